@@ -1,19 +1,35 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 import datetime
+import math
+import re
 import base64
-import urllib.parse
-import urllib.request
 from streamlit_option_menu import option_menu
 import textwrap
 import hashlib
 import random
 import time
 import json
+import threading
+import io
+import zipfile
+import multiprocessing
 import uuid
-from supabase import create_client, Client
+import pickle
+import csv
+import os
+import sqlite3
+import httpx
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from abc import ABC, abstractmethod
+from PIL import Image, ImageOps
+import segno
+from supabase import create_client, ClientOptions
+from fake_supabase import FakeSupabaseClient
+from laudo_pdf import render_report_pdf
 
 # ==============================================================================
 # 1. CONFIGURAÇÃO E CONEXÃO SUPABASE
@@ -25,28 +41,210 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Acesso gerenciado ao banco: um único cliente por processo (pool HTTP keep-alive compartilhado
+# por todas as sessões), com prazo por chamada, novas tentativas com backoff e disjuntor.
+DB_TIMEOUT_SECONDS = 15
+DB_CONNECT_TIMEOUT_SECONDS = 5
+DB_MAX_ATTEMPTS = 3
+DB_BACKOFF_SECONDS = 0.25
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_SECONDS = 30
+
+# Falhas de infraestrutura (gateway, PostgREST sem conexão com o Postgres, statement timeout).
+# Erros de aplicação (4xx, violação de chave, RPC inexistente) sobem direto, sem nova tentativa.
+TRANSIENT_DB_CODES = {"500", "502", "503", "504", "520", "522", "524", "57014", "PGRST000", "PGRST001", "PGRST002", "PGRST003"}
+# Falhas em que a requisição comprovadamente não chegou ao servidor (seguro repetir até escritas)
+UNSENT_REQUEST_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+class BackendUnavailable(Exception):
+    """Disjuntor aberto: o banco está instável e a chamada nem chega a ser enviada."""
+
+def is_transient_db_error(e):
+    if isinstance(e, httpx.TransportError):
+        return True
+    return str(getattr(e, 'code', '') or '') in TRANSIENT_DB_CODES
+
+class GuardedQuery:
+    """
+    Envolve a cadeia de filtros do supabase-py: repassa cada chamada e intercepta apenas o execute(),
+    que passa pelo cliente gerenciado. Escritas (insert/update/upsert/delete/rpc) não são repetidas
+    após um erro de rede ambíguo, para não duplicar gravações.
+    """
+    WRITE_METHODS = {'insert', 'update', 'upsert', 'delete'}
+    
+    def __init__(self, manager, builder, table, op='select'):
+        self._manager = manager
+        self._builder = builder
+        self._table = table
+        self._op = op
+        
+    def __getattr__(self, name):
+        attr = getattr(self._builder, name)
+        if name == 'execute':
+            return lambda: self._manager.execute(f"{self._table}.{self._op}", attr, idempotent=self._op == 'select')
+        if not callable(attr):
+            # Propriedades como `not_` devolvem o próprio builder
+            return GuardedQuery(self._manager, attr, self._table, self._op) if hasattr(attr, 'execute') else attr
+        
+        def chained(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            if hasattr(result, 'execute'):
+                return GuardedQuery(self._manager, result, self._table, name if name in self.WRITE_METHODS else self._op)
+            return result
+        return chained
+
+class ManagedSupabaseClient:
+    """
+    Cliente de dados compartilhado pelo processo, com a mesma interface usada no app
+    (supabase.table(...)....execute() e supabase.rpc(...).execute()).
+    Cada execute() é medido; falhas transitórias são repetidas com backoff exponencial e,
+    após CIRCUIT_FAILURE_THRESHOLD falhas seguidas, o disjuntor abre por CIRCUIT_RESET_SECONDS
+    (as chamadas falham na hora com BackendUnavailable). Passado o prazo, a próxima chamada
+    testa o banco: sucesso fecha o disjuntor, nova falha o reabre.
+    """
+    def __init__(self, client):
+        self._client = client
+        self.lock = threading.Lock()
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.circuit_opens = 0
+        self.last_error = None
+        self.metrics = {}
+        
+    def table(self, name):
+        return GuardedQuery(self, self._client.table(name), name)
+    
+    def rpc(self, fn, params=None, **kwargs):
+        return GuardedQuery(self, self._client.rpc(fn, params or {}, **kwargs), f"rpc:{fn}", op='call')
+    
+    def is_open(self):
+        return self.opened_at is not None and time.monotonic() - self.opened_at < CIRCUIT_RESET_SECONDS
+    
+    def _metric(self, label):
+        return self.metrics.setdefault(label, {"chamadas": 0, "erros": 0, "novas_tentativas": 0, "bloqueadas": 0, "tempo_total_ms": 0.0, "tempo_max_ms": 0.0})
+    
+    def _record(self, label, elapsed, error=None, transient=False):
+        with self.lock:
+            m = self._metric(label)
+            m["chamadas"] += 1
+            m["tempo_total_ms"] += elapsed * 1000
+            m["tempo_max_ms"] = max(m["tempo_max_ms"], elapsed * 1000)
+            if error is None:
+                self.consecutive_failures = 0
+                self.opened_at = None
+                return
+            m["erros"] += 1
+            self.last_error = f"{datetime.datetime.now().strftime('%d/%m/%Y %H:%M:%S')} | {label} | {type(error).__name__}: {error}"
+            if transient:
+                self.consecutive_failures += 1
+                if self.consecutive_failures >= CIRCUIT_FAILURE_THRESHOLD:
+                    if self.opened_at is None:
+                        self.circuit_opens += 1
+                    self.opened_at = time.monotonic()
+    
+    def execute(self, label, execute_fn, idempotent=True):
+        with self.lock:
+            if self.is_open():
+                self._metric(label)["bloqueadas"] += 1
+                raise BackendUnavailable(f"Banco de dados indisponível (disjuntor aberto): {label}")
+            
+        for attempt in range(DB_MAX_ATTEMPTS):
+            started = time.perf_counter()
+            try:
+                result = execute_fn()
+            except Exception as e:
+                transient = is_transient_db_error(e)
+                self._record(label, time.perf_counter() - started, error=e, transient=transient)
+                retryable = transient and (idempotent or isinstance(e, UNSENT_REQUEST_ERRORS))
+                if not retryable or attempt + 1 >= DB_MAX_ATTEMPTS or self.is_open():
+                    raise
+                with self.lock:
+                    self._metric(label)["novas_tentativas"] += 1
+                time.sleep(DB_BACKOFF_SECONDS * (2 ** attempt) * (0.5 + random.random()))
+                continue
+            self._record(label, time.perf_counter() - started)
+            return result
+    
+    def metrics_rows(self):
+        """Tabela de métricas por operação (tabela.operação) para o painel de diagnóstico."""
+        with self.lock:
+            return [
+                {
+                    "Operação": label,
+                    "Chamadas": m["chamadas"],
+                    "Erros": m["erros"],
+                    "Novas Tentativas": m["novas_tentativas"],
+                    "Bloqueadas (Disjuntor)": m["bloqueadas"],
+                    "Latência Média (ms)": round(m["tempo_total_ms"] / m["chamadas"], 1) if m["chamadas"] else 0.0,
+                    "Latência Máx. (ms)": round(m["tempo_max_ms"], 1)
+                }
+                for label, m in sorted(self.metrics.items())
+            ]
+
+@st.cache_resource
+def get_supabase_client(url, key):
+    """Cria o cliente uma única vez por processo; os reruns e as novas sessões reaproveitam as conexões abertas."""
+    options = ClientOptions(postgrest_client_timeout=httpx.Timeout(DB_TIMEOUT_SECONDS, connect=DB_CONNECT_TIMEOUT_SECONDS))
+    return ManagedSupabaseClient(create_client(url, key, options=options))
+
+@st.cache_resource
+def get_fake_supabase_client(path, latency_ms):
+    """Backend falso em processo (fake_supabase.py), para benchmarks e testes de carga sem rede."""
+    return ManagedSupabaseClient(FakeSupabaseClient(path, latency_ms=latency_ms))
+
+def fake_backend_config():
+    """
+    O backend falso é ativado por ELO_FAKE_SUPABASE=<arquivo SQLite ou :memory:> (latência em
+    ELO_FAKE_LATENCY_MS) ou por fake_path / fake_latency_ms na seção [supabase] dos secrets.
+    """
+    if os.environ.get("ELO_FAKE_SUPABASE"):
+        return os.environ["ELO_FAKE_SUPABASE"], float(os.environ.get("ELO_FAKE_LATENCY_MS", 0))
+    try:
+        conf = st.secrets["supabase"]
+        if conf.get("fake_path"):
+            return conf["fake_path"], float(conf.get("fake_latency_ms", 0))
+    except Exception:
+        pass
+    return None
+
+# Motivo da falha ao criar o cliente (mesmo formato de last_error), exibido no diagnóstico das Configurações
+DB_CONNECT_ERROR = None
 try:
-    SUPABASE_URL = st.secrets["supabase"]["url"]
-    SUPABASE_KEY = st.secrets["supabase"]["key"]
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    FAKE_BACKEND = fake_backend_config()
+    if FAKE_BACKEND:
+        supabase = get_fake_supabase_client(*FAKE_BACKEND)
+    else:
+        SUPABASE_URL = st.secrets["supabase"]["url"]
+        SUPABASE_KEY = st.secrets["supabase"]["key"]
+        supabase = get_supabase_client(SUPABASE_URL, SUPABASE_KEY)
     DB_CONNECTED = True
 except Exception as e:
     DB_CONNECTED = False
+    DB_CONNECT_ERROR = f"{datetime.datetime.now().strftime('%d/%m/%Y %H:%M:%S')} | conexão | {type(e).__name__}: {e}"
+
+def query_platform_settings():
+    """Leitura direta (sem cache) do config_json salvo em platform_settings."""
+    res = supabase.table('platform_settings').select('config_json').limit(1).execute()
+    if res.data and len(res.data) > 0:
+        return res.data[0].get('config_json') or {}
+    return {}
+
+@st.cache_data(ttl=60, show_spinner=False)
+def fetch_platform_settings():
+    """Cache curto compartilhado entre sessões: uma nova sessão não paga a ida ao banco para as configurações."""
+    return query_platform_settings()
 
 def get_saved_settings():
     """Recupera as configurações de identidade visual e URL salvas no banco de dados."""
     default_conf = {
         "name": "Elo NR-01",
         "consultancy": "Pessin Gestão e Desenvolvimento Humano",
-        "logo_b64": None,
+        "logo_ref": None,
         "base_url": "https://elonr01-cris.streamlit.app" 
     }
     if DB_CONNECTED:
         try:
-            res = supabase.table('platform_settings').select('config_json').execute()
-            if res.data and len(res.data) > 0:
-                db_conf = res.data[0].get('config_json', {})
-                default_conf.update(db_conf)
+            default_conf.update(fetch_platform_settings())
         except Exception:
             pass
     return default_conf
@@ -261,21 +459,10 @@ if st.session_state.acoes_list is None:
 if st.session_state.user_credits is None: 
     st.session_state.user_credits = 0
 
-# Mock inicial (Apenas como Fail-Safe)
+# Cópia em sessão dos usuários lidos do banco (o modo local usa o armazenamento embutido, seção 4.6).
+# Sem banco, o acesso Master padrão (fail-safe) existe apenas em memória, nunca gravado em disco.
 if 'users_db' not in st.session_state:
-    st.session_state.users_db = {
-        "admin": {
-            "password": "admin", 
-            "role": "Master", 
-            "credits": 999999
-        }
-    }
-
-if 'companies_db' not in st.session_state:
-    st.session_state.companies_db = []
-
-if 'local_responses_db' not in st.session_state:
-    st.session_state.local_responses_db = []
+    st.session_state.users_db = {} if DB_CONNECTED else {"admin": {"password": "admin", "role": "Master", "credits": 999999}}
 
 # LISTA COMPLETA HSE 35 PERGUNTAS (EXPANDIDA PARA MANUTENÇÃO)
 if 'hse_questions' not in st.session_state:
@@ -510,9 +697,10 @@ if 'hse_questions' not in st.session_state:
 # 4. FUNÇÕES DE CÁLCULO E BANCO DE DADOS
 # ==============================================================================
 def get_logo_html(width=180):
-    """Retorna a tag de imagem com a logo codificada em Base64 ou SVG padrão."""
-    if st.session_state.platform_config['logo_b64']:
-        return f'<img src="data:image/png;base64,{st.session_state.platform_config["logo_b64"]}" width="{width}">'
+    """Retorna a tag de imagem com a logo da plataforma (repositório de ativos) ou o SVG padrão."""
+    logo_uri = logo_data_uri(st.session_state.platform_config)
+    if logo_uri:
+        return f'<img src="{logo_uri}" width="{width}">'
     
     svg = f"""
     <svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 400 120" width="{width}">
@@ -533,63 +721,146 @@ def get_logo_html(width=180):
     b64 = base64.b64encode(svg.encode("utf-8")).decode("utf-8")
     return f'<img src="data:image/svg+xml;base64,{b64}">'
 
-def image_to_base64(file):
-    """Converte arquivo de imagem de upload para Base64 string."""
-    try: 
-        return base64.b64encode(file.getvalue()).decode() if file else None
-    except: 
-        return None
-
 def logout(): 
     st.session_state.logged_in = False
     st.rerun()
 
-def calculate_actual_scores(all_responses, hse_questions):
+# ==============================================================================
+# MOTOR VETORIZADO DE PONTUAÇÃO (NUMPY)
+# ==============================================================================
+# Posição de cada rótulo na régua Likert (1 = extremo esquerdo, 5 = extremo direito).
+# As duas réguas usadas no questionário compartilham as mesmas posições.
+LIKERT_CODES = {
+    "Nunca": 1, "Raramente": 2, "Às vezes": 3, "Frequentemente": 4, "Sempre": 5,
+    "Discordo Totalmente": 1, "Discordo": 2, "Neutro": 3, "Concordo": 4, "Concordo Totalmente": 5
+}
+MISSING_CODE = 0  # Sentinela de "sem resposta" na matriz uint8
+
+# Formato compacto da coluna responses.answers: {"v": 2, "a": {"<id da pergunta>": <posição 1..5>}}
+# Linhas antigas (sem "v") continuam no formato legado, com o texto da pergunta e o rótulo por extenso.
+COMPACT_ANSWERS_VERSION = 2
+VALID_ANSWER_CODES = {1: 1, 2: 2, 3: 3, 4: 4, 5: 5}
+
+def build_question_index(hse_questions):
+    """
+    Achata o questionário em vetores alinhados às colunas da matriz de respostas:
+    texto, id, índice da dimensão e a flag de inversão (rev) de cada pergunta.
+    """
+    categories = list(hse_questions.keys())
+    texts, ids, cat_idx, rev = [], [], [], []
+    for ci, (cat, qs) in enumerate(hse_questions.items()):
+        for q in qs:
+            texts.append(q['q'])
+            ids.append(q['id'])
+            cat_idx.append(ci)
+            rev.append(bool(q.get('rev', False)))
+    return {
+        "categories": categories,
+        "texts": texts,
+        "ids": np.array(ids, dtype=np.int64),
+        "id_keys": [str(i) for i in ids],
+        "cat_idx": np.array(cat_idx, dtype=np.int64),
+        "rev": np.array(rev, dtype=bool)
+    }
+
+def read_answer_codes(answers, qindex):
+    """
+    Leitor único das respostas: devolve a posição Likert (ou MISSING_CODE) de cada coluna do
+    questionário, tanto para o formato compacto por id quanto para o legado por texto.
+    """
+    answers = answers or {}
+    if answers.get('v') == COMPACT_ANSWERS_VERSION:
+        compact = answers.get('a') or {}
+        return [VALID_ANSWER_CODES.get(compact.get(k), MISSING_CODE) for k in qindex['id_keys']]
+    return [LIKERT_CODES.get(answers.get(t), MISSING_CODE) for t in qindex['texts']]
+
+def compact_answers(answers, hse_questions):
+    """Converte respostas (legadas ou já compactas) para o formato compacto por id de pergunta."""
+    qindex = build_question_index(hse_questions)
+    codes = read_answer_codes(answers, qindex)
+    return {
+        "v": COMPACT_ANSWERS_VERSION,
+        "a": {k: code for k, code in zip(qindex['id_keys'], codes) if code != MISSING_CODE}
+    }
+
+def encode_answers_matrix(responses, qindex):
+    """
+    Codifica todas as respostas uma única vez numa matriz compacta
+    (respondentes x perguntas, uint8), com MISSING_CODE onde não há resposta válida.
+    Linhas que já chegam enxutas (campo _codes, ver slim_scored_rows) são copiadas sem decodificar.
+    """
+    flat = bytearray()
+    for r in responses:
+        packed = r.get('_codes')
+        flat.extend(packed if packed is not None else read_answer_codes(r.get('answers'), qindex))
+    return np.frombuffer(flat, dtype=np.uint8).reshape(len(responses), len(qindex['texts']))
+
+def likert_values(codes, qindex):
+    """Converte códigos em notas 1..5, invertendo as perguntas negativas (rev=True) com 6 - código."""
+    values = np.where(qindex['rev'], 6 - codes.astype(np.int16), codes.astype(np.int16))
+    values[codes == MISSING_CODE] = 0
+    return values
+
+def analytics_from_sums(q_sums, q_counts, qindex):
+    """
+    Converte somas e contagens por pergunta nas métricas do laudo:
+    médias dimensionais, score global e o percentual de risco por pergunta.
+    Os arredondamentos seguem exatamente as regras históricas do sistema.
+    """
+    n_cats = len(qindex['categories'])
+    dim_sums = np.bincount(qindex['cat_idx'], weights=q_sums, minlength=n_cats)
+    dim_counts = np.bincount(qindex['cat_idx'], weights=q_counts, minlength=n_cats)
+    
+    # Médias Dimensionais
+    dim_averages = {}
+    for ci, cat in enumerate(qindex['categories']):
+        n = int(dim_counts[ci])
+        dim_averages[cat] = round(int(dim_sums[ci]) / n, 1) if n > 0 else 0.0
+    
+    # Raio-X: Nota 5.0 (Perfeito) = 0% de Risco. Nota 1.0 (Péssimo) = 100% de Risco.
+    detalhe_percent = {}
+    for qt, soma, total in zip(qindex['texts'], q_sums.tolist(), q_counts.tolist()):
+        if total > 0:
+            avg_q = int(soma) / int(total)
+            detalhe_percent[qt] = int(((5.0 - avg_q) / 4.0) * 100)
+    
+    # Media global da empresa baseada apenas nas dimensões válidas
+    vals_validos = [v for v in dim_averages.values() if v > 0]
+    score = round(sum(vals_validos) / len(vals_validos), 1) if vals_validos else 0
+    return dim_averages, score, detalhe_percent
+
+def calculate_actual_scores(all_responses, hse_questions, codes=None):
     """
     Calcula os scores reais baseados nas respostas dos colaboradores.
     Aplica inversão de nota caso a pergunta seja negativa (rev=True).
     """
-    for resp_row in all_responses:
-        ans_dict = resp_row.get('answers', {})
-        total_score = 0
-        count_valid = 0
-        
-        for cat, qs in hse_questions.items():
-            for q in qs:
-                q_text = q['q']
-                is_rev = q.get('rev', False)
-                user_ans = ans_dict.get(q_text)
-                
-                if user_ans:
-                    val = None
-                    if user_ans in ["Nunca", "Raramente", "Às vezes", "Frequentemente", "Sempre"]:
-                        # Se a pergunta é negativa (rev=True), Nunca = Bom(5). Se positiva, Sempre = Bom(5).
-                        if is_rev: 
-                            val = {"Nunca": 5, "Raramente": 4, "Às vezes": 3, "Frequentemente": 2, "Sempre": 1}.get(user_ans)
-                        else: 
-                            val = {"Nunca": 1, "Raramente": 2, "Às vezes": 3, "Frequentemente": 4, "Sempre": 5}.get(user_ans)
-                    
-                    elif user_ans in ["Discordo Totalmente", "Discordo", "Neutro", "Concordo", "Concordo Totalmente"]:
-                        if is_rev: 
-                            val = {"Discordo Totalmente": 5, "Discordo": 4, "Neutro": 3, "Concordo": 2, "Concordo Totalmente": 1}.get(user_ans)
-                        else: 
-                            val = {"Discordo Totalmente": 1, "Discordo": 2, "Neutro": 3, "Concordo": 4, "Concordo Totalmente": 5}.get(user_ans)
-
-                    if val is not None:
-                        total_score += val
-                        count_valid += 1
-                        
-        # Armazena o score calculado daquele individuo especifico na linha
+    if not all_responses:
+        return all_responses
+    
+    qindex = build_question_index(hse_questions)
+    if codes is None:
+        codes = encode_answers_matrix(all_responses, qindex)
+    values = likert_values(codes, qindex)
+    totals = values.sum(axis=1).tolist()
+    counts = (codes != MISSING_CODE).sum(axis=1).tolist()
+    
+    # Armazena o score calculado daquele individuo especifico na linha
+    for resp_row, total_score, count_valid in zip(all_responses, totals, counts):
         resp_row['score_calculado'] = round(total_score / count_valid, 2) if count_valid > 0 else 0
     
     return all_responses
 
-def process_company_analytics(comp, comp_resps, hse_questions):
+def process_company_analytics(comp, comp_resps, hse_questions, codes=None, aggregates=None):
     """
     Gera as médias dimensionais e o Raio-X com base em dados concretos (respostas do DB).
     [NOVO CÁLCULO DE RISCO MATEMÁTICO NORMALIZADO (Fim do 0% falso)]
+    Com `aggregates` (linhas de response_aggregates) o cálculo lê apenas somas e contagens por pergunta.
     """
-    comp['respondidas'] = len(comp_resps)
+    qindex = build_question_index(hse_questions)
+    if aggregates is not None:
+        q_sums, q_counts, comp['respondidas'], _ = aggregates_to_sums(aggregates, qindex)
+    else:
+        comp['respondidas'] = len(comp_resps)
     
     if comp['respondidas'] == 0:
         comp['score'] = 0
@@ -597,148 +868,1226 @@ def process_company_analytics(comp, comp_resps, hse_questions):
         comp['detalhe_perguntas'] = {}
         return comp
 
-    dimensoes_totais = {cat: [] for cat in hse_questions.keys()}
-    soma_por_pergunta = {} 
-    total_por_pergunta = {}
-
-    for resp_row in comp_resps:
-        ans_dict = resp_row.get('answers', {})
-        
-        for cat, qs in hse_questions.items():
-            for q in qs:
-                q_text = q['q']
-                is_rev = q.get('rev', False)
-                user_ans = ans_dict.get(q_text)
-                
-                if user_ans:
-                    val = None
-                    if user_ans in ["Nunca", "Raramente", "Às vezes", "Frequentemente", "Sempre"]:
-                        if is_rev: 
-                            val = {"Nunca": 5, "Raramente": 4, "Às vezes": 3, "Frequentemente": 2, "Sempre": 1}.get(user_ans)
-                        else: 
-                            val = {"Nunca": 1, "Raramente": 2, "Às vezes": 3, "Frequentemente": 4, "Sempre": 5}.get(user_ans)
-                    
-                    elif user_ans in ["Discordo Totalmente", "Discordo", "Neutro", "Concordo", "Concordo Totalmente"]:
-                        if is_rev: 
-                            val = {"Discordo Totalmente": 5, "Discordo": 4, "Neutro": 3, "Concordo": 2, "Concordo Totalmente": 1}.get(user_ans)
-                        else: 
-                            val = {"Discordo Totalmente": 1, "Discordo": 2, "Neutro": 3, "Concordo": 4, "Concordo Totalmente": 5}.get(user_ans)
-
-                    if val is not None:
-                        dimensoes_totais[cat].append(val)
-                        
-                        if q_text not in soma_por_pergunta:
-                            soma_por_pergunta[q_text] = 0
-                            total_por_pergunta[q_text] = 0
-                            
-                        total_por_pergunta[q_text] += 1
-                        soma_por_pergunta[q_text] += val
+    if aggregates is None:
+        if codes is None:
+            codes = encode_answers_matrix(comp_resps, qindex)
+        values = likert_values(codes, qindex)
+        q_sums = values.sum(axis=0)
+        q_counts = (codes != MISSING_CODE).sum(axis=0)
+    
+    comp['dimensoes'], comp['score'], comp['detalhe_perguntas'] = analytics_from_sums(q_sums, q_counts, qindex)
+    return comp
 
-    # Médias Dimensionais
-    dim_averages = {}
-    for cat, vals in dimensoes_totais.items():
-        dim_averages[cat] = round(sum(vals) / len(vals), 1) if vals else 0.0
+def group_sums_by_key(keys, n_groups, codes, qindex):
+    """
+    Agrupamento por ordenação: soma de notas e contagem de respostas válidas por (grupo, pergunta),
+    mais o número de respondentes de cada grupo. Linhas com chave negativa são ignoradas.
+    """
+    n_q = len(qindex['texts'])
+    q_sums = np.zeros((n_groups, n_q), dtype=np.int64)
+    q_counts = np.zeros((n_groups, n_q), dtype=np.int64)
+    
+    known = keys >= 0
+    keys, codes = keys[known], codes[known]
+    respondents = np.bincount(keys, minlength=n_groups)
+    if len(keys) == 0:
+        return q_sums, q_counts, respondents
+    
+    order = np.argsort(keys, kind='stable')
+    keys_sorted = keys[order]
+    codes_sorted = codes[order]
+    groups, starts = np.unique(keys_sorted, return_index=True)
+    q_sums[groups] = np.add.reduceat(likert_values(codes_sorted, qindex).astype(np.int64), starts, axis=0)
+    q_counts[groups] = np.add.reduceat((codes_sorted != MISSING_CODE).astype(np.int64), starts, axis=0)
+    return q_sums, q_counts, respondents
 
-    # CÁLCULO PRECISO DO RAIO-X DE RISCO
-    # A fórmula agora reflete a nota real: Nota 5.0 (Perfeito) = 0% de Risco. Nota 1.0 (Péssimo) = 100% de Risco.
-    detalhe_percent = {}
-    for qt, soma in soma_por_pergunta.items():
-        total = total_por_pergunta[qt]
-        avg_q = soma / total if total > 0 else 0
-        if total > 0:
-            risco = ((5.0 - avg_q) / 4.0) * 100
-            detalhe_percent[qt] = int(risco)
+def process_all_companies_analytics(companies, all_answers, hse_questions, codes=None):
+    """
+    Calcula dimensoes, score e detalhe_perguntas de todas as empresas de uma só vez.
+    As respostas são particionadas por empresa numa única passada (índice hash id -> grupo
+    e agrupamento por ordenação), no lugar de um filtro completo da lista por empresa.
+    """
+    qindex = build_question_index(hse_questions)
+    if codes is None:
+        codes = encode_answers_matrix(all_answers, qindex)
+    
+    group_of = {}
+    for c in companies:
+        group_of.setdefault(str(c['id']), len(group_of))
+    keys = np.fromiter((group_of.get(str(r.get('company_id')), -1) for r in all_answers), dtype=np.int64, count=len(all_answers))
+    q_sums, q_counts, respondents = group_sums_by_key(keys, len(group_of), codes, qindex)
+    
+    for c in companies:
+        g = group_of[str(c['id'])]
+        c['respondidas'] = int(respondents[g])
+        if c['respondidas'] == 0:
+            c['score'] = 0
+            c['dimensoes'] = {cat: 0 for cat in hse_questions.keys()}
+            c['detalhe_perguntas'] = {}
         else:
-            detalhe_percent[qt] = None # Flag para "Nenhuma resposta"
+            c['dimensoes'], c['score'], c['detalhe_perguntas'] = analytics_from_sums(q_sums[g], q_counts[g], qindex)
+    return companies
+
+# Projeção de colunas enviada ao PostgREST: o painel só trafega o que de fato utiliza
+# (os campos analíticos score/dimensoes/detalhe_perguntas são recalculados localmente).
+COMPANY_COLUMNS = "id, razao, cnpj, cnae, setor, risco, func, limit_evals, segmentacao, resp, email, telefone, endereco, valid_until, logo_ref, owner, org_structure"
+RESPONSE_COLUMNS = "id, company_id, setor, answers, created_at"
+USER_COLUMNS = "username, password, role, credits, valid_until, linked_company_id"
+ASSET_COLUMNS = "hash, mime, width, height, data"
+
+# Tamanho máximo da lista enviada no filtro IN (mantém a URL do PostgREST em tamanho seguro)
+IN_FILTER_CHUNK = 150
+
+# Linhas por página na leitura das respostas (não deve passar do max-rows do PostgREST, 1000 no Supabase)
+RESPONSE_PAGE_SIZE = 1000
+
+def get_user_scope():
+    """
+    Monta o escopo de visibilidade do usuário logado.
+    Master enxerga tudo, Gestor apenas as empresas que possui e Analista somente a empresa vinculada.
+    """
+    perm = st.session_state.admin_permission
+    if perm == "Gestor":
+        return {"perm": perm, "owner": st.session_state.user_username, "company_id": None}
+    if perm == "Analista":
+        return {"perm": perm, "owner": None, "company_id": st.session_state.user_linked_company}
+    return {"perm": "Master", "owner": None, "company_id": None}
+
+def filter_companies_by_scope(companies, scope):
+    """Aplica em memória o mesmo filtro de permissão que é empurrado para o banco."""
+    if scope['perm'] == "Gestor":
+        return [c for c in companies if c.get('owner') == scope['owner']]
+    if scope['perm'] == "Analista":
+        return [c for c in companies if c['id'] == scope['company_id']]
+    return companies
+
+def fetch_scoped_companies(scope):
+    """Busca no Supabase apenas as empresas visíveis ao escopo, com projeção de colunas."""
+    if scope['perm'] == "Analista" and not scope['company_id']:
+        return []
+    query = supabase.table('companies').select(COMPANY_COLUMNS)
+    if scope['perm'] == "Gestor":
+        query = query.eq('owner', scope['owner'])
+    elif scope['perm'] == "Analista":
+        query = query.eq('id', scope['company_id'])
+    return query.execute().data
+
+def iter_response_pages(company_ids=None, after_id=None, page_size=RESPONSE_PAGE_SIZE):
+    """
+    Gerador de páginas de respostas com paginação por chave (keyset): cada requisição pede
+    `id > último id da página anterior`, ordenado por id, então o custo por página não cresce
+    com o tamanho da tabela (ao contrário de OFFSET) e nenhuma consulta esbarra no limite de
+    linhas do PostgREST. Uma página menor que `page_size` não encerra a leitura (o max-rows do
+    servidor pode ser menor que ela): só uma página vazia encerra.
+    Apenas uma página de JSON bruto fica em memória por vez.
+    company_ids=None lê a tabela inteira; com uma lista, o filtro IN é enviado em lotes.
+    Com `after_id`, a leitura começa depois desse id (sincronização incremental).
+    """
+    chunks = [None] if company_ids is None else [company_ids[i:i + IN_FILTER_CHUNK] for i in range(0, len(company_ids), IN_FILTER_CHUNK)]
+    for chunk in chunks:
+        last_id = after_id
+        while True:
+            query = supabase.table('responses').select(RESPONSE_COLUMNS)
+            if chunk is not None:
+                query = query.in_('company_id', chunk)
+            if last_id is not None:
+                query = query.gt('id', last_id)
+            page = query.order('id').limit(page_size).execute().data
+            if not page:
+                break
+            last_id = page[-1]['id']
+            yield page
 
-    comp['dimensoes'] = dim_averages
+def iter_scoped_response_pages(scope, company_ids, after_id=None):
+    """Páginas de respostas do escopo: Master lê a tabela sem filtro, os demais perfis filtram por empresa."""
+    return iter_response_pages(None if scope['perm'] == "Master" else company_ids, after_id)
+
+def count_scoped_responses(scope, company_ids):
+    """Conta as respostas do escopo no servidor (requisição HEAD, sem trafegar linhas)."""
+    if scope['perm'] == "Master":
+        return supabase.table('responses').select('id', count='exact', head=True).execute().count or 0
     
-    # Media global da empresa baseada apenas nas dimensões válidas
-    vals_validos = [v for v in dim_averages.values() if v > 0]
-    comp['score'] = round(sum(vals_validos) / len(vals_validos), 1) if vals_validos else 0
-    comp['detalhe_perguntas'] = detalhe_percent
+    total = 0
+    for i in range(0, len(company_ids), IN_FILTER_CHUNK):
+        chunk = company_ids[i:i + IN_FILTER_CHUNK]
+        total += supabase.table('responses').select('id', count='exact', head=True).in_('company_id', chunk).execute().count or 0
+    return total
+
+def build_company_analytics(companies, all_answers, hse_questions, score_rows=True):
+    """
+    Calcula os scores individuais e o analítico de cada empresa (etapa pura, sem acesso ao banco).
+    Use score_rows=False quando as respostas já chegam pontuadas (ex: vindas da sincronização incremental).
+    """
+    # Codificação única da matriz de respostas, compartilhada pelas duas etapas
+    codes = encode_answers_matrix(all_answers, build_question_index(hse_questions))
+    if score_rows:
+        all_answers = calculate_actual_scores(all_answers, hse_questions, codes=codes)
     
-    return comp
+    for c in companies:
+        if 'org_structure' not in c or not c['org_structure']: 
+            c['org_structure'] = {"Geral": ["Geral"]}
+            
+    companies = process_all_companies_analytics(companies, all_answers, hse_questions, codes=codes)
+    return companies, all_answers
+
+def slim_scored_rows(rows, hse_questions):
+    """
+    Pontua um lote de respostas e troca o JSON bruto de `answers` pelos códigos uint8
+    já codificados (campo _codes, um byte por pergunta). Depois disso o lote ocupa uma
+    fração da memória e continua legível por encode_answers_matrix.
+    """
+    codes = encode_answers_matrix(rows, build_question_index(hse_questions))
+    calculate_actual_scores(rows, hse_questions, codes=codes)
+    for r, row_codes in zip(rows, codes):
+        r['_codes'] = row_codes.tobytes()
+        r.pop('answers', None)
+    return rows
 
-def load_data_from_db():
+# ==============================================================================
+# 4.1 CACHE ANALÍTICO COMPARTILHADO ENTRE SESSÕES (TTL + VERSÃO DOS DADOS)
+# ==============================================================================
+CACHE_TTL_SECONDS = 300
+CACHE_MAX_ENTRIES = 256
+
+@st.cache_resource
+def get_data_version_registry():
+    """Registro único por processo (compartilhado por todas as sessões) da versão atual dos dados."""
+    return {"version": 0, "lock": threading.Lock()}
+
+def get_data_version():
+    return get_data_version_registry()["version"]
+
+def invalidate_data_cache():
+    """
+    Deve ser chamada após toda escrita no banco (empresas, setores, respostas, usuários).
+    Ao incrementar a versão, as entradas de cache das versões anteriores deixam de ser lidas
+    e expiram sozinhas pelo TTL.
+    """
+    registry = get_data_version_registry()
+    with registry["lock"]:
+        registry["version"] += 1
+
+# Leituras independentes do carregamento do painel rodam em paralelo, cada uma com seu prazo
+# máximo de espera (segundos). A sincronização das respostas pode paginar a tabela inteira.
+FETCH_WORKERS = 16
+QUERY_TIMEOUTS = {"companies": 15, "responses": 120, "users": 15}
+
+@st.cache_resource
+def get_fetch_executor():
+    """Pool de threads único do processo para as consultas do carregamento (compartilhado pelas sessões)."""
+    return ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="elo-fetch")
+
+def fetch_users():
+    return supabase.table('admin_users').select(USER_COLUMNS).execute().data
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_scoped_dataset(scope, data_version, hse_questions):
+    """
+    Leitura do Supabase + cálculo analítico completo do escopo, guardados em cache.
+    A chave é (escopo do usuário, versão dos dados), então trocar um selectbox não
+    refaz as consultas nem o recálculo dos scores.
+    Empresas, respostas e usuários são buscados ao mesmo tempo, então a latência fica próxima
+    da consulta mais lenta e não da soma de todas. Só o Gestor precisa esperar a lista de
+    empresas para filtrar as respostas; Master lê tudo e o Analista já conhece sua empresa.
+    As configurações da plataforma ficam fora deste cache (fetch_platform_settings), pois são
+    salvas sem mudar a versão dos dados.
+    Retorna (empresas, respostas, usuários).
+    """
+    executor = get_fetch_executor()
+    store = get_response_store()
+    
+    f_companies = executor.submit(fetch_scoped_companies, scope)
+    # A base de usuários só é necessária para o Master (gestão de acessos)
+    f_users = executor.submit(fetch_users) if scope['perm'] == "Master" else None
+    f_answers = None
+    if scope['perm'] != "Gestor":
+        known_ids = [scope['company_id']] if scope['perm'] == "Analista" and scope['company_id'] else []
+        f_answers = executor.submit(sync_scoped_responses, scope, known_ids, hse_questions, store)
+    
+    companies = f_companies.result(timeout=QUERY_TIMEOUTS["companies"])
+    if f_answers is None:
+        all_answers = sync_scoped_responses(scope, [c['id'] for c in companies], hse_questions, store)
+    else:
+        all_answers = f_answers.result(timeout=QUERY_TIMEOUTS["responses"])
+    users_raw = f_users.result(timeout=QUERY_TIMEOUTS["users"]) if f_users else []
+        
+    companies, all_answers = build_company_analytics(companies, all_answers, hse_questions, score_rows=False)
+    return companies, all_answers, users_raw
+
+@st.cache_resource
+def get_last_good_snapshots():
+    """Último dataset carregado com sucesso por escopo, servido enquanto o banco estiver instável."""
+    return {"scopes": {}, "lock": threading.Lock()}
+
+def remember_last_good_dataset(scope, data_version, dataset):
+    """Guarda (serializado) o dataset do escopo; só regrava quando a versão dos dados muda."""
+    snapshots = get_last_good_snapshots()
+    key = scope_to_key(scope)
+    with snapshots["lock"]:
+        current = snapshots["scopes"].get(key)
+        if current is not None and current[0] == data_version:
+            return
+        snapshots["scopes"].pop(key, None)
+        if len(snapshots["scopes"]) >= MAX_SYNC_SCOPES:
+            snapshots["scopes"].pop(next(iter(snapshots["scopes"])))
+        snapshots["scopes"][key] = (data_version, pickle.dumps(dataset, protocol=pickle.HIGHEST_PROTOCOL))
+
+def restore_last_good_dataset(scope):
+    """Devolve (versão, dataset) do último carregamento bem-sucedido do escopo, ou None."""
+    snapshots = get_last_good_snapshots()
+    with snapshots["lock"]:
+        current = snapshots["scopes"].get(scope_to_key(scope))
+    if current is None:
+        return None
+    return current[0], pickle.loads(current[1])
+
+def load_data_from_db(scope=None):
     """
     Função principal que puxa dados do Supabase e sincroniza.
+    O filtro de permissão (owner, empresa vinculada, lista de empresas) e a projeção
+    de colunas são resolvidos na própria consulta, então o volume trafegado
+    acompanha apenas o que o usuário logado pode ver.
     """
+    if scope is None:
+        scope = get_user_scope()
+        
     all_answers = []
     companies = []
+    st.session_state.dataset_cache_key = None
+    st.session_state.data_stale = False
     
     if DB_CONNECTED:
         try:
-            companies = supabase.table('companies').select("*").execute().data
-            all_answers = supabase.table('responses').select("*").execute().data
-            
-            users_raw = supabase.table('admin_users').select("*").execute().data
+            data_version = get_data_version()
+            dataset = load_scoped_dataset(scope, data_version, st.session_state.hse_questions)
+            remember_last_good_dataset(scope, data_version, dataset)
+        except Exception:
+            # A falha já foi contabilizada nas métricas do cliente; serve o último retrato bom do escopo
+            snapshot = restore_last_good_dataset(scope)
+            dataset = None
+            if snapshot is not None:
+                data_version, dataset = snapshot
+                st.session_state.data_stale = True
+                
+        # Configurações são opcionais: uma falha aqui não derruba o painel. O cache curto é limpo
+        # pelos botões de salvar, então o valor recém-gravado não é sobrescrito pelo antigo.
+        try:
+            settings = fetch_platform_settings()
+        except Exception:
+            settings = None
+        if settings:
+            st.session_state.platform_config.update(settings)
+                
+        if dataset is not None:
+            companies, all_answers, users_raw = dataset
             if users_raw:
                 st.session_state.users_db = {u['username']: u for u in users_raw}
-        except Exception as e:
-            pass
+            if companies:
+                st.session_state.dataset_cache_key = (scope, data_version)
             
-    if not companies:
-        companies = st.session_state.companies_db
-        all_answers = st.session_state.local_responses_db
-        
-    # Transforma e calcula dados REAIS
-    all_answers = calculate_actual_scores(all_answers, st.session_state.hse_questions)
-    
-    for c in companies:
-        if 'org_structure' not in c or not c['org_structure']: 
-            c['org_structure'] = {"Geral": ["Geral"]}
-            
-        comp_resps = [r for r in all_answers if str(r['company_id']) == str(c['id'])]
-        c = process_company_analytics(c, comp_resps, st.session_state.hse_questions)
+    else:
+        # Modo local (armazenamento embutido): nunca entra no cache compartilhado
+        local_store = get_local_storage()
+        companies = local_store.list_companies(scope)
+        all_answers = local_store.list_responses([c['id'] for c in companies])
+        companies, all_answers = build_company_analytics(companies, all_answers, st.session_state.hse_questions)
 
     return companies, all_answers
 
-def generate_real_history(comp_id, all_responses, hse_questions, total_vidas):
+@st.cache_data(ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def cached_company_history(dataset_cache_key, comp_id, total_vidas, granularity, _all_responses, _hse_questions):
+    """Histórico em cache; as respostas já estão identificadas pela chave do dataset."""
+    return generate_real_history(comp_id, _all_responses, _hse_questions, total_vidas, granularity=granularity)
+
+def get_company_history(comp_id, all_responses, hse_questions, total_vidas, expected_respondents=None, granularity="month"):
     """
-    Agrupa as respostas reais do banco por Mês/Ano para gerar a evolução histórica verdadeira.
+    Usa o cache compartilhado quando os dados vieram do banco; no modo local calcula direto.
+    Se os agregados pré-calculados da empresa estiverem completos (mesmo total de respondentes),
+    o histórico mensal ou trimestral é montado a partir deles em vez das respostas brutas.
+    Faixas customizadas (tupla de (rótulo, início, fim)) sempre usam as respostas, que têm a data exata.
     """
-    history_dict = {}
-    for r in all_responses:
-        # Filtra apenas respostas da empresa selecionada
-        if str(r.get('company_id')) != str(comp_id): 
-            continue
-        
-        created_at = r.get('created_at')
-        if not created_at: 
-            periodo = "Dados Antigos"
+    cache_key = st.session_state.get('dataset_cache_key')
+    if cache_key is None:
+        return generate_real_history(comp_id, all_responses, hse_questions, total_vidas, granularity=granularity)
+    
+    if granularity in ("month", "quarter"):
+        try:
+            aggregates = load_company_aggregates(comp_id, cache_key[1])
+            if aggregates and sum(int(a.get('respondentes') or 0) for a in aggregates) == expected_respondents:
+                return generate_real_history(comp_id, [], hse_questions, total_vidas, aggregates=aggregates, granularity=granularity)
+        except Exception:
+            pass
+    return cached_company_history(cache_key, comp_id, total_vidas, granularity, all_responses, hse_questions)
+
+# ==============================================================================
+# 4.2 SINCRONIZAÇÃO INCREMENTAL DAS RESPOSTAS (MARCA D'ÁGUA POR ID)
+# ==============================================================================
+# As respostas são append-only (o survey_screen apenas insere). Cada escopo guarda as
+# linhas já pontuadas e, a cada nova versão dos dados, busca somente id > marca d'água.
+# O id (identity) cresce a cada inserção, ao contrário do created_at, que pode chegar
+# atrasado, antigo ou nulo em importações; a contagem no servidor cobre o restante.
+MAX_SYNC_SCOPES = 64
+
+@st.cache_resource
+def get_response_store():
+    """
+    Armazenamento local compartilhado entre sessões: um espelho pontuado por escopo de usuário.
+    O lock do registro protege apenas o dicionário de escopos; cada espelho tem o seu, mantido
+    durante as leituras do banco, então escopos diferentes sincronizam em paralelo.
+    """
+    return {"scopes": {}, "lock": threading.Lock()}
+
+def scope_to_key(scope):
+    return f"{scope['perm']}|{scope['owner']}|{scope['company_id']}"
+
+def _merge_scored_rows(mirror, pages, hse_questions):
+    """
+    Consome as páginas do leitor em streaming: pontua apenas as linhas ainda não vistas,
+    guarda-as enxutas (sem o JSON de answers) e avança a marca d'água do espelho.
+    """
+    for page in pages:
+        unseen = [r for r in page if r.get('id') not in mirror['rows']]
+        for r in slim_scored_rows(unseen, hse_questions):
+            mirror['rows'][r.get('id')] = r
+            row_id = r.get('id')
+            if row_id is not None and (mirror['watermark'] is None or row_id > mirror['watermark']):
+                mirror['watermark'] = row_id
+
+def sync_scoped_responses(scope, company_ids, hse_questions, store=None):
+    """
+    Devolve as respostas pontuadas do escopo trazendo do banco apenas o delta desde a última leitura.
+    Empresas que entraram no escopo são carregadas por completo; as que saíram são descartadas.
+    Uma contagem HEAD no servidor reconcilia o que o delta por id não enxerga (exclusões feitas
+    fora deste processo, linhas confirmadas com id menor que a marca d'água): se o banco tiver
+    um número de linhas diferente do espelho, o escopo é recarregado do zero.
+    Quem chama de uma thread auxiliar deve passar `store` já resolvido na thread do script.
+    """
+    if store is None:
+        store = get_response_store()
+    key = scope_to_key(scope)
+    ids_atuais = {str(cid) for cid in company_ids}
+    
+    with store["lock"]:
+        mirror = store["scopes"].pop(key, None)
+        if mirror is None:
+            if len(store["scopes"]) >= MAX_SYNC_SCOPES:
+                # Descarta o escopo usado há mais tempo (o dicionário preserva a ordem de uso)
+                store["scopes"].pop(next(iter(store["scopes"])))
+            mirror = {"rows": {}, "watermark": None, "company_ids": set(), "loaded": False, "lock": threading.Lock()}
+        store["scopes"][key] = mirror
+    
+    with mirror["lock"]:
+        if not mirror['loaded']:
+            _merge_scored_rows(mirror, iter_scoped_response_pages(scope, company_ids), hse_questions)
+            mirror['loaded'] = True
         else:
-            try:
-                # Transforma a data do Supabase (ex: '2026-02-19T10:19:00+00:00') em Mes/Ano
-                dt = datetime.datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-                periodo = dt.strftime('%m/%Y')
-            except:
-                periodo = "Geral"
+            # Empresas que saíram do escopo
+            removidas = mirror['company_ids'] - ids_atuais
+            if removidas and scope['perm'] != "Master":
+                mirror['rows'] = {k: r for k, r in mirror['rows'].items() if str(r['company_id']) not in removidas}
             
-        if periodo not in history_dict:
-            history_dict[periodo] = []
-        history_dict[periodo].append(r)
+            # Empresas novas no escopo: carga completa apenas delas (a marca d'água do delta é a anterior)
+            watermark = mirror['watermark']
+            novas = [cid for cid in company_ids if str(cid) not in mirror['company_ids']]
+            if novas and scope['perm'] != "Master":
+                _merge_scored_rows(mirror, iter_response_pages(novas), hse_questions)
+            
+            _merge_scored_rows(mirror, iter_scoped_response_pages(scope, company_ids, after_id=watermark), hse_questions)
+            
+            # Reconciliação barata do que o delta não trouxe (exclusões, ids confirmados fora de ordem)
+            if count_scoped_responses(scope, company_ids) != len(mirror['rows']):
+                mirror['rows'], mirror['watermark'] = {}, None
+                _merge_scored_rows(mirror, iter_scoped_response_pages(scope, company_ids), hse_questions)
         
-    history_list = []
-    for period, resps in history_dict.items():
-        comp_mock = {'id': comp_id, 'func': total_vidas}
-        comp_stats = process_company_analytics(comp_mock, resps, hse_questions)
+        mirror['company_ids'] = ids_atuais
+        return list(mirror['rows'].values())
+
+def purge_company_from_response_store(comp_id):
+    """Remove do espelho local as respostas de uma empresa excluída (cascata do delete_company)."""
+    store = get_response_store()
+    with store["lock"]:
+        mirrors = list(store["scopes"].values())
+    for mirror in mirrors:
+        with mirror["lock"]:
+            mirror['rows'] = {k: r for k, r in mirror['rows'].items() if str(r['company_id']) != str(comp_id)}
+            mirror['company_ids'].discard(str(comp_id))
+
+# Chaves numéricas de período do histórico. Mês: ano*12 + (mês-1); trimestre: ano*4 + (trimestre-1);
+# faixas customizadas: posição da faixa na lista. As sentinelas negativas ordenam antes de qualquer período.
+HISTORY_GRANULARITIES = {"Mensal": "month", "Trimestral": "quarter", "Personalizado": "custom"}
+PERIOD_NO_DATE = -3       # Resposta sem created_at ("Dados Antigos")
+PERIOD_INVALID = -2       # created_at ilegível ("Geral")
+PERIOD_OUT_OF_RANGE = -1  # Fora de todas as faixas customizadas (descartada)
+HISTORY_CACHE_MAX_ENTRIES = 20000
+
+@st.cache_resource
+def get_closed_period_cache():
+    """
+    Somas por pergunta dos períodos já encerrados (empresa x granularidade x período), compartilhadas
+    entre sessões. Como as respostas só são inseridas com a data corrente, um período fechado não muda.
+    Cada entrada guarda a impressão digital das linhas do período (respondentes, maior id e soma dos ids):
+    exclusões e inserções fora de ordem trocam a impressão e invalidam só aquela entrada. Edições que
+    mantêm os ids (migração de formato, rebuild, exclusão de empresa) limpam o cache explicitamente.
+    """
+    return {"periods": {}, "lock": threading.Lock()}
+
+def clear_closed_period_cache():
+    cache = get_closed_period_cache()
+    with cache["lock"]:
+        cache["periods"].clear()
+
+def build_custom_history_ranges(inicio, fim, janela_dias):
+    """Divide [inicio, fim] em janelas consecutivas de `janela_dias` dias: ((rótulo, início ISO, fim ISO), ...)."""
+    ranges = []
+    atual = inicio
+    while atual <= fim:
+        limite = min(atual + datetime.timedelta(days=janela_dias - 1), fim)
+        ranges.append((f"{atual.strftime('%d/%m/%y')} a {limite.strftime('%d/%m/%y')}", atual.isoformat(), limite.isoformat()))
+        atual = limite + datetime.timedelta(days=1)
+    return tuple(ranges)
+
+def parse_created_at_days(created_ats):
+    """
+    Converte os created_at em datas (dia) de uma só vez. Vale a data local gravada no timestamp
+    (os 10 primeiros caracteres), a mesma que o agrupamento antigo por fromisoformat usava.
+    Retorna (datas com NaT nas ilegíveis, máscara das linhas sem created_at).
+    """
+    raw = pd.Series(list(created_ats), dtype=object)
+    missing = (raw.isna() | (raw == "")).to_numpy(dtype=bool)
+    return pd.to_datetime(raw.str.slice(0, 10), format='%Y-%m-%d', errors='coerce'), missing
+
+def history_period_keys(created_ats, granularity="month"):
+    """
+    Converte todos os created_at em chaves numéricas de período de uma só vez (pandas/numpy).
+    `granularity` é "month", "quarter" ou uma sequência de faixas (rótulo, início, fim) com datas
+    inclusivas e sem sobreposição.
+    """
+    days, missing = parse_created_at_days(created_ats)
+    if days.empty:
+        return np.zeros(0, dtype=np.int64)
+    valid = days.notna().to_numpy()
+    
+    if granularity in ("month", "quarter"):
+        years = days.dt.year.fillna(0).to_numpy(dtype=np.int64)
+        months = days.dt.month.fillna(1).to_numpy(dtype=np.int64)
+        keys = years * 12 + months - 1 if granularity == "month" else years * 4 + (months - 1) // 3
+    else:
+        starts = np.array([r[1] for r in granularity], dtype='datetime64[D]')
+        ends = np.array([r[2] for r in granularity], dtype='datetime64[D]')
+        day_values = days.to_numpy(dtype='datetime64[D]')
+        order = np.argsort(starts)
+        pos = np.searchsorted(starts[order], day_values, side='right') - 1
+        inside = (pos >= 0) & valid
+        keys = np.full(len(days), PERIOD_OUT_OF_RANGE, dtype=np.int64)
+        keys[inside] = order[pos[inside]]
+        inside[inside] = day_values[inside] <= ends[keys[inside]]
+        keys[~inside] = PERIOD_OUT_OF_RANGE
+    
+    keys = np.where(valid, keys, PERIOD_INVALID)
+    return np.where(missing, PERIOD_NO_DATE, keys).astype(np.int64)
+
+def history_period_label(key, granularity="month"):
+    """Rótulo exibido para a chave de período (mês mantém o formato '%m/%Y' usado nos laudos)."""
+    if key == PERIOD_NO_DATE:
+        return "Dados Antigos"
+    if key == PERIOD_INVALID:
+        return "Geral"
+    if granularity == "month":
+        return f"{key % 12 + 1:02d}/{key // 12}"
+    if granularity == "quarter":
+        return f"{key % 4 + 1}º Tri/{key // 4}"
+    return granularity[key][0]
+
+def history_period_bounds(key, granularity="month"):
+    """Primeiro e último dia (datas) do período; None para as sentinelas sem data."""
+    if key < 0:
+        return None, None
+    if granularity in ("month", "quarter"):
+        year, first_month = (key // 12, key % 12 + 1) if granularity == "month" else (key // 4, (key % 4) * 3 + 1)
+        last_month = first_month if granularity == "month" else first_month + 2
+        inicio = datetime.date(year, first_month, 1)
+        proximo = datetime.date(year + 1, 1, 1) if last_month == 12 else datetime.date(year, last_month + 1, 1)
+        return inicio, proximo - datetime.timedelta(days=1)
+    return datetime.date.fromisoformat(granularity[key][1]), datetime.date.fromisoformat(granularity[key][2])
+
+def closed_period_mask(period_keys, granularity, today):
+    """Marca os períodos já encerrados em `today` (cacheáveis); o período corrente sempre é recalculado."""
+    period_keys = np.asarray(period_keys, dtype=np.int64)
+    if granularity == "month":
+        return period_keys < today.year * 12 + today.month - 1
+    if granularity == "quarter":
+        return period_keys < today.year * 4 + (today.month - 1) // 3
+    ends = np.array([r[2] for r in granularity], dtype='datetime64[D]')
+    closed = period_keys < 0
+    in_range = period_keys >= 0
+    closed[in_range] = ends[period_keys[in_range]] < np.datetime64(today, 'D')
+    return closed
+
+def history_period_sums(comp_id, comp_rows, qindex, granularity="month", today=None):
+    """
+    Somas e contagens por pergunta e respondentes de cada período da empresa, numa única passada
+    agrupada. Períodos encerrados com a mesma impressão digital (respondentes, maior id e soma dos
+    ids) vêm do cache e suas linhas nem chegam a ser codificadas; uma nova resposta no mês corrente
+    não invalida os meses fechados. Retorna {chave do período: (q_sums, q_counts, respondentes)}.
+    """
+    keys = history_period_keys([r.get('created_at') for r in comp_rows], granularity)
+    periods, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    closed = closed_period_mask(periods, granularity, today or datetime.date.today())
+    signature = (str(comp_id), granularity if isinstance(granularity, str) else tuple(granularity), tuple(qindex['id_keys']))
+    ids = np.array([int(r.get('id') or 0) for r in comp_rows], dtype=np.int64)
+    id_sums = np.zeros(len(periods), dtype=np.int64)
+    np.add.at(id_sums, inverse, ids)
+    id_maxes = np.zeros(len(periods), dtype=np.int64)
+    np.maximum.at(id_maxes, inverse, ids)
+    fingerprints = list(zip(counts.tolist(), id_maxes.tolist(), id_sums.tolist()))
+    
+    cache = get_closed_period_cache()
+    result = {}
+    pending = np.ones(len(periods), dtype=bool)
+    with cache["lock"]:
+        for g, k in enumerate(periods.tolist()):
+            hit = cache["periods"].get((signature, k)) if closed[g] else None
+            if hit is not None and hit[0] == fingerprints[g]:
+                result[k] = hit[1]
+                pending[g] = False
+    
+    rows_idx = np.flatnonzero(pending[inverse])
+    if len(rows_idx) == 0:
+        return result
+    codes = encode_answers_matrix([comp_rows[i] for i in rows_idx.tolist()], qindex)
+    q_sums, q_counts, respondents = group_sums_by_key(inverse[rows_idx], len(periods), codes, qindex)
+    with cache["lock"]:
+        for g in np.flatnonzero(pending).tolist():
+            k = int(periods[g])
+            result[k] = (q_sums[g], q_counts[g], int(respondents[g]))
+            if closed[g]:
+                cache["periods"].pop((signature, k), None)
+                if len(cache["periods"]) >= HISTORY_CACHE_MAX_ENTRIES:
+                    cache["periods"].pop(next(iter(cache["periods"])))
+                cache["periods"][(signature, k)] = (fingerprints[g], result[k])
+    return result
+
+def aggregate_period_start(periodo):
+    """Primeiro dia do mês de uma linha agregada ('YYYY-MM'), no formato aceito por history_period_keys."""
+    if periodo == "sem-data" or not periodo:
+        return None
+    return f"{periodo}-01" if periodo != "geral" else periodo
+
+def generate_real_history(comp_id, all_responses, hse_questions, total_vidas, aggregates=None, granularity="month", today=None):
+    """
+    Agrupa as respostas reais do banco por período (mês, trimestre ou faixas customizadas de datas)
+    para gerar a evolução histórica verdadeira, do período mais antigo para o mais novo.
+    As datas são convertidas em bloco para chaves numéricas e todos os períodos são somados numa
+    única passada; os períodos encerrados ficam em cache, então só o corrente é recalculado.
+    Com `aggregates` o agrupamento é feito sobre as linhas pré-calculadas (empresa x setor x mês),
+    que só têm resolução mensal: use-os apenas com granularidade mensal ou trimestral.
+    """
+    qindex = build_question_index(hse_questions)
+    if aggregates is not None:
+        comp_aggs = [a for a in aggregates if str(a.get('company_id')) == str(comp_id)]
+        keys = history_period_keys([aggregate_period_start(a.get('periodo')) for a in comp_aggs], granularity)
+        grouped = {}
+        for k, a in zip(keys.tolist(), comp_aggs):
+            grouped.setdefault(k, []).append(a)
+        period_sums = {k: aggregates_to_sums(rows, qindex)[:3] for k, rows in grouped.items()}
+    else:
+        comp_rows = [r for r in all_responses if str(r.get('company_id')) == str(comp_id)]
+        period_sums = history_period_sums(comp_id, comp_rows, qindex, granularity, today)
         
+    history_list = []
+    for k in sorted(period_sums):
+        if k == PERIOD_OUT_OF_RANGE:
+            continue
+        q_sums, q_counts, respondidas = period_sums[k]
+        dimensoes, score, _ = analytics_from_sums(q_sums, q_counts, qindex)
+        inicio, fim = history_period_bounds(k, granularity)
         history_list.append({
-            "periodo": period,
-            "score": comp_stats.get('score', 0),
+            "periodo": history_period_label(k, granularity),
+            "score": score,
             "vidas": total_vidas,
-            "adesao": int((len(resps) / total_vidas) * 100) if total_vidas > 0 else 0,
-            "dimensoes": comp_stats.get('dimensoes', {})
+            "adesao": int((respondidas / total_vidas) * 100) if total_vidas > 0 else 0,
+            "dimensoes": dimensoes,
+            "inicio": inicio,
+            "fim": fim
         })
-        
-    # Ordena cronologicamente do mais antigo pro mais novo (se possível)
+    return history_list
+
+# ==============================================================================
+# 4.3 AGREGADOS PRÉ-CALCULADOS (EMPRESA x SETOR x MÊS) - TABELA response_aggregates
+# ==============================================================================
+# Estrutura e funções SQL em supabase/migrations/20261018120000_response_aggregates.sql
+AGGREGATE_COLUMNS = "company_id, setor, periodo, respondentes, soma_scores, somas, contagens"
+AGGREGATE_BATCH = 500
+
+def period_key_from_created_at(created_at):
+    """Converte o created_at na chave de período dos agregados ('YYYY-MM')."""
+    if not created_at:
+        return "sem-data"
     try:
-        history_list.sort(key=lambda x: datetime.datetime.strptime(x['periodo'], '%m/%Y') if '/' in x['periodo'] else datetime.datetime.min)
+        return datetime.datetime.fromisoformat(created_at.replace('Z', '+00:00')).strftime('%Y-%m')
     except:
-        pass
+        return "geral"
+
+def period_label(periodo):
+    """Rótulo de período exibido no histórico (mesmo formato '%m/%Y' do agrupamento por respostas)."""
+    if periodo == "sem-data":
+        return "Dados Antigos"
+    if periodo == "geral" or not periodo:
+        return "Geral"
+    return f"{periodo[5:7]}/{periodo[:4]}"
+
+def aggregates_to_sums(agg_rows, qindex):
+    """Consolida linhas de agregado em vetores de soma/contagem por pergunta, respondentes e soma de scores."""
+    col_of = {str(qid): i for i, qid in enumerate(qindex['ids'].tolist())}
+    q_sums = np.zeros(len(qindex['texts']), dtype=np.int64)
+    q_counts = np.zeros(len(qindex['texts']), dtype=np.int64)
+    respondentes, soma_scores = 0, 0.0
+    for a in agg_rows:
+        respondentes += int(a.get('respondentes') or 0)
+        soma_scores += float(a.get('soma_scores') or 0)
+        for qid, v in (a.get('somas') or {}).items():
+            if qid in col_of:
+                q_sums[col_of[qid]] += int(v)
+        for qid, v in (a.get('contagens') or {}).items():
+            if qid in col_of:
+                q_counts[col_of[qid]] += int(v)
+    return q_sums, q_counts, respondentes, soma_scores
+
+def build_response_aggregate_delta(answers_dict, hse_questions):
+    """Incremento de uma única resposta: notas por id de pergunta (rev já aplicado) e o score individual."""
+    qindex = build_question_index(hse_questions)
+    codes = encode_answers_matrix([{'answers': answers_dict}], qindex)
+    values = likert_values(codes, qindex)[0].tolist()
+    somas, contagens = {}, {}
+    for qid, code, val in zip(qindex['ids'].tolist(), codes[0].tolist(), values):
+        if code != MISSING_CODE:
+            somas[str(qid)] = somas.get(str(qid), 0) + val
+            contagens[str(qid)] = contagens.get(str(qid), 0) + 1
+    score = calculate_actual_scores([{'answers': answers_dict}], hse_questions, codes=codes)[0]['score_calculado']
+    return somas, contagens, score
+
+def compute_aggregate_rows(responses, hse_questions):
+    """Monta as linhas de response_aggregates a partir das respostas brutas (usado no backfill)."""
+    qindex = build_question_index(hse_questions)
+    codes = encode_answers_matrix(responses, qindex)
+    calculate_actual_scores(responses, hse_questions, codes=codes)
+    
+    group_of = {}
+    keys = np.fromiter(
+        (group_of.setdefault((str(r.get('company_id')), r.get('setor') or "Geral", period_key_from_created_at(r.get('created_at'))), len(group_of)) for r in responses),
+        dtype=np.int64, count=len(responses)
+    )
+    q_sums, q_counts, respondents = group_sums_by_key(keys, len(group_of), codes, qindex)
+    score_sums = np.bincount(keys, weights=[r['score_calculado'] for r in responses], minlength=len(group_of)) if responses else []
+    
+    ids = [str(qid) for qid in qindex['ids'].tolist()]
+    rows = []
+    for (company_id, setor, periodo), g in group_of.items():
+        rows.append({
+            "company_id": company_id,
+            "setor": setor,
+            "periodo": periodo,
+            "respondentes": int(respondents[g]),
+            "soma_scores": round(float(score_sums[g]), 2),
+            "somas": {qid: int(s) for qid, s, n in zip(ids, q_sums[g].tolist(), q_counts[g].tolist()) if n > 0},
+            "contagens": {qid: int(n) for qid, n in zip(ids, q_counts[g].tolist()) if n > 0}
+        })
+    return rows
+
+def fetch_company_aggregates(company_ids):
+    """Lê as linhas agregadas das empresas informadas (O(setores x meses) por empresa)."""
+    rows = []
+    for i in range(0, len(company_ids), IN_FILTER_CHUNK):
+        chunk = company_ids[i:i + IN_FILTER_CHUNK]
+        rows.extend(supabase.table('response_aggregates').select(AGGREGATE_COLUMNS).in_('company_id', chunk).execute().data)
+    return rows
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_company_aggregates(comp_id, data_version):
+    return fetch_company_aggregates([comp_id])
+
+def submit_survey_response(row, hse_questions):
+    """
+    Grava a resposta e incrementa o agregado na mesma transação (RPC submit_survey_response).
+    Enquanto a migração não estiver aplicada no banco (PGRST202), mantém o insert simples.
+    """
+    somas, contagens, score = build_response_aggregate_delta(row['answers'], hse_questions)
+    try:
+        supabase.rpc('submit_survey_response', {
+            "p_company_id": row['company_id'],
+            "p_cpf_hash": row['cpf_hash'],
+            "p_setor": row['setor'],
+            "p_answers": row['answers'],
+            "p_created_at": row['created_at'],
+            "p_periodo": period_key_from_created_at(row['created_at']),
+            "p_somas": somas,
+            "p_contagens": contagens,
+            "p_score": score
+        }).execute()
+    except Exception as e:
+        if getattr(e, 'code', None) != 'PGRST202':
+            raise
+        supabase.table('responses').insert(row).execute()
+
+def rebuild_response_aggregates(hse_questions):
+    """
+    Backfill: recalcula a tabela response_aggregates a partir de todas as respostas.
+    Cada grupo (empresa, setor, mês) é sobrescrito por upsert e os grupos que não têm mais
+    respostas (exclusões) são apagados; rode fora de campanhas ativas, pois uma resposta gravada
+    durante o rebuild pode ser sobrescrita pelo valor recalculado.
+    Retorna o número de linhas agregadas gravadas.
+    """
+    responses = []
+    for page in iter_response_pages():
+        responses.extend(slim_scored_rows(page, hse_questions))
+    rows = compute_aggregate_rows(responses, hse_questions)
+    existentes = [
+        (a['company_id'], a['setor'], a['periodo'])
+        for page in iter_table_pages('response_aggregates', "company_id, setor, periodo", ('company_id', 'setor', 'periodo')) for a in page
+    ]
+    for i in range(0, len(rows), AGGREGATE_BATCH):
+        supabase.table('response_aggregates').upsert(rows[i:i + AGGREGATE_BATCH]).execute()
+    recalculados = {(str(r['company_id']), r['setor'], r['periodo']) for r in rows}
+    for company_id, setor, periodo in existentes:
+        if (str(company_id), setor, periodo) not in recalculados:
+            supabase.table('response_aggregates').delete().eq('company_id', company_id).eq('setor', setor).eq('periodo', periodo).execute()
+    invalidate_data_cache()
+    clear_closed_period_cache()
+    return len(rows)
+
+# ==============================================================================
+# 4.4 CUBO ANALÍTICO EM MEMÓRIA (EMPRESA x SETOR x MÊS x PERGUNTA)
+# ==============================================================================
+# Grupos com menos respondentes que este limite são suprimidos nas consultas do cubo (anonimato/LGPD)
+MIN_RESPONDENTES_CELULA = 3
+
+class AnalyticsCube:
+    """
+    Cubo OLAP construído uma vez por versão dos dados. Cada célula é uma combinação observada de
+    (empresa, setor, mês) e guarda, por pergunta, a soma das notas e a contagem de respostas válidas,
+    além do número de respondentes e da soma dos scores individuais.
+
+    API de consulta:
+      - slice(company=..., setor=..., month=...)  -> novo cubo restrito às células selecionadas
+      - rollup(by=('setor',))                     -> métricas consolidadas por nível (ou no total com by=())
+      - drilldown('setor', company=[...])         -> atalho para slice(...).rollup((nível,))
+    """
+    LEVELS = ('company', 'setor', 'month')
+
+    def __init__(self, qindex, cell_keys, q_sums, q_counts, respondents, score_sums, min_respondents=MIN_RESPONDENTES_CELULA):
+        self.qindex = qindex
+        self.cell_keys = cell_keys
+        self.q_sums = q_sums
+        self.q_counts = q_counts
+        self.respondents = respondents
+        self.score_sums = score_sums
+        self.min_respondents = min_respondents
+
+    @classmethod
+    def from_responses(cls, responses, hse_questions, min_respondents=MIN_RESPONDENTES_CELULA):
+        """Constrói o cubo a partir das respostas pontuadas (score_calculado) numa única passada agrupada."""
+        qindex = build_question_index(hse_questions)
+        codes = encode_answers_matrix(responses, qindex)
         
-    return history_list
+        cell_of = {}
+        keys = np.fromiter(
+            (cell_of.setdefault((str(r.get('company_id')), r.get('setor') or "Geral", period_key_from_created_at(r.get('created_at'))), len(cell_of)) for r in responses),
+            dtype=np.int64, count=len(responses)
+        )
+        q_sums, q_counts, respondents = group_sums_by_key(keys, len(cell_of), codes, qindex)
+        score_sums = np.bincount(keys, weights=[r.get('score_calculado', 0) for r in responses], minlength=len(cell_of)) if responses else np.zeros(0)
+        
+        cells = list(cell_of)
+        cell_keys = {level: np.array([c[i] for c in cells], dtype=object) for i, level in enumerate(cls.LEVELS)}
+        return cls(qindex, cell_keys, q_sums, q_counts, respondents, score_sums, min_respondents)
+
+    def __len__(self):
+        return len(self.respondents)
+
+    def slice(self, company=None, setor=None, month=None):
+        """Restringe o cubo às células cujos rótulos estão nas listas informadas (None = sem filtro)."""
+        mask = np.ones(len(self), dtype=bool)
+        for level, values in (('company', company), ('setor', setor), ('month', month)):
+            if values is not None:
+                wanted = {str(v) for v in values} if level == 'company' else set(values)
+                mask &= np.array([k in wanted for k in self.cell_keys[level]], dtype=bool)
+        return AnalyticsCube(
+            self.qindex,
+            {level: keys[mask] for level, keys in self.cell_keys.items()},
+            self.q_sums[mask], self.q_counts[mask], self.respondents[mask], self.score_sums[mask],
+            self.min_respondents
+        )
+
+    def rollup(self, by=(), include_suppressed=False):
+        """
+        Consolida as células pelos níveis de `by`. Cada grupo traz respondentes, score_medio
+        (média dos scores individuais), score, dimensoes e detalhe_perguntas. Grupos abaixo do
+        limite mínimo de respondentes saem marcados como suprimidos e sem métricas.
+        """
+        group_of = {}
+        gids = np.fromiter(
+            (group_of.setdefault(tuple(self.cell_keys[level][i] for level in by), len(group_of)) for i in range(len(self))),
+            dtype=np.int64, count=len(self)
+        )
+        n_groups = len(group_of)
+        q_sums = np.zeros((n_groups, self.q_sums.shape[1]), dtype=np.int64)
+        q_counts = np.zeros((n_groups, self.q_counts.shape[1]), dtype=np.int64)
+        np.add.at(q_sums, gids, self.q_sums)
+        np.add.at(q_counts, gids, self.q_counts)
+        respondents = np.bincount(gids, weights=self.respondents, minlength=n_groups)
+        score_sums = np.bincount(gids, weights=self.score_sums, minlength=n_groups)
+        
+        result = []
+        for labels, g in group_of.items():
+            n = int(respondents[g])
+            entry = dict(zip(by, labels))
+            entry['respondentes'] = n
+            entry['suprimido'] = n < self.min_respondents
+            if entry['suprimido']:
+                if include_suppressed:
+                    result.append(entry)
+                continue
+            entry['score_medio'] = round(float(score_sums[g]) / n, 2)
+            entry['dimensoes'], entry['score'], entry['detalhe_perguntas'] = analytics_from_sums(q_sums[g], q_counts[g], self.qindex)
+            result.append(entry)
+        return result
+
+    def drilldown(self, level, **filters):
+        """Desce um nível: aplica os filtros e consolida pelo nível pedido (ex: setores de uma empresa)."""
+        return self.slice(**filters).rollup((level,))
+
+@st.cache_resource(ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def cached_analytics_cube(dataset_cache_key, _responses, _hse_questions):
+    """Cubo compartilhado entre sessões (somente leitura): as consultas sempre devolvem novos objetos."""
+    return AnalyticsCube.from_responses(_responses, _hse_questions)
+
+def get_analytics_cube(responses, hse_questions):
+    """Devolve o cubo da versão atual dos dados; no modo local o cubo é montado na hora."""
+    cache_key = st.session_state.get('dataset_cache_key')
+    if cache_key is None:
+        return AnalyticsCube.from_responses(responses, hse_questions)
+    return cached_analytics_cube(cache_key, responses, hse_questions)
+
+# ==============================================================================
+# 4.5 MIGRAÇÃO DAS RESPOSTAS LEGADAS PARA O FORMATO COMPACTO
+# ==============================================================================
+MIGRATION_BATCH = 500
+
+def migrate_answers_to_compact(hse_questions, batch_size=MIGRATION_BATCH):
+    """
+    Reescreve no formato compacto todas as respostas ainda gravadas com o texto das perguntas.
+    Percorre a tabela em lotes por id (apenas linhas sem o campo de versão) e grava cada lote
+    com um único upsert. Os scores não mudam: o leitor produz os mesmos códigos nos dois formatos.
+    Retorna o número de respostas migradas.
+    """
+    migrated = 0
+    last_id = None
+    while True:
+        query = supabase.table('responses').select("id, company_id, cpf_hash, setor, answers, created_at").is_('answers->>v', 'null')
+        if last_id is not None:
+            query = query.gt('id', last_id)
+        page = query.order('id').limit(batch_size).execute().data
+        if not page:
+            break
+        for r in page:
+            r['answers'] = compact_answers(r['answers'], hse_questions)
+        supabase.table('responses').upsert(page).execute()
+        migrated += len(page)
+        last_id = page[-1]['id']
+        
+    invalidate_data_cache()
+    clear_closed_period_cache()
+    return migrated
+
+def migrate_local_answers_to_compact(hse_questions):
+    """Equivalente da migração para o armazenamento local embutido."""
+    local_store = get_local_storage()
+    legados = [r for r in local_store.list_responses() if (r.get('answers') or {}).get('v') != COMPACT_ANSWERS_VERSION]
+    local_store.update_response_answers([(r['id'], compact_answers(r['answers'], hse_questions)) for r in legados])
+    clear_closed_period_cache()
+    return len(legados)
+
+# ==============================================================================
+# 4.6 ARMAZENAMENTO LOCAL EMBUTIDO (MODO OFFLINE / ON-PREMISE)
+# ==============================================================================
+# Sem Supabase, empresas, respostas e usuários ficam num banco embutido em disco, compartilhado
+# pelas sessões e preservado entre reinícios. As tabelas espelham as do Supabase.
+# Configuração opcional em secrets.toml:  [local_storage] backend = "sqlite", path = "elo_local.db"
+# (a variável de ambiente ELO_LOCAL_DB tem prioridade sobre o caminho).
+LOCAL_DB_DEFAULT_PATH = "elo_local.db"
+
+class LocalStorage(ABC):
+    """
+    Operações de dados usadas pelo app no modo local. Novos backends implementam esta interface.
+    Linhas entram e saem como dicionários com os mesmos campos das tabelas do Supabase.
+    """
+    # ---- Empresas ----
+    @abstractmethod
+    def list_companies(self, scope=None):
+        """Empresas visíveis ao escopo (owner para Gestor, empresa vinculada para Analista, todas sem escopo), sem logo_b64."""
+
+    @abstractmethod
+    def get_company(self, comp_id):
+        """Registro completo da empresa (todas as colunas), ou None."""
+
+    @abstractmethod
+    def insert_company(self, company):
+        """Grava uma nova empresa."""
+
+    @abstractmethod
+    def update_company(self, comp_id, fields):
+        """Atualiza apenas os campos de empresa presentes em `fields`."""
+
+    @abstractmethod
+    def delete_company(self, comp_id):
+        """Exclui a empresa com suas respostas e acessos vinculados (cascata)."""
+
+    # ---- Respostas ----
+    @abstractmethod
+    def list_responses(self, company_ids=None):
+        """Respostas das empresas informadas (todas com None), ordenadas por id."""
+
+    @abstractmethod
+    def insert_response(self, row):
+        """Grava uma resposta e devolve o id gerado."""
+
+    @abstractmethod
+    def has_response(self, company_id, cpf_hash):
+        """True se o CPF (hash) já respondeu pela empresa (checagem antifraude)."""
+
+    @abstractmethod
+    def count_responses(self, company_id):
+        """Número de respostas já gravadas para a empresa."""
+
+    @abstractmethod
+    def update_response_answers(self, id_answers):
+        """Regrava o campo answers de várias respostas: sequência de (id, answers)."""
+
+    # ---- Usuários ----
+    @abstractmethod
+    def list_users(self):
+        """Todos os acessos administrativos, por username."""
+
+    @abstractmethod
+    def get_user(self, username):
+        """Acesso pelo username, ou None."""
+
+    @abstractmethod
+    def insert_user(self, user):
+        """Grava um novo acesso administrativo."""
+
+    @abstractmethod
+    def delete_user(self, username):
+        """Remove o acesso."""
+
+    # ---- Ativos (logos) ----
+    @abstractmethod
+    def get_asset(self, ref):
+        """Linha da tabela de ativos pelo hash do conteúdo, ou None."""
+
+    @abstractmethod
+    def put_asset(self, asset):
+        """Grava o ativo; regravar o mesmo hash não altera nada."""
+
+    @abstractmethod
+    def list_inline_logos(self):
+        """Empresas que ainda guardam o logo em base64 inline: [{id, logo_b64}]."""
+
+    @abstractmethod
+    def replace_inline_logo(self, comp_id, ref):
+        """Troca o logo inline da empresa pela referência do repositório de ativos."""
+
+    # ---- Versão ----
+    @abstractmethod
+    def change_count(self):
+        """Contador que cresce a cada escrita no backend; serve de versão dos dados no modo local."""
+
+class SQLiteStorage(LocalStorage):
+    """
+    Backend SQLite (biblioteca padrão). Uma conexão por processo protegida por lock, em modo WAL.
+    Colunas JSON (org_structure, answers) são gravadas como texto; as demais guardam o valor como veio.
+    Índices: respostas por (company_id, created_at), (company_id, cpf_hash) e created_at;
+    empresas por owner; usuários por linked_company_id.
+    """
+    COMPANY_FIELDS = [c.strip() for c in COMPANY_COLUMNS.split(',')]
+    RESPONSE_FIELDS = ["id", "company_id", "cpf_hash", "setor", "answers", "created_at"]
+    USER_FIELDS = [c.strip() for c in USER_COLUMNS.split(',')]
+    ASSET_FIELDS = [c.strip() for c in ASSET_COLUMNS.split(',')]
+    JSON_FIELDS = {"org_structure", "answers"}
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS companies (
+            id TEXT PRIMARY KEY, razao, cnpj, cnae, setor, risco, func, limit_evals, segmentacao, resp,
+            email, telefone, endereco, valid_until, logo_ref, owner, org_structure, logo_b64
+        );
+        CREATE INDEX IF NOT EXISTS idx_companies_owner ON companies (owner);
+        CREATE TABLE IF NOT EXISTS responses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, company_id TEXT NOT NULL, cpf_hash TEXT, setor, answers, created_at TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_responses_company_created ON responses (company_id, created_at);
+        CREATE INDEX IF NOT EXISTS idx_responses_company_cpf ON responses (company_id, cpf_hash);
+        CREATE INDEX IF NOT EXISTS idx_responses_created ON responses (created_at);
+        CREATE TABLE IF NOT EXISTS admin_users (
+            username TEXT PRIMARY KEY, password, role, credits, valid_until, linked_company_id
+        );
+        CREATE INDEX IF NOT EXISTS idx_admin_users_company ON admin_users (linked_company_id);
+        CREATE TABLE IF NOT EXISTS assets (
+            hash TEXT PRIMARY KEY, mime, width, height, data
+        );
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            if path != ":memory:":
+                self.conn.execute("PRAGMA journal_mode=WAL")
+                self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(self.SCHEMA)
+            # Bases criadas antes do repositório de ativos só têm a coluna legada logo_b64
+            if "logo_ref" not in {r["name"] for r in self.conn.execute("PRAGMA table_info(companies)")}:
+                self.conn.execute("ALTER TABLE companies ADD COLUMN logo_ref")
+    
+    def _encode(self, field, value):
+        return json.dumps(value, ensure_ascii=False) if field in self.JSON_FIELDS and value is not None else value
+    
+    def _decode(self, row):
+        out = dict(row)
+        for field in self.JSON_FIELDS & out.keys():
+            if out[field] is not None:
+                out[field] = json.loads(out[field])
+        return out
+    
+    def _query(self, sql, params=()):
+        with self.lock:
+            return [self._decode(r) for r in self.conn.execute(sql, params).fetchall()]
+    
+    def change_count(self):
+        """Linhas alteradas desde a abertura da conexão (só cresce): versão dos dados no modo local."""
+        with self.lock:
+            return self.conn.total_changes
+    
+    def _write(self, sql, params=()):
+        with self.lock, self.conn:
+            return self.conn.execute(sql, params)
+    
+    def _insert(self, table, fields, row):
+        cols = [f for f in fields if f in row]
+        return self._write(
+            f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' for _ in cols)})",
+            [self._encode(f, row[f]) for f in cols]
+        )
+    
+    # ---- Empresas ----
+    def list_companies(self, scope=None):
+        """Mesmo filtro de permissão do Supabase (owner para Gestor, empresa vinculada para Analista)."""
+        cols = ', '.join(self.COMPANY_FIELDS)
+        if scope and scope['perm'] == "Gestor":
+            return self._query(f"SELECT {cols} FROM companies WHERE owner = ?", (scope['owner'],))
+        if scope and scope['perm'] == "Analista":
+            return self._query(f"SELECT {cols} FROM companies WHERE id = ?", (scope['company_id'],))
+        return self._query(f"SELECT {cols} FROM companies")
+    
+    def get_company(self, comp_id):
+        rows = self._query("SELECT * FROM companies WHERE id = ?", (comp_id,))
+        return rows[0] if rows else None
+    
+    def insert_company(self, company):
+        self._insert("companies", self.COMPANY_FIELDS, company)
+    
+    def update_company(self, comp_id, fields):
+        cols = [f for f in self.COMPANY_FIELDS if f in fields and f != "id"]
+        if cols:
+            self._write(
+                f"UPDATE companies SET {', '.join(f'{c} = ?' for c in cols)} WHERE id = ?",
+                [self._encode(c, fields[c]) for c in cols] + [comp_id]
+            )
+    
+    def delete_company(self, comp_id):
+        """Exclusão em cascata, como no banco: respostas e acessos vinculados saem junto."""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM responses WHERE company_id = ?", (comp_id,))
+            self.conn.execute("DELETE FROM admin_users WHERE linked_company_id = ?", (comp_id,))
+            self.conn.execute("DELETE FROM companies WHERE id = ?", (comp_id,))
+    
+    # ---- Respostas ----
+    def list_responses(self, company_ids=None):
+        if company_ids is None:
+            return self._query("SELECT * FROM responses ORDER BY id")
+        rows = []
+        for i in range(0, len(company_ids), IN_FILTER_CHUNK):
+            chunk = [str(cid) for cid in company_ids[i:i + IN_FILTER_CHUNK]]
+            rows.extend(self._query(
+                f"SELECT * FROM responses WHERE company_id IN ({', '.join('?' for _ in chunk)}) ORDER BY id", chunk
+            ))
+        return rows
+    
+    def insert_response(self, row):
+        return self._insert("responses", self.RESPONSE_FIELDS, row).lastrowid
+    
+    def has_response(self, company_id, cpf_hash):
+        """Checagem antifraude de CPF duplicado, resolvida pelo índice (company_id, cpf_hash)."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT 1 FROM responses WHERE company_id = ? AND cpf_hash = ? LIMIT 1", (str(company_id), cpf_hash)
+            ).fetchone() is not None
+    
+    def count_responses(self, company_id):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM responses WHERE company_id = ?", (str(company_id),)).fetchone()[0]
+    
+    def update_response_answers(self, id_answers):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE responses SET answers = ? WHERE id = ?",
+                [(self._encode("answers", answers), rid) for rid, answers in id_answers]
+            )
+    
+    # ---- Usuários ----
+    def list_users(self):
+        return self._query("SELECT * FROM admin_users ORDER BY username")
+    
+    def get_user(self, username):
+        rows = self._query("SELECT * FROM admin_users WHERE username = ?", (username,))
+        return rows[0] if rows else None
+    
+    def insert_user(self, user):
+        self._insert("admin_users", self.USER_FIELDS, user)
+    
+    def delete_user(self, username):
+        self._write("DELETE FROM admin_users WHERE username = ?", (username,))
+    
+    # ---- Ativos (logos) ----
+    def get_asset(self, ref):
+        rows = self._query("SELECT * FROM assets WHERE hash = ?", (ref,))
+        return rows[0] if rows else None
+    
+    def put_asset(self, asset):
+        """Chave = hash do conteúdo: regravar o mesmo ativo não altera nada."""
+        self._write(
+            f"INSERT OR IGNORE INTO assets ({', '.join(self.ASSET_FIELDS)}) VALUES ({', '.join('?' for _ in self.ASSET_FIELDS)})",
+            [asset[f] for f in self.ASSET_FIELDS]
+        )
+    
+    def list_inline_logos(self):
+        return self._query("SELECT id, logo_b64 FROM companies WHERE logo_b64 IS NOT NULL AND logo_b64 != ''")
+    
+    def replace_inline_logo(self, comp_id, ref):
+        self._write("UPDATE companies SET logo_ref = ?, logo_b64 = NULL WHERE id = ?", (ref, comp_id))
+
+LOCAL_STORAGE_BACKENDS = {"sqlite": SQLiteStorage}
+
+@st.cache_resource
+def get_local_storage():
+    """Backend local único do processo, escolhido pela configuração (padrão: SQLite em disco)."""
+    try:
+        conf = dict(st.secrets.get("local_storage", {}))
+    except Exception:
+        conf = {}
+    backend = LOCAL_STORAGE_BACKENDS[conf.get("backend", "sqlite")]
+    return backend(os.environ.get("ELO_LOCAL_DB") or conf.get("path", LOCAL_DB_DEFAULT_PATH))
 
 def delete_company(comp_id):
     """ Exclui a empresa e dados em cascata. """
@@ -749,8 +2098,16 @@ def delete_company(comp_id):
             supabase.table('companies').delete().eq('id', comp_id).execute()
         except Exception as e: 
             st.warning(f"Erro ao excluir do DB: {e}")
-    
-    st.session_state.companies_db = [c for c in st.session_state.companies_db if c['id'] != comp_id]
+        try:
+            supabase.table('response_aggregates').delete().eq('company_id', comp_id).execute()
+        except:
+            pass
+        purge_company_from_response_store(comp_id)
+        invalidate_data_cache()
+    else:
+        get_local_storage().delete_company(comp_id)
+    fetch_survey_company.clear()
+    clear_closed_period_cache()
     st.success("✅ Empresa excluída com sucesso!")
     time.sleep(1)
     st.rerun()
@@ -762,9 +2119,10 @@ def delete_user(username):
             supabase.table('admin_users').delete().eq('username', username).execute()
         except: 
             pass
-    
-    if username in st.session_state.users_db:
-        del st.session_state.users_db[username]
+        invalidate_data_cache()
+    else:
+        get_local_storage().delete_user(username)
+    st.session_state.users_db.pop(username, None)
     
     st.success("✅ Usuário excluído!")
     time.sleep(1)
@@ -1048,6 +2406,1483 @@ def gerar_banco_sugestoes(dimensoes):
         
     return sugestoes
 
+# ==============================================================================
+# 4.7 DOCUMENTOS EM HTML (LAUDO TÉCNICO E DOSSIÊ EVOLUTIVO)
+# ==============================================================================
+# Funções puras (sem widgets): a tela coleta os parâmetros e só chama o construtor,
+# o que permite gerar e medir os documentos fora do Streamlit (ver benchmarks/).
+# Cada documento é um casco estático (CSS, cabeçalho, textos legais e marca) compilado uma vez
+# por versão da configuração da plataforma, com marcadores [[bloco]] onde entram os dados.
+# Por requisição só os blocos da empresa são renderizados, e a saída sai em trechos (stream).
+TEMPLATE_SLOT = re.compile(r"\[\[(\w+)\]\]")
+REPORT_TEMPLATE_MAX_ENTRIES = 16
+
+class ReportTemplate:
+    """Casco HTML pré-compilado: trechos estáticos intercalados com os nomes dos blocos de dados."""
+    def __init__(self, source):
+        parts = TEMPLATE_SLOT.split(source)
+        self.static = parts[0::2]
+        self.slots = parts[1::2]
+
+    def stream(self, blocks):
+        """
+        Gera o documento trecho a trecho. Cada bloco é uma string ou um iterável de strings
+        (consumido uma única vez: blocos que aparecem mais de uma vez no casco devem ser strings).
+        """
+        for static, slot in zip(self.static, self.slots):
+            yield static
+            block = blocks[slot]
+            if isinstance(block, str):
+                yield block
+            else:
+                yield from block
+        yield self.static[-1]
+
+    def render(self, blocks):
+        return "".join(self.stream(blocks))
+
+@st.cache_resource
+def get_report_template_cache():
+    """Cascos compilados por (tipo de documento, versão da marca), compartilhados entre sessões."""
+    return {"templates": {}, "lock": threading.Lock()}
+
+def report_brand_version():
+    """
+    Versão da marca impressa nos documentos: a própria configuração da plataforma (nome, logo...)
+    como tupla. O hash de cada string fica guardado no objeto, então a chave sai barata mesmo
+    com o logo em base64; salvar uma nova configuração gera outra versão e recompila os cascos.
+    """
+    cfg = st.session_state.platform_config
+    return tuple((k, v if isinstance(v, (str, int, float, bool, type(None))) else repr(v)) for k, v in cfg.items())
+
+def laudo_shell(logo_html):
+    return f"""
+    <!DOCTYPE html>
+    <html lang="pt-BR">
+    <head>
+        <meta charset="utf-8">
+        <title>Dossiê Técnico Institucional - [[razao_titulo]]</title>
+        <style>
+            body {{
+                font-family: 'Segoe UI', 'Helvetica Neue', Helvetica, Arial, sans-serif;
+                padding: 30mm 20mm;
+                color: #2c3e50;
+                background-color: #ffffff;
+                line-height: 1.6;
+                max-width: 210mm;
+                margin: 0 auto;
+            }}
+            h4 {{
+                color: {COR_PRIMARIA};
+                border-left: 5px solid {COR_SECUNDARIA};
+                padding-left: 12px;
+                margin-top: 40px;
+                margin-bottom: 15px;
+                font-size: 13px;
+                letter-spacing: 0.5px;
+            }}
+            .caixa-destaque {{
+                background: linear-gradient(135deg, #f8f9fa 0%, #ffffff 100%);
+                padding: 20px;
+                border-radius: 8px;
+                margin-bottom: 25px;
+                border-left: 6px solid {COR_SECUNDARIA};
+                box-shadow: 0 4px 6px rgba(0,0,0,0.02);
+            }}
+            .colunas-flex {{
+                display: flex;
+                gap: 30px;
+                margin-top: 25px;
+                margin-bottom: 25px;
+            }}
+            .coluna-dado {{
+                flex: 1;
+                border: 1px solid #eef2f5;
+                border-radius: 10px;
+                padding: 15px;
+                background-color: #fafbfc;
+            }}
+            .titulo-coluna {{
+                font-weight: 800;
+                font-size: 11px;
+                color: {COR_PRIMARIA};
+                margin-bottom: 12px;
+                text-align: center;
+                text-transform: uppercase;
+                letter-spacing: 1px;
+                border-bottom: 1px solid #eef2f5;
+                padding-bottom: 8px;
+            }}
+            .grid-raiox {{
+                background: #ffffff;
+                border: 1px solid #eef2f5;
+                padding: 20px;
+                border-radius: 10px;
+                margin-bottom: 25px;
+                column-count: 2;
+                column-gap: 50px;
+                box-shadow: 0 2px 4px rgba(0,0,0,0.01);
+            }}
+            @media print {{
+                body {{
+                    padding: 0;
+                    margin: 0;
+                    -webkit-print-color-adjust: exact !important;
+                    print-color-adjust: exact !important;
+                }}
+                .grid-raiox {{
+                    page-break-inside: avoid;
+                }}
+                table {{
+                    page-break-inside: auto;
+                }}
+                tr {{
+                    page-break-inside: avoid;
+                    page-break-after: auto;
+                }}
+                h4 {{
+                    page-break-after: avoid;
+                }}
+            }}
+        </style>
+    </head>
+    <body>
+        <header style="display: flex; justify-content: space-between; align-items: center; border-bottom: 3px solid {COR_PRIMARIA}; padding-bottom: 20px; margin-bottom: 30px;">
+            <div style="flex: 0 0 auto;">{logo_html}</div>
+            <div style="text-align: right; flex: 1;">
+                <div style="font-size: 22px; font-weight: 900; color: {COR_PRIMARIA}; letter-spacing: -0.5px;">LAUDO TÉCNICO HSE-IT</div>
+                <div style="font-size: 12px; color: #7f8c8d; font-weight: 500; text-transform: uppercase; letter-spacing: 1px; margin-top: 4px;">Mapeamento de Riscos Psicossociais (NR-01)</div>
+            </div>
+        </header>
+
+        <div class="caixa-destaque">
+            [[logo_cliente]]
+            <div style="font-size: 10px; color: #95a5a6; margin-bottom: 6px; text-transform: uppercase; font-weight: bold; letter-spacing: 1px;">Entidade Auditada</div>
+            <div style="font-weight: 900; font-size: 18px; margin-bottom: 8px; color: #2c3e50;">[[razao]]</div>
+
+            <div style="display: flex; gap: 40px; margin-top: 15px;">
+                <div>
+                    <div style="font-size: 9px; color: #7f8c8d; text-transform: uppercase;">Registro CNPJ</div>
+                    <div style="font-size: 11px; font-weight: 600; color: #34495e;">[[cnpj]]</div>
+                </div>
+                <div>
+                    <div style="font-size: 9px; color: #7f8c8d; text-transform: uppercase;">Adesão Total da Cota</div>
+                    <div style="font-size: 11px; font-weight: 600; color: #34495e;">[[respondidas]] Vidas Mapeadas</div>
+                </div>
+                <div>
+                    <div style="font-size: 9px; color: #7f8c8d; text-transform: uppercase;">Data de Fechamento (Emissão)</div>
+                    <div style="font-size: 11px; font-weight: 600; color: #34495e;">[[emissao]]</div>
+                </div>
+            </div>
+            <div style="margin-top: 15px; border-top: 1px dashed #ddd; padding-top: 10px;">
+                <div style="font-size: 9px; color: #7f8c8d; text-transform: uppercase;">Endereço de Faturamento e Auditoria</div>
+                <div style="font-size: 11px; color: #34495e;">[[endereco]]</div>
+            </div>
+        </div>
+
+        <h4>1. TESE, OBJETIVO E RIGOR METODOLÓGICO</h4>
+        <p style="text-align: justify; font-size: 11px; color: #555;">
+            O presente relatório executivo embasa-se na literatura técnica científica e carrega como objetivo macro identificar, catalogar e mensurar através de score a existência de potencias fatores nocivos de risco psicossocial permeando as malhas do ambiente de trabalho desta Organização Cliente.
+            <br><br>
+            Para garantir lisura ao processo, a plataforma tecnológica encarregou-se de transcrever e calcular os algoritmos validados mundialmente pelo <strong>HSE Management Standards Indicator Tool</strong> (Reino Unido), convergindo suas normativas para atender diretamente às exigências modernas estipuladas pelo GRO/PGR no escopo da Norma Regulamentadora Brasileira nº 01 (NR-01).
+            <br><br>
+            A engenharia da metodologia escaneia com rigor absoluto 7 (sete) dimensões indissociáveis da saúde mental laborativa: Compressão de Nível de Demandas, Soberania e Autonomia (Controle Organizacional), Suporte Estrutural Liderança (Gestor), Solidariedade Setorial (Pares), Textura e Qualidade dos Relacionamentos Interpessoais, Clareza de Papel Individual, e fluidez da Gestão na Curva de Mudança Institucional.
+        </p>
+
+        <div class="colunas-flex">
+            <div class="coluna-dado">
+                <div class="titulo-coluna">2. SCORE MASTER DA ORGANIZAÇÃO</div>
+                <div style="text-align: center; padding: 15px; font-family: 'Helvetica Neue', Helvetica, sans-serif;">
+                    <div style="font-size: 32px; font-weight: 900; color: {COR_PRIMARIA}; text-shadow: 1px 1px 0px rgba(0,0,0,0.05);">
+                        [[score]] <span style="font-size: 14px; font-weight: normal; color: #a0a0a0;">/ 5.00 Máx</span>
+                    </div>
+                    <div style="width: 100%; background: #e0e0e0; height: 16px; border-radius: 8px; margin-top: 10px; position: relative; overflow: hidden; box-shadow: inset 0 2px 4px rgba(0,0,0,0.1);">
+                        <div style="position: absolute; left: 0; top: 0; width: [[score_width]]%; background: linear-gradient(90deg, {COR_PRIMARIA} 0%, {COR_SECUNDARIA} 100%); height: 16px; border-radius: 8px;"></div>
+                    </div>
+                    <div style="font-size: 10px; color: #7f8c8d; margin-top: 8px; letter-spacing: 1px; text-transform: uppercase;">
+                        Coeficiente Geral do Ecossistema
+                    </div>
+                </div>
+            </div>
+            <div class="coluna-dado">
+                <div class="titulo-coluna">3. RAIZ E MATRIZ PONTUAL DAS DIMENSÕES</div>
+                <table style="width: 100%; font-size: 10px; font-family: 'Helvetica Neue', Helvetica, sans-serif; border-collapse: collapse; margin-top: 5px;">
+                    <thead>
+                        <tr style="background-color: #f8f9fa;">
+                            <th style="text-align: left; padding: 8px 10px; border-bottom: 2px solid #ddd; color: #555;">Dimensão Investigada</th>
+                            <th style="text-align: right; padding: 8px 10px; border-bottom: 2px solid #ddd; color: #555;">Nota Obtida</th>
+                        </tr>
+                    </thead>
+                    <tbody>
+                        [[radar_rows]]
+                    </tbody>
+                </table>
+            </div>
+        </div>
+
+        <h4>4. MAPA DE DIAGNÓSTICO DETALHADO POR DIMENSÃO DE SAÚDE</h4>
+        <div style="display: flex; flex-wrap: wrap; margin-bottom: 30px; gap: 8px;">
+            [[dimensoes]]
+        </div>
+        [[benchmark]]
+        <h4>5. VARREDURA RAIO-X DOS 35 FATORES DE RISCO INTERNOS AVALIADOS</h4>
+        <p style="font-size: 10px; color: #777; margin-bottom: 15px; margin-top: -10px; font-style: italic;">
+            Nota técnica de interpretação de leitura: As barras gráficas ilustradas abaixo representam o grau de fragilidade (ou exposição perigosa) do grupo avaliado em relação a cada afirmação da pesquisa. Porcentagens acentuadamente altas, sinalizadas na paleta de cores quentes, requerem atenção mandatória nos planos de remediação.
+        </p>
+        <div class="grid-raiox">
+            [[raiox]]
+        </div>
+
+        <div style="page-break-before: always;"></div>
+
+        <h4>6. ARQUITETURA DO PLANO DE AÇÃO ESTRATÉGICO SUGERIDO PELA IA (GRO)</h4>
+        <p style="font-size: 10px; color: #777; margin-bottom: 15px; margin-top: -10px; font-style: italic;">
+            A tabela subsequente foi refinada pelo algoritmo consultivo para combater diretamente e com máxima eficiência as maiores ameaças listadas nas piores pontuações encontradas no radar de escaneamento interno.
+        </p>
+        <table style="width: 100%; border-collapse: collapse; font-size: 10px; font-family: 'Helvetica Neue', Helvetica, Arial, sans-serif; box-shadow: 0 0 0 1px #eef2f5; border-radius: 8px; overflow: hidden;">
+            <thead>
+                <tr style="background-color: {COR_PRIMARIA}; color: #ffffff;">
+                    <th style="padding: 12px 10px; text-align: left; font-weight: 600; letter-spacing: 0.5px;">AÇÃO MACRO / TÍTULO</th>
+                    <th style="padding: 12px 10px; text-align: left; font-weight: 600; letter-spacing: 0.5px;">DESDOBRAMENTO E ESTRATÉGIA PRÁTICA DETALHADA</th>
+                    <th style="padding: 12px 10px; text-align: center; font-weight: 600; letter-spacing: 0.5px;">ÁREA FOCO</th>
+                    <th style="padding: 12px 10px; text-align: left; font-weight: 600; letter-spacing: 0.5px;">ATOR RESPONSÁVEL</th>
+                    <th style="padding: 12px 10px; text-align: left; font-weight: 600; letter-spacing: 0.5px;">TIMELINE/PRAZO</th>
+                </tr>
+            </thead>
+            <tbody>
+                [[acoes]]
+            </tbody>
+        </table>
+
+        <h4>7. DESPACHO E CONCLUSÃO TÉCNICA EMANADA DO LAUDO AUDITADO</h4>
+        <div style="text-align: justify; font-size: 11px; line-height: 1.8; background-color: #f8fbfc; padding: 25px; border-radius: 8px; border: 1px solid #eef2f5; color: #444; white-space: pre-wrap;">
+            [[analise]]
+        </div>
+
+        <div style="margin-top: 80px; display: flex; justify-content: space-around; gap: 60px;">
+            <div style="flex: 1; text-align: center; border-top: 1px solid #2c3e50; padding-top: 12px;">
+                <div style="font-weight: 800; font-size: 12px; color: #2c3e50; text-transform: uppercase;">[[sig_empresa_nome]]</div>
+                <div style="color: #7f8c8d; font-size: 10px; margin-top: 4px;">[[sig_empresa_cargo]]</div>
+                <div style="color: #95a5a6; font-size: 9px; margin-top: 2px;">Assinatura por delegação da Contratante</div>
+            </div>
+            <div style="flex: 1; text-align: center; border-top: 1px solid #2c3e50; padding-top: 12px;">
+                <div style="font-weight: 800; font-size: 12px; color: #2c3e50; text-transform: uppercase;">[[sig_tecnico_nome]]</div>
+                <div style="color: #7f8c8d; font-size: 10px; margin-top: 4px;">[[sig_tecnico_cargo]]</div>
+                <div style="color: #95a5a6; font-size: 9px; margin-top: 2px;">Chancela Técnica Eletrônica da Especialista</div>
+            </div>
+        </div>
+
+        <div style="margin-top: 40px; border-top: 1px solid #ccc; padding-top: 15px; font-size: 8px; color: #888; text-align: justify; font-family: 'Helvetica Neue', Helvetica, sans-serif; line-height: 1.4;">
+            <strong>TERMO DE CONFIDENCIALIDADE E PROTEÇÃO ESTRITA DE DADOS (LGPD):</strong> Este instrumento avaliativo de saúde ocupacional corporativa foi confeccionado utilizando complexos métodos de criptografia de banco de dados e obfuscação de entidades. Os resultados e matrizes de calor apresentados neste dossiê carregam a premissa irrevogável do anonimato. Nenhum número, gráfico, tabela ou insight aqui delineado é capaz de identificar participantes do corpo colaborativo individualmente ou quebrar a barreira do sigilo profissional garantido pela Lei Geral de Proteção de Dados Pessoais (Lei nº 13.709/2018).
+        </div>
+    </body>
+    </html>
+    """
+
+def dossie_shell(logo_html):
+    return f"""
+    <!DOCTYPE html>
+    <html lang="pt-BR">
+    <head>
+        <meta charset="utf-8">
+        <title>Relatório Evolutivo HSE</title>
+        <style>
+            body {{
+                font-family: 'Segoe UI', 'Helvetica Neue', Helvetica, Arial, sans-serif;
+                padding: 40px 30px;
+                color: #2c3e50;
+                background: white;
+                line-height: 1.6;
+            }}
+            .linha-divisor {{ border-bottom: 2px solid {COR_PRIMARIA}; padding-bottom: 15px; margin-bottom: 25px; display: flex; justify-content: space-between; align-items: center; }}
+            .box-infos {{ background: #f8fbfc; padding: 20px; border-radius: 8px; margin-bottom: 25px; border-left: 5px solid {COR_SECUNDARIA}; }}
+            h4 {{ color: {COR_PRIMARIA}; border-left: 4px solid {COR_SECUNDARIA}; padding-left: 12px; margin-top: 35px; font-size: 14px; text-transform: uppercase; }}
+            .tabela-kpi {{ width: 100%; border-collapse: collapse; font-size: 12px; margin-bottom: 30px; box-shadow: 0 0 0 1px #eef2f5; border-radius: 6px; overflow: hidden; }}
+            .tabela-kpi th {{ background-color: {COR_PRIMARIA}; color: white; padding: 12px; text-align: center; font-weight: 600; letter-spacing: 0.5px; }}
+            .tabela-kpi td {{ padding: 12px; border-bottom: 1px solid #eef2f5; text-align: center; color: #34495e; }}
+            .tabela-kpi td:first-child {{ text-align: left; font-weight: 600; }}
+            .rodape {{ margin-top: 60px; font-size: 9px; color: #95a5a6; text-align: center; border-top: 1px dashed #e0e6ed; padding-top: 15px; letter-spacing: 0.5px; text-transform: uppercase; }}
+        </style>
+    </head>
+    <body>
+        <div class="linha-divisor">
+            <div>{logo_html}</div>
+            <div style="text-align:right;">
+                <div style="font-size:20px; font-weight:900; color:{COR_PRIMARIA}; letter-spacing: -0.5px;">DOSSIÊ TÉCNICO EVOLUTIVO</div>
+                <div style="font-size:11px; color:#7f8c8d; font-weight:600; letter-spacing: 1px;">Análise Comparativa Temporal de Saúde Ocupacional Corporativa</div>
+            </div>
+        </div>
+
+        <div class="box-infos">
+            <div style="font-size:10px; color:#95a5a6; margin-bottom:6px; font-weight: 800; letter-spacing: 1px;">DADOS CADASTRAIS DA ORGANIZAÇÃO AUDITADA</div>
+            <div style="font-weight:900; font-size:16px; margin-bottom:8px; color:#2c3e50;">[[razao]]</div>
+            <div style="display: flex; gap: 20px; margin-top: 10px;">
+                <div style="font-size:11px;"><strong>CNPJ Atrelado:</strong> <span style="color:#7f8c8d;">[[cnpj]]</span></div>
+                <div style="font-size:11px;"><strong>Janelas Temporais Sob Análise Crítica Restrita:</strong> <span style="color:{COR_PRIMARIA}; font-weight: bold; background: #eef2f5; padding: 2px 6px; border-radius: 4px;">[[periodo_a]]</span> VERSUS <span style="color:{COR_PRIMARIA}; font-weight: bold; background: #eef2f5; padding: 2px 6px; border-radius: 4px;">[[periodo_b]]</span></div>
+            </div>
+        </div>
+
+        <h4>1. PAINEL DE RESUMO DA MATRIZ DE INDICADORES CHAVE (OVERALL KPIs)</h4>
+        <table class="tabela-kpi">
+            <tr>
+                <th>SINTOMA / INDICADOR ANALISADO</th>
+                <th>MARCO REFERÊNCIA [[[periodo_a]]]</th>
+                <th>MARCO CONSTATADO [[[periodo_b]]]</th>
+                <th>VARIAÇÃO LÍQUIDA (DELTA)</th>
+            </tr>
+            [[kpi_rows]]
+        </table>
+
+        <h4>2. REPRESENTAÇÃO VISUAL DA TENSÃO E EQUILÍBRIO GRÁFICO</h4>
+        <div style="padding: 25px; border: 1px solid #e0e6ed; border-radius: 12px; font-family: 'Helvetica Neue', Helvetica, Arial, sans-serif; background: #ffffff; box-shadow: 0 4px 15px rgba(0,0,0,0.03);">
+            [[barras]]
+        </div>
+
+        <h4>3. EXPOSIÇÃO E ANÁLISE TÉCNICA PRELIMINAR DOS RESULTADOS</h4>
+        <p style="text-align:justify; font-size:12px; line-height:1.7; background:#fbfcfd; padding:20px; border-radius:8px; border: 1px solid #eef2f5; color: #444;">A análise metodológica e estruturada, fruto do levantamento de dados contínuos comparando os dois recortes delimitados, demonstra estatisticamente <strong>[[texto_evolucao]]</strong> nos índices gerais balizadores do vasto ecossistema de saúde mental e gestão de pressões internas nesta frente corporativa.<br><br>Recomenda-se terminantemente aos diretores, RH e SESMT responsáveis não só garantir a manutenção contínua e incansável dos protocolos protetivos de acompanhamento já vigentes, mas seguir com firmeza incontestável a execução e o compliance da Matriz do Plano de Ação Estratégico. Atenção irredutível e foco de reestruturação prioritário devem incidir sem delongas sobre os times ou dimensões mapeadas que, inegavelmente, não foram hábeis o suficiente para demonstrar oscilação benéfica de variação estatística positiva nesse último ciclo.</p>
+        [[significancia]]
+        <div class="rodape">
+            Plataforma Elo NR-01 Enterprise Core | Inteligência em Dados e Saúde Mental no Trabalho<br>Documento Oficial Sigiloso e Criptografado de Caráter Único e Exclusivamente Analítico
+        </div>
+    </body>
+    </html>
+    """
+
+REPORT_SHELLS = {"laudo": laudo_shell, "dossie": dossie_shell}
+
+def report_template(kind):
+    """Casco compilado do documento para a marca atual (compila na primeira vez que a versão aparece)."""
+    cache = get_report_template_cache()
+    key = (kind, report_brand_version())
+    template = cache["templates"].get(key)
+    if template is None:
+        template = ReportTemplate(REPORT_SHELLS[kind](get_logo_html(150)))
+        with cache["lock"]:
+            if len(cache["templates"]) >= REPORT_TEMPLATE_MAX_ENTRIES:
+                cache["templates"].pop(next(iter(cache["templates"])))
+            cache["templates"][key] = template
+    return template
+
+# --- BLOCOS DE DADOS DO LAUDO ---
+def laudo_dimension_cards(dimensoes):
+    """Cards do mapa de diagnóstico por dimensão, um trecho por dimensão."""
+    for dim, nota in dimensoes.items():
+        cor_card = COR_RISCO_ALTO if nota < 3 else (COR_RISCO_MEDIO if nota < 4 else COR_RISCO_BAIXO)
+        label_card = "CENÁRIO CRÍTICO" if nota < 3 else ("MOMENTO DE ATENÇÃO" if nota < 4 else "AMBIENTE SEGURO")
+        yield f"""
+            <div style="flex: 1; min-width: 85px; background-color: #fcfcfc; border: 1px solid #e0e0e0; padding: 8px; border-radius: 6px; margin: 4px; text-align: center; font-family: 'Helvetica Neue', Helvetica, sans-serif; box-shadow: inset 0 -2px 0 {cor_card};">
+                <div style="font-size: 8px; color: #555; text-transform: uppercase; letter-spacing: 0.5px; font-weight: bold;">{dim}</div>
+                <div style="font-size: 16px; font-weight: 800; color: {cor_card}; margin: 4px 0;">{nota:.1f}</div>
+                <div style="font-size: 7px; color: #777; background: #eee; padding: 2px; border-radius: 2px;">{label_card}</div>
+            </div>
+            """
+
+def laudo_heatmap_rows(hse_questions, detalhes_heatmap):
+    """Raio-X das perguntas (mapa de calor): cabeçalho de cada dimensão seguido das barras de exposição."""
+    for cat, pergs in hse_questions.items():
+        yield f"""
+            <div style="font-weight: bold; color: {COR_PRIMARIA}; font-size: 11px; margin-top: 14px; margin-bottom: 6px; border-bottom: 2px solid #eaeaea; font-family: 'Helvetica Neue', Helvetica, sans-serif; padding-bottom: 2px;">
+                {cat.upper()}
+            </div>
+            """
+        for q in pergs:
+            # Percentual de exposição pré-calculado pelo motor analítico (None = ninguém respondeu ainda)
+            val = detalhes_heatmap.get(q['q'])
+            if val is None:
+                c_bar, txt_exposicao, val_width = "#cccccc", "Sem Respostas", 0
+            else:
+                c_bar = COR_RISCO_ALTO if val >= 50 else (COR_RISCO_MEDIO if val >= 25 else COR_RISCO_BAIXO)
+                txt_exposicao, val_width = f"{val}% Exposição", val
+            yield f"""
+            <div style="margin-bottom: 6px; font-family: 'Helvetica Neue', Helvetica, sans-serif;">
+                <div style="display: flex; justify-content: space-between; align-items: flex-end; font-size: 9px; margin-bottom: 2px;">
+                    <span style="color: #444; width: 85%; white-space: nowrap; overflow: hidden; text-overflow: ellipsis;" title="{q['q']}">{q['q']}</span>
+                    <span style="color: {c_bar}; font-weight: bold; font-size: 8px;">{txt_exposicao}</span>
+                </div>
+                <div style="width: 100%; background-color: #f0f0f0; height: 6px; border-radius: 3px; overflow: hidden; box-shadow: inset 0 1px 2px rgba(0,0,0,0.05);">
+                    <div style="width: {val_width}%; background-color: {c_bar}; height: 100%; border-radius: 3px; transition: width 0.5s ease-in-out;"></div>
+                </div>
+            </div>
+            """
+
+def laudo_action_rows(acoes_list):
+    """Linhas da matriz do plano de ação."""
+    if not acoes_list:
+        yield "<tr><td colspan='5' style='text-align: center; padding: 20px; color: #999;'>Matriz de ações não preenchida pelo corpo técnico.</td></tr>"
+        return
+    for i in acoes_list:
+        yield f"""
+                <tr>
+                    <td style="padding: 10px; border-bottom: 1px solid #eef0f2; font-weight: bold; color: #2c3e50;">{i.get('acao','')}</td>
+                    <td style="padding: 10px; border-bottom: 1px solid #eef0f2; color: #555;">{i.get('estrat','')}</td>
+                    <td style="padding: 10px; border-bottom: 1px solid #eef0f2; text-align: center;"><span style="background: #eef2f5; padding: 3px 6px; border-radius: 4px; font-size: 8px; color: #34495e;">{i.get('area','')}</span></td>
+                    <td style="padding: 10px; border-bottom: 1px solid #eef0f2; font-style: italic; color: #7f8c8d;">{i.get('resp','')}</td>
+                    <td style="padding: 10px; border-bottom: 1px solid #eef0f2; font-weight: bold; color: {COR_PRIMARIA};">{i.get('prazo','')}</td>
+                </tr>
+                """
+
+def laudo_radar_rows(dimensoes):
+    for k, v in dimensoes.items():
+        yield f"""
+                        <tr>
+                            <td style='padding: 6px 10px; border-bottom: 1px solid #f0f0f0; color: #444; font-weight: 500;'>{k}</td>
+                            <td style='padding: 6px 10px; text-align: right; border-bottom: 1px solid #f0f0f0; font-weight: bold; color: {COR_PRIMARIA};'>{v:.1f}</td>
+                        </tr>
+                        """
+
+def laudo_benchmark_section(benchmark):
+    """Posicionamento setorial (percentis no grupo CNAE x grau de risco); vazio sem grupo publicável."""
+    if not benchmark:
+        return ""
+    linhas_bench = "".join(f"""
+            <tr>
+                <td style='padding: 6px 10px; border-bottom: 1px solid #f0f0f0; color: #444; font-weight: 500;'>{u['unidade']}</td>
+                <td style='padding: 6px 10px; text-align: center; border-bottom: 1px solid #f0f0f0; font-weight: bold; color: {COR_PRIMARIA};'>{u['valor']:.1f}</td>
+                <td style='padding: 6px 10px; text-align: center; border-bottom: 1px solid #f0f0f0; color: #555;'>{u['mediana']:.1f}</td>
+                <td style='padding: 6px 10px; text-align: center; border-bottom: 1px solid #f0f0f0; font-weight: bold; color: {COR_RISCO_ALTO if u['percentil'] < 25 else (COR_RISCO_MEDIO if u['percentil'] < 50 else COR_RISCO_BAIXO)};'>{u['percentil']}º</td>
+            </tr>
+            """ for u in benchmark['unidades'] if u['tipo'] != 'pergunta')
+    return f"""
+        <h4>4.1 POSICIONAMENTO FRENTE AO SETOR (BENCHMARK {benchmark['grupo'].upper()})</h4>
+        <p style="font-size: 10px; color: #777; margin-bottom: 15px; margin-top: -10px; font-style: italic;">
+            Comparação anônima com {benchmark['empresas']} organizações do mesmo grupo de referência. O percentil indica a parcela de empresas do grupo com nota igual ou inferior (quanto maior, melhor).
+        </p>
+        <table style="width: 100%; font-size: 10px; font-family: 'Helvetica Neue', Helvetica, sans-serif; border-collapse: collapse; margin-bottom: 30px;">
+            <thead>
+                <tr style="background-color: #f8f9fa;">
+                    <th style="text-align: left; padding: 8px 10px; border-bottom: 2px solid #ddd; color: #555;">Indicador</th>
+                    <th style="padding: 8px 10px; border-bottom: 2px solid #ddd; color: #555;">Nota da Empresa</th>
+                    <th style="padding: 8px 10px; border-bottom: 2px solid #ddd; color: #555;">Mediana do Setor</th>
+                    <th style="padding: 8px 10px; border-bottom: 2px solid #ddd; color: #555;">Percentil no Setor</th>
+                </tr>
+            </thead>
+            <tbody>
+                {linhas_bench}
+            </tbody>
+        </table>
+        """
+
+def stream_laudo_html(empresa, hse_questions, acoes_list, analise_texto, sig_empresa_nome, sig_empresa_cargo, sig_tecnico_nome, sig_tecnico_cargo, benchmark=None):
+    """
+    Gera o Laudo Técnico HSE-IT da empresa em trechos, sobre o casco compilado da marca atual.
+    `benchmark` (resultado de BenchmarkIndex.percentiles) acrescenta o posicionamento frente ao setor.
+    """
+    logo_cliente_html = ""
+    logo_cliente_uri = logo_data_uri(empresa)
+    if logo_cliente_uri:
+        logo_cliente_html = f"<img src='{logo_cliente_uri}' width='110' style='float:right; margin-left: 15px; border-radius:4px; box-shadow: 0px 2px 4px rgba(0,0,0,0.1);'>"
+    dimensoes = empresa.get('dimensoes') or {}
+    score_final_empresa = empresa.get('score', 0)
+    return report_template("laudo").stream({
+        "razao_titulo": str(empresa['razao']),
+        "logo_cliente": logo_cliente_html,
+        "razao": str(empresa.get('razao', 'Razão Social Não Informada')),
+        "cnpj": str(empresa.get('cnpj', 'Não Especificado')),
+        "respondidas": str(empresa.get('respondidas', 0)),
+        "emissao": datetime.datetime.now().strftime('%d de %B de %Y'),
+        "endereco": str(empresa.get('endereco', 'Sem endereço de auditoria configurado no sistema.')),
+        "score": f"{score_final_empresa:.2f}",
+        "score_width": str((score_final_empresa / 5.0) * 100),
+        "radar_rows": laudo_radar_rows(dimensoes),
+        "dimensoes": laudo_dimension_cards(dimensoes),
+        "benchmark": laudo_benchmark_section(benchmark),
+        "raiox": laudo_heatmap_rows(hse_questions, empresa.get('detalhe_perguntas', {})),
+        "acoes": laudo_action_rows(acoes_list),
+        "analise": str(analise_texto),
+        "sig_empresa_nome": str(sig_empresa_nome),
+        "sig_empresa_cargo": str(sig_empresa_cargo),
+        "sig_tecnico_nome": str(sig_tecnico_nome),
+        "sig_tecnico_cargo": str(sig_tecnico_cargo),
+    })
+
+def build_laudo_html(empresa, hse_questions, acoes_list, analise_texto, sig_empresa_nome, sig_empresa_cargo, sig_tecnico_nome, sig_tecnico_cargo, benchmark=None):
+    """Laudo Técnico HSE-IT completo numa única string (pronto para impressão em PDF pelo navegador)."""
+    return "".join(stream_laudo_html(empresa, hse_questions, acoes_list, analise_texto, sig_empresa_nome, sig_empresa_cargo, sig_tecnico_nome, sig_tecnico_cargo, benchmark))
+
+# --- BLOCOS DE DADOS DO DOSSIÊ ---
+def dossie_evolution_text(diff_score, significancia=None):
+    """Conclusão do dossiê (HTML e PDF): pelo teste de significância quando houver, senão pelo sinal da diferença."""
+    conclusao_geral = significancia[0]['Conclusão'] if significancia else None
+    if conclusao_geral == "Melhora significativa":
+        return "uma melhoria estatisticamente significativa (IC 95%)"
+    if conclusao_geral == "Piora significativa":
+        return "uma queda estatisticamente significativa (IC 95%), que denota forte ponto de atenção crítico imediato"
+    if conclusao_geral == "Sem diferença significativa":
+        return "uma oscilação dentro da margem de variação amostral (sem diferença estatisticamente significativa), o que exige vigília contínua"
+    return "uma melhoria palpável e generalizada" if diff_score > 0 else "um platô de estabilidade que exige vigília contínua, ou, de modo agravante, uma sinalização técnica de queda que denota forte ponto de atenção crítico imediato"
+
+def dossie_kpi_rows(dados_a, dados_b):
+    diff_score = dados_b['score'] - dados_a['score']
+    return f"""
+            <tr>
+                <td>Score Geral da Organização (Cálculo Composto)</td>
+                <td>{dados_a['score']}</td>
+                <td>{dados_b['score']}</td>
+                <td style="font-weight:900; color:{'#27ae60' if diff_score > 0 else '#c0392b'};">{diff_score:+.2f} pts</td>
+            </tr>
+            <tr>
+                <td>Taxa Bruta de Adesão e Participação Censitária (%)</td>
+                <td>{dados_a['adesao']}%</td>
+                <td>{dados_b['adesao']}%</td>
+                <td style="font-weight:bold; color:#7f8c8d;">{(dados_b['adesao'] - dados_a['adesao']):+.1f}% de tração</td>
+            </tr>
+            """
+
+def dossie_score_bars(periodo_a, periodo_b, dados_a, dados_b):
+    """Barras de score dos dois períodos (CSS inline, para impressão offline)."""
+    for periodo, dados, cor, margem in ((periodo_a, dados_a, COR_COMP_A, ' style="margin-bottom: 25px;"'), (periodo_b, dados_b, COR_COMP_B, "")):
+        yield f"""
+            <div{margem}>
+                <div style="display: flex; justify-content: space-between; align-items: baseline; margin-bottom: 8px;">
+                    <strong style="color: #34495e; font-size: 12px; text-transform: uppercase; letter-spacing: 0.5px;">Volume e Score da Análise Período [{periodo}]:</strong>
+                    <span style="font-size: 24px; font-weight: 900; color: {cor}">{dados['score']} <span style="font-size: 12px; color: #aab7b8;">/ 5.0</span></span>
+                </div>
+                <div style="width: 100%; background: #ecf0f1; height: 18px; border-radius: 9px; overflow: hidden; box-shadow: inset 0 2px 4px rgba(0,0,0,0.06);">
+                   <div style="width: {(dados['score']/5)*100}%; background: {cor}; height: 18px; border-radius: 9px;"></div>
+                </div>
+            </div>
+            """
+
+def dossie_significance_section(periodo_a, periodo_b, significancia):
+    """Seção de intervalos de confiança (linhas de significance_rows); vazia sem teste."""
+    if not significancia:
+        return ""
+    linhas_sig = "".join(
+        f"<tr><td>{r['Indicador']}</td><td>{r['Período A']}</td><td>{r['Período B']}</td><td>{r['Variação (B - A)']}</td><td>{r['p-valor']}</td>"
+        f"<td style='font-weight:bold; color:{'#27ae60' if r['Conclusão'] == 'Melhora significativa' else '#c0392b' if r['Conclusão'] == 'Piora significativa' else '#7f8c8d'};'>{r['Conclusão']}</td></tr>"
+        for r in significancia
+    )
+    return f"""
+        <h4>4. SIGNIFICÂNCIA ESTATÍSTICA DAS VARIAÇÕES (INTERVALOS DE CONFIANÇA DE 95%)</h4>
+        <table class="tabela-kpi">
+            <tr><th>INDICADOR</th><th>MÉDIA [IC 95%] - {periodo_a}</th><th>MÉDIA [IC 95%] - {periodo_b}</th><th>VARIAÇÃO [IC 95%]</th><th>P-VALOR</th><th>CONCLUSÃO</th></tr>
+            {linhas_sig}
+        </table>
+        <p style="font-size:10px; color:#7f8c8d;">{SIGNIFICANCE_NOTE}</p>
+        """
+
+def stream_dossie_html(empresa, periodo_a, periodo_b, dados_a, dados_b, significancia=None):
+    """
+    Gera o Dossiê Técnico Evolutivo (comparativo Período A x Período B) em trechos.
+    `significancia` (linhas de significance_rows, com o Score Geral primeiro) acrescenta a seção
+    de intervalos de confiança e baseia a conclusão no teste, e não só no sinal da diferença.
+    """
+    return report_template("dossie").stream({
+        "razao": str(empresa['razao']),
+        "cnpj": str(empresa.get('cnpj', 'Não Especificado no Sistema')),
+        "periodo_a": str(periodo_a),
+        "periodo_b": str(periodo_b),
+        "kpi_rows": dossie_kpi_rows(dados_a, dados_b),
+        "barras": dossie_score_bars(periodo_a, periodo_b, dados_a, dados_b),
+        "texto_evolucao": dossie_evolution_text(dados_b['score'] - dados_a['score'], significancia),
+        "significancia": dossie_significance_section(periodo_a, periodo_b, significancia),
+    })
+
+def build_dossie_html(empresa, periodo_a, periodo_b, dados_a, dados_b, significancia=None):
+    """Dossiê Técnico Evolutivo completo numa única string."""
+    return "".join(stream_dossie_html(empresa, periodo_a, periodo_b, dados_a, dados_b, significancia))
+
+def report_html_pages(html):
+    """
+    Divide o documento em páginas de pré-visualização: a capa e uma página por seção (<h4>),
+    cada uma com o <head> (CSS) do documento. Assim a prévia envia só a seção escolhida ao navegador.
+    """
+    partes = html.split("<h4>")
+    head = partes[0][:partes[0].index("<body>") + len("<body>")]
+    paginas = [("Capa", partes[0] + "</body></html>")]
+    for parte in partes[1:]:
+        titulo = parte[:parte.index("</h4>")].strip()
+        paginas.append((titulo, head + "<h4>" + parte))
+    return paginas
+
+# ==============================================================================
+# 4.8 SOMAS ACUMULADAS POR DIA (COMPARAÇÃO DE INTERVALOS ARBITRÁRIOS A x B)
+# ==============================================================================
+class CompanyPrefixSums:
+    """
+    Somas de prefixo por dia de uma empresa: para cada dia com respostas, a soma acumulada
+    (desde o primeiro dia) das notas e das contagens válidas por pergunta e dos respondentes.
+    Qualquer intervalo [início, fim] sai de duas buscas binárias e uma subtração de vetores,
+    em O(log dias + perguntas), sem refiltrar nem repontuar as respostas brutas.
+    Também acumula os momentos (n, soma, soma dos quadrados) das unidades estatísticas de cada
+    respondente e guarda os códigos ordenados por dia, para os testes de significância (seção 4.9).
+    Respostas sem data (ou com data ilegível) ficam fora das comparações por intervalo.
+    """
+    def __init__(self, qindex, days, cum_sums, cum_counts, cum_respondents, codes=None, cum_moments=None):
+        self.qindex = qindex
+        self.days = days
+        self.cum_sums = cum_sums
+        self.cum_counts = cum_counts
+        self.cum_respondents = cum_respondents
+        self.codes = codes
+        self.cum_moments = cum_moments
+
+    @classmethod
+    def from_responses(cls, comp_rows, hse_questions):
+        qindex = build_question_index(hse_questions)
+        parsed, _ = parse_created_at_days([r.get('created_at') for r in comp_rows])
+        day_values = parsed.to_numpy(dtype='datetime64[D]')
+        dated = np.flatnonzero(~np.isnat(day_values))
+        days, keys = np.unique(day_values[dated], return_inverse=True)
+        codes = encode_answers_matrix([comp_rows[i] for i in dated.tolist()], qindex)
+        q_sums, q_counts, respondents = group_sums_by_key(keys.astype(np.int64), len(days), codes, qindex)
+        
+        # Linha 0 zerada: o intervalo [i, j) é cum[j] - cum[i]
+        n_q = len(qindex['texts'])
+        cum_sums = np.vstack([np.zeros((1, n_q), dtype=np.int64), np.cumsum(q_sums, axis=0)])
+        cum_counts = np.vstack([np.zeros((1, n_q), dtype=np.int64), np.cumsum(q_counts, axis=0)])
+        cum_respondents = np.concatenate([[0], np.cumsum(respondents)])
+        
+        # Respondentes ordenados por dia: o intervalo de dias [i, j) vira a fatia cum_respondents[i]:cum_respondents[j]
+        codes = codes[np.argsort(keys, kind='stable')]
+        starts = cum_respondents[:-1]
+        cum_moments = []
+        for m in unit_moment_rows(respondent_unit_values(codes, qindex)):
+            per_day = np.add.reduceat(m, starts, axis=0) if len(days) else m[:0]
+            cum_moments.append(np.vstack([np.zeros((1, m.shape[1])), np.cumsum(per_day, axis=0)]))
+        return cls(qindex, days, cum_sums, cum_counts, cum_respondents, codes, cum_moments)
+
+    @property
+    def first_day(self):
+        return self.days[0].astype(datetime.date) if len(self.days) else None
+
+    @property
+    def last_day(self):
+        return self.days[-1].astype(datetime.date) if len(self.days) else None
+
+    def _day_range(self, inicio, fim):
+        i = np.searchsorted(self.days, np.datetime64(inicio, 'D'), side='left')
+        j = np.searchsorted(self.days, np.datetime64(fim, 'D'), side='right')
+        return i, max(i, j)
+
+    def range_sums(self, inicio, fim):
+        """Somas, contagens por pergunta e respondentes do intervalo de datas inclusivo [inicio, fim]."""
+        i, j = self._day_range(inicio, fim)
+        return self.cum_sums[j] - self.cum_sums[i], self.cum_counts[j] - self.cum_counts[i], int(self.cum_respondents[j] - self.cum_respondents[i])
+
+    def range_summary(self, inicio, fim, total_vidas):
+        """Mesmo formato de um item do histórico (periodo, score, vidas, adesao, dimensoes) para o intervalo."""
+        q_sums, q_counts, respondidas = self.range_sums(inicio, fim)
+        dimensoes, score, _ = analytics_from_sums(q_sums, q_counts, self.qindex)
+        return {
+            "periodo": f"{inicio.strftime('%d/%m/%Y')} a {fim.strftime('%d/%m/%Y')}",
+            "score": score,
+            "vidas": total_vidas,
+            "adesao": int((respondidas / total_vidas) * 100) if total_vidas > 0 else 0,
+            "dimensoes": dimensoes,
+            "respondidas": respondidas,
+            "inicio": inicio,
+            "fim": fim
+        }
+
+    def range_moments(self, inicio, fim):
+        """Momentos (n, soma, soma dos quadrados) de cada unidade estatística no intervalo, em O(unidades)."""
+        i, j = self._day_range(inicio, fim)
+        return tuple(cum[j] - cum[i] for cum in self.cum_moments)
+
+    def range_units(self, inicio, fim):
+        """Matriz de unidades dos respondentes do intervalo (usada só no bootstrap de amostras pequenas)."""
+        i, j = self._day_range(inicio, fim)
+        return respondent_unit_values(self.codes[self.cum_respondents[i]:self.cum_respondents[j]], self.qindex)
+
+    def compare_ranges(self, faixa_a, faixa_b):
+        """Intervalos de confiança e teste de significância entre dois intervalos de datas (A x B)."""
+        moments_a, moments_b = self.range_moments(*faixa_a), self.range_moments(*faixa_b)
+        units_a = units_b = None
+        if min(moments_a[0].max(initial=0), moments_b[0].max(initial=0)) < BOOTSTRAP_MIN_N:
+            units_a, units_b = self.range_units(*faixa_a), self.range_units(*faixa_b)
+        return compare_unit_samples(moments_a, moments_b, units_a, units_b)
+
+@st.cache_resource(ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def cached_company_prefix_sums(dataset_cache_key, comp_id, _all_responses, _hse_questions):
+    """Somas de prefixo compartilhadas entre sessões (somente leitura) por versão dos dados e empresa."""
+    return CompanyPrefixSums.from_responses([r for r in _all_responses if str(r.get('company_id')) == str(comp_id)], _hse_questions)
+
+def get_company_prefix_sums(comp_id, all_responses, hse_questions):
+    """Devolve as somas de prefixo da empresa na versão atual dos dados; no modo local monta na hora."""
+    cache_key = st.session_state.get('dataset_cache_key')
+    if cache_key is None:
+        return CompanyPrefixSums.from_responses([r for r in all_responses if str(r.get('company_id')) == str(comp_id)], hse_questions)
+    return cached_company_prefix_sums(cache_key, comp_id, all_responses, hse_questions)
+
+# ==============================================================================
+# 4.9 SIGNIFICÂNCIA ESTATÍSTICA (INTERVALOS DE CONFIANÇA E TESTES A x B)
+# ==============================================================================
+# A unidade amostral é o respondente. Cada linha da matriz de unidades traz a nota de cada pergunta
+# (rev aplicado), a média de cada dimensão e o score geral (média das dimensões respondidas) dele.
+SIGNIFICANCE_ALPHA = 0.05
+CONFIDENCE_Z = 1.959964     # Quantil normal do IC de 95%
+BOOTSTRAP_MIN_N = 30        # Abaixo disso (em qualquer um dos lados) ICs e p-valor vêm do bootstrap
+BOOTSTRAP_RESAMPLES = 2000
+BOOTSTRAP_CHUNK = 250       # Reamostragens por tarefa no pool
+BOOTSTRAP_SEED = 20261018
+
+SIGNIFICANCE_NOTE = (
+    f"Médias por respondente. Teste de Welch para amostras grandes e bootstrap ({BOOTSTRAP_RESAMPLES} reamostragens) "
+    f"quando algum período tem menos de {BOOTSTRAP_MIN_N} respondentes. Diferenças com p-valor abaixo de {SIGNIFICANCE_ALPHA} são consideradas reais."
+)
+
+def stat_units(qindex):
+    """Tipo e rótulo de cada coluna da matriz de unidades: perguntas, dimensões e o score geral."""
+    return [("pergunta", t) for t in qindex['texts']] + [("dimensao", c) for c in qindex['categories']] + [("geral", "Score Geral")]
+
+def respondent_unit_values(codes, qindex):
+    """Matriz (respondentes x unidades) em float, com NaN onde o respondente não tem valor."""
+    valid = codes != MISSING_CODE
+    values = likert_values(codes, qindex).astype(np.float64)
+    n_q, n_cats = len(qindex['texts']), len(qindex['categories'])
+    onehot = np.zeros((n_q, n_cats))
+    onehot[np.arange(n_q), qindex['cat_idx']] = 1.0
+    dim_counts = valid @ onehot
+    dim_means = np.divide(values @ onehot, dim_counts, out=np.full(dim_counts.shape, np.nan), where=dim_counts > 0)
+    n_dims = (dim_counts > 0).sum(axis=1)
+    overall = np.divide(np.nansum(dim_means, axis=1), n_dims, out=np.full(len(codes), np.nan), where=n_dims > 0)
+    return np.hstack([np.where(valid, values, np.nan), dim_means, overall[:, None]])
+
+def unit_moment_rows(units):
+    """Momentos por respondente (1 se válido, valor, valor²), prontos para somar por grupo."""
+    valid = ~np.isnan(units)
+    x = np.where(valid, units, 0.0)
+    return valid.astype(np.float64), x, x * x
+
+def unit_moments(units):
+    """Contagem, soma e soma dos quadrados de cada unidade (NaN ignorado)."""
+    return tuple(m.sum(axis=0) for m in unit_moment_rows(units))
+
+def moments_mean_se(moments):
+    """Média e erro padrão de cada unidade a partir de (n, soma, soma dos quadrados)."""
+    n, total, squares = moments
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(n > 0, total / n, np.nan)
+        var = np.where(n > 1, (squares - total * mean) / (n - 1), np.nan)
+        se = np.sqrt(np.clip(var, 0, None) / n)
+    return mean, se
+
+def _bootstrap_chunk(units_a, units_b, resamples, seed):
+    """Médias reamostradas (com reposição) de A e de B: matrizes (reamostragens x unidades)."""
+    rng = np.random.default_rng(seed)
+    means = []
+    for units in (units_a, units_b):
+        m = unit_moment_rows(units[rng.integers(0, len(units), size=(resamples, len(units)))])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means.append(m[1].sum(axis=1) / m[0].sum(axis=1))
+    return means
+
+@st.cache_resource
+def get_stats_executor():
+    """Pool de threads do bootstrap (o NumPy libera o GIL nas operações vetoriais)."""
+    return ThreadPoolExecutor(max_workers=max(2, os.cpu_count() or 1), thread_name_prefix="elo-stats")
+
+def bootstrap_compare(units_a, units_b, resamples=BOOTSTRAP_RESAMPLES, seed=BOOTSTRAP_SEED):
+    """
+    Bootstrap percentílico das médias de A, de B e da diferença B - A, com as reamostragens
+    divididas em lotes no pool. Semente fixa: a mesma seleção sempre mostra o mesmo resultado.
+    """
+    seeds = np.random.SeedSequence(seed).spawn(math.ceil(resamples / BOOTSTRAP_CHUNK))
+    sizes = [min(BOOTSTRAP_CHUNK, resamples - i * BOOTSTRAP_CHUNK) for i in range(len(seeds))]
+    executor = get_stats_executor()
+    parts = [f.result() for f in [executor.submit(_bootstrap_chunk, units_a, units_b, n, sd) for n, sd in zip(sizes, seeds)]]
+    boot_a = np.vstack([p[0] for p in parts])
+    boot_b = np.vstack([p[1] for p in parts])
+    diff = boot_b - boot_a
+    q = [100 * SIGNIFICANCE_ALPHA / 2, 100 * (1 - SIGNIFICANCE_ALPHA / 2)]
+    with np.errstate(invalid='ignore'):
+        p = np.minimum(1.0, 2 * np.minimum(np.nanmean(diff <= 0, axis=0), np.nanmean(diff >= 0, axis=0)))
+    return np.nanpercentile(boot_a, q, axis=0), np.nanpercentile(boot_b, q, axis=0), np.nanpercentile(diff, q, axis=0), p
+
+def compare_unit_samples(moments_a, moments_b, units_a=None, units_b=None):
+    """
+    Compara A x B em todas as unidades de uma vez. Amostras grandes: IC normal das médias e teste
+    de Welch (aproximação normal da estatística t). Se algum lado tiver menos de BOOTSTRAP_MIN_N
+    respondentes e as matrizes de unidades forem informadas, ICs e p-valor vêm do bootstrap.
+    Unidades com menos de 2 respondentes em algum lado ficam sem teste (p = NaN).
+    """
+    mean_a, se_a = moments_mean_se(moments_a)
+    mean_b, se_b = moments_mean_se(moments_b)
+    n_a, n_b = moments_a[0], moments_b[0]
+    diff = mean_b - mean_a
+    se_diff = np.sqrt(se_a ** 2 + se_b ** 2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z = diff / se_diff
+    p = np.array([math.erfc(abs(v) / math.sqrt(2)) if np.isfinite(v) else (0.0 if d != 0 else 1.0) for v, d in zip(z.tolist(), diff.tolist())])
+    ci_a = np.array([mean_a - CONFIDENCE_Z * se_a, mean_a + CONFIDENCE_Z * se_a])
+    ci_b = np.array([mean_b - CONFIDENCE_Z * se_b, mean_b + CONFIDENCE_Z * se_b])
+    ci_diff = np.array([diff - CONFIDENCE_Z * se_diff, diff + CONFIDENCE_Z * se_diff])
+    method = np.full(len(diff), "Welch", dtype=object)
+    
+    small = (np.minimum(n_a, n_b) < BOOTSTRAP_MIN_N) & (np.minimum(n_a, n_b) >= 2)
+    if small.any() and units_a is not None and units_b is not None and len(units_a) and len(units_b):
+        b_ci_a, b_ci_b, b_ci_diff, b_p = bootstrap_compare(units_a, units_b)
+        ci_a[:, small], ci_b[:, small], ci_diff[:, small], p[small] = b_ci_a[:, small], b_ci_b[:, small], b_ci_diff[:, small], b_p[small]
+        method[small] = "Bootstrap"
+    
+    untestable = np.minimum(n_a, n_b) < 2
+    p[untestable] = np.nan
+    method[untestable] = "-"
+    return {
+        "n_a": n_a, "n_b": n_b, "mean_a": mean_a, "mean_b": mean_b, "diff": diff,
+        "ci_a": ci_a, "ci_b": ci_b, "ci_diff": ci_diff, "p": p,
+        "significant": np.nan_to_num(p, nan=1.0) < SIGNIFICANCE_ALPHA, "method": method
+    }
+
+def compare_setores(comp_rows, setor_a, setor_b, hse_questions):
+    """Teste de significância entre dois setores da mesma empresa (todas as respostas de cada setor)."""
+    qindex = build_question_index(hse_questions)
+    units = []
+    for setor in (setor_a, setor_b):
+        rows = [r for r in comp_rows if (r.get('setor') or "Geral") == setor]
+        units.append(respondent_unit_values(encode_answers_matrix(rows, qindex), qindex))
+    return compare_unit_samples(unit_moments(units[0]), unit_moments(units[1]), units[0], units[1])
+
+def significance_verdict(diff, p):
+    if not np.isfinite(p):
+        return "Amostra insuficiente"
+    if p >= SIGNIFICANCE_ALPHA:
+        return "Sem diferença significativa"
+    return "Melhora significativa" if diff > 0 else "Piora significativa"
+
+def significance_rows(result, hse_questions, kinds=("geral", "dimensao"), min_respondents=MIN_RESPONDENTES_CELULA):
+    """
+    Tabela legível do resultado: média e IC de A e B, diferença, p-valor e conclusão por unidade,
+    na ordem dos tipos pedidos em `kinds` (o Score Geral vem primeiro por padrão).
+    Lados com menos de `min_respondents` respondentes não são exibidos (anonimato/LGPD).
+    """
+    units = list(enumerate(stat_units(build_question_index(hse_questions))))
+    rows = []
+    for u, (kind, label) in [unit for k in kinds for unit in units if unit[1][0] == k]:
+        if min(result['n_a'][u], result['n_b'][u]) < min_respondents:
+            rows.append({"Indicador": label, "Período A": "-", "Período B": "-", "Variação (B - A)": "-", "p-valor": "-", "Método": "-", "Conclusão": "Amostra insuficiente"})
+            continue
+        fmt = lambda m, ci: f"{m:.2f} [{ci[0]:.2f} – {ci[1]:.2f}]"
+        p = result['p'][u]
+        rows.append({
+            "Indicador": label,
+            "Período A": fmt(result['mean_a'][u], result['ci_a'][:, u]),
+            "Período B": fmt(result['mean_b'][u], result['ci_b'][:, u]),
+            "Variação (B - A)": fmt(result['diff'][u], result['ci_diff'][:, u]),
+            "p-valor": f"{p:.3f}" if np.isfinite(p) else "-",
+            "Método": result['method'][u],
+            "Conclusão": significance_verdict(result['diff'][u], p)
+        })
+    return rows
+
+# ==============================================================================
+# 4.10 BENCHMARK SETORIAL (PERCENTIS POR DIVISÃO CNAE x GRAU DE RISCO NR-04)
+# ==============================================================================
+# Grupos de referência com menos empresas que este limite não são publicados (anonimato entre clientes)
+BENCHMARK_MIN_EMPRESAS = 5
+BENCHMARK_COMPANY_COLUMNS = "id, cnae, risco"
+BENCHMARK_PAGE_SIZE = 1000
+
+def cnae_division(cnae):
+    """Divisão CNAE (os 2 primeiros dígitos do código, ex: '86.10-1' -> '86'); None se não houver."""
+    digits = "".join(ch for ch in str(cnae or "") if ch.isdigit())
+    return digits[:2] if len(digits) >= 2 else None
+
+def benchmark_group_keys(company):
+    """Grupos de referência em ordem de preferência: (divisão, grau de risco) e, na falta, só a divisão."""
+    divisao = cnae_division(company.get('cnae'))
+    if divisao is None:
+        return []
+    return [(divisao, company.get('risco')), (divisao, None)]
+
+def benchmark_group_label(key):
+    divisao, risco = key
+    return f"CNAE divisão {divisao} · Grau de Risco {risco}" if risco is not None else f"CNAE divisão {divisao} (todos os graus de risco)"
+
+def benchmark_unit_values(companies, qindex):
+    """Matriz (empresas x unidades) com score geral, dimensões e exposição (%) por pergunta; NaN sem dado."""
+    values = np.full((len(companies), 1 + len(qindex['categories']) + len(qindex['texts'])), np.nan)
+    for i, c in enumerate(companies):
+        dims = c.get('dimensoes') or {}
+        detalhe = c.get('detalhe_perguntas') or {}
+        values[i, 0] = c.get('score', np.nan)
+        values[i, 1:1 + len(qindex['categories'])] = [dims.get(cat, np.nan) for cat in qindex['categories']]
+        values[i, 1 + len(qindex['categories']):] = [detalhe.get(t, np.nan) for t in qindex['texts']]
+    return values
+
+class BenchmarkIndex:
+    """
+    Índice pré-calculado (uma vez por versão dos dados) das distribuições de cada unidade entre as
+    empresas do mesmo grupo de referência. Cada grupo guarda as colunas já ordenadas, então o
+    percentil de uma empresa sai de duas buscas binárias por unidade, sem nova leitura das respostas.
+    Unidades: score geral e dimensões (quanto maior, melhor) e exposição por pergunta (quanto maior, pior).
+    """
+    def __init__(self, qindex, groups, min_empresas=BENCHMARK_MIN_EMPRESAS):
+        self.qindex = qindex
+        self.groups = groups
+        self.min_empresas = min_empresas
+
+    @classmethod
+    def from_companies(cls, companies, hse_questions, min_empresas=BENCHMARK_MIN_EMPRESAS, min_respondentes=MIN_RESPONDENTES_CELULA):
+        """Monta o índice a partir de empresas já processadas (dimensoes, score, detalhe_perguntas, respondidas)."""
+        qindex = build_question_index(hse_questions)
+        elegiveis = [c for c in companies if int(c.get('respondidas') or 0) >= min_respondentes and c.get('score')]
+        values = benchmark_unit_values(elegiveis, qindex)
+        members = {}
+        for i, c in enumerate(elegiveis):
+            for key in benchmark_group_keys(c):
+                members.setdefault(key, []).append(i)
+        # np.sort joga os NaN para o fim de cada coluna; o número de valores válidos fica ao lado
+        groups = {}
+        for key, idx in members.items():
+            if len(idx) >= min_empresas:
+                block = values[idx]
+                groups[key] = (np.sort(block, axis=0), (~np.isnan(block)).sum(axis=0))
+        return cls(qindex, groups, min_empresas)
+
+    def group_for(self, company):
+        """Primeiro grupo publicado para a empresa (com o mínimo de empresas), ou None."""
+        return next((key for key in benchmark_group_keys(company) if key in self.groups), None)
+
+    def percentiles(self, company):
+        """
+        Posição da empresa em cada unidade dentro do seu grupo: percentil (rank médio, 0 a 100),
+        mediana e quartis do grupo. Retorna None se a empresa não tiver grupo publicado.
+        """
+        key = self.group_for(company)
+        if key is None:
+            return None
+        ordered, n_valid = self.groups[key]
+        own = benchmark_unit_values([company], self.qindex)[0]
+        labels = ["Score Geral"] + self.qindex['categories'] + self.qindex['texts']
+        kinds = ["geral"] + ["dimensao"] * len(self.qindex['categories']) + ["pergunta"] * len(self.qindex['texts'])
+        unidades = []
+        for u, (label, kind) in enumerate(zip(labels, kinds)):
+            n = int(n_valid[u])
+            if n < self.min_empresas or np.isnan(own[u]):
+                continue
+            col = ordered[:n, u]
+            below = np.searchsorted(col, own[u], side='left')
+            equal = np.searchsorted(col, own[u], side='right') - below
+            p25, mediana, p75 = np.percentile(col, [25, 50, 75]).tolist()
+            unidades.append({
+                "unidade": label, "tipo": kind, "valor": float(own[u]),
+                "percentil": int(round(100 * (below + 0.5 * equal) / n)),
+                "p25": round(p25, 2), "mediana": round(mediana, 2), "p75": round(p75, 2), "empresas": n
+            })
+        return {"grupo": benchmark_group_label(key), "empresas": int(n_valid.max()), "unidades": unidades}
+
+def iter_table_pages(table, columns, order_by, page_size=BENCHMARK_PAGE_SIZE):
+    """
+    Lê uma tabela inteira em páginas (range), respeitando o max-rows do PostgREST: a próxima
+    faixa começa depois das linhas realmente recebidas e só uma página vazia encerra a leitura.
+    """
+    start = 0
+    while True:
+        query = supabase.table(table).select(columns)
+        for col in order_by:
+            query = query.order(col)
+        page = query.range(start, start + page_size - 1).execute().data
+        if not page:
+            break
+        yield page
+        start += len(page)
+
+def companies_from_aggregates(companies, aggregates, hse_questions):
+    """Métricas de cada empresa (dimensoes, score, detalhe_perguntas) somando suas linhas agregadas."""
+    qindex = build_question_index(hse_questions)
+    por_empresa = {}
+    for a in aggregates:
+        por_empresa.setdefault(str(a.get('company_id')), []).append(a)
+    result = []
+    for c in companies:
+        rows = por_empresa.get(str(c['id']), [])
+        q_sums, q_counts, respondidas, _ = aggregates_to_sums(rows, qindex)
+        c = dict(c, respondidas=respondidas)
+        if respondidas:
+            c['dimensoes'], c['score'], c['detalhe_perguntas'] = analytics_from_sums(q_sums, q_counts, qindex)
+        result.append(c)
+    return result
+
+@st.cache_resource(ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_benchmark_index(data_version, _hse_questions):
+    """
+    Índice de benchmark de toda a base (independe do escopo do usuário: só percentis agregados saem dele).
+    Lê empresas (id, cnae, risco) e a tabela response_aggregates, em O(empresas x setores x meses).
+    """
+    companies = [c for page in iter_table_pages('companies', BENCHMARK_COMPANY_COLUMNS, ('id',)) for c in page]
+    aggregates = [a for page in iter_table_pages('response_aggregates', AGGREGATE_COLUMNS, ('company_id', 'setor', 'periodo')) for a in page]
+    return BenchmarkIndex.from_companies(companies_from_aggregates(companies, aggregates, _hse_questions), _hse_questions)
+
+@st.cache_resource(ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_local_benchmark_index(change_count, _hse_questions):
+    """Índice de toda a base do armazenamento embutido, refeito só quando alguma linha local muda."""
+    local_store = get_local_storage()
+    companies = local_store.list_companies({"perm": "Master", "owner": None, "company_id": None})
+    companies, _ = build_company_analytics(companies, local_store.list_responses([c['id'] for c in companies]), _hse_questions)
+    return BenchmarkIndex.from_companies(companies, _hse_questions)
+
+def get_benchmark_index(hse_questions):
+    """
+    Índice da versão atual dos dados (do banco ou, no modo local, do armazenamento embutido).
+    None se os agregados do banco não puderem ser lidos: percentis calculados só sobre as empresas
+    visíveis ao usuário seriam de outra população e não podem sair com o rótulo do grupo CNAE.
+    """
+    if not DB_CONNECTED:
+        return load_local_benchmark_index(get_local_storage().change_count(), hse_questions)
+    cache_key = st.session_state.get('dataset_cache_key')
+    try:
+        return load_benchmark_index(cache_key[1] if cache_key else get_data_version(), hse_questions)
+    except Exception:
+        return None
+
+# ==============================================================================
+# 4.11 DOCUMENTOS EM PDF (RENDERIZAÇÃO EM SEGUNDO PLANO + CACHE POR HASH DO CONTEÚDO)
+# ==============================================================================
+# O PDF é gerado pelo laudo_pdf.py numa thread auxiliar; o resultado fica guardado pelo hash
+# das entradas (analítico da empresa, ações, textos, assinaturas e marca), então repetir o
+# download do mesmo conteúdo é imediato e dois cliques iguais não geram o documento duas vezes.
+REPORT_WORKERS = 2
+REPORT_CACHE_MAX_ENTRIES = 256
+REPORT_POLL_SECONDS = 0.5
+# Exportação em lote: o fpdf é CPU puro, então os laudos são renderizados em processos separados
+REPORT_BATCH_WORKERS = max(1, min(4, os.cpu_count() or 1))
+
+@st.cache_resource
+def get_report_store():
+    """PDFs prontos (por hash), trabalhos em andamento e falhas, compartilhados entre sessões."""
+    return {"done": {}, "jobs": {}, "errors": {}, "lock": threading.Lock()}
+
+@st.cache_resource
+def get_report_executor():
+    return ThreadPoolExecutor(max_workers=REPORT_WORKERS, thread_name_prefix="elo-pdf")
+
+@st.cache_resource
+def get_report_process_pool():
+    # "spawn" evita herdar por fork as threads e conexões abertas do servidor Streamlit
+    return ProcessPoolExecutor(max_workers=REPORT_BATCH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+def report_branding():
+    """Marca e paleta impressas no PDF (entram no hash: trocar a logo gera um novo documento)."""
+    cfg = st.session_state.platform_config
+    return {
+        "marca": {"nome": cfg.get('name', ''), "consultoria": cfg.get('consultancy', ''), "logo_b64": logo_source(cfg)[1]},
+        "cores": {
+            "primaria": COR_PRIMARIA, "secundaria": COR_SECUNDARIA, "comp_a": COR_COMP_A, "comp_b": COR_COMP_B,
+            "risco_alto": COR_RISCO_ALTO, "risco_medio": COR_RISCO_MEDIO, "risco_baixo": COR_RISCO_BAIXO
+        },
+        "data_emissao": datetime.date.today().strftime('%d/%m/%Y')
+    }
+
+def default_action_plan(sugestoes):
+    """Plano de ação inicial do laudo: todas as sugestões do banco de inteligência, com responsável e prazo a definir."""
+    return [{
+        "acao": s['acao'],
+        "estrat": s['estrat'],
+        "area": s['area'],
+        "resp": "A Definir na Reunião de Acompanhamento",
+        "prazo": "SLA Estipulado em 30 a 60 dias"
+    } for s in sugestoes]
+
+def laudo_pdf_payload(empresa, hse_questions, acoes_list, analise_texto, assinaturas, benchmark=None):
+    return {
+        "empresa": {k: empresa.get(k) for k in ("id", "razao", "cnpj", "cnae", "risco", "func", "respondidas", "score", "dimensoes", "detalhe_perguntas")},
+        "perguntas": {cat: [q['q'] for q in qs] for cat, qs in hse_questions.items()},
+        "acoes": acoes_list or [],
+        "analise": analise_texto,
+        "assinaturas": assinaturas,
+        "benchmark": benchmark,
+        **report_branding()
+    }
+
+def dossie_pdf_payload(empresa, periodo_a, periodo_b, dados_a, dados_b, significancia=None):
+    campos = ("score", "adesao", "dimensoes")
+    return {
+        "empresa": {k: empresa.get(k) for k in ("id", "razao", "cnpj")},
+        "periodo_a": periodo_a,
+        "periodo_b": periodo_b,
+        "dados_a": {k: dados_a.get(k) for k in campos},
+        "dados_b": {k: dados_b.get(k) for k in campos},
+        "texto_evolucao": dossie_evolution_text(dados_b['score'] - dados_a['score'], significancia),
+        "significancia": significancia,
+        "nota_significancia": SIGNIFICANCE_NOTE,
+        **report_branding()
+    }
+
+def report_content_hash(kind, payload):
+    raw = json.dumps({"kind": kind, "payload": payload}, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def _store_report(store, key, pdf):
+    with store["lock"]:
+        store["errors"].pop(key, None)
+        if key not in store["done"] and len(store["done"]) >= REPORT_CACHE_MAX_ENTRIES:
+            store["done"].pop(next(iter(store["done"])))
+        store["done"][key] = pdf
+
+def _render_report_job(store, key, kind, payload):
+    try:
+        pdf = render_report_pdf(kind, payload)
+    except Exception as e:
+        with store["lock"]:
+            store["jobs"].pop(key, None)
+            store["errors"][key] = str(e)
+        return
+    _store_report(store, key, pdf)
+    with store["lock"]:
+        store["jobs"].pop(key, None)
+
+def submit_report(kind, payload):
+    """
+    Agenda a geração do PDF, a não ser que o mesmo conteúdo já esteja pronto ou em andamento.
+    Devolve a chave (hash do conteúdo) usada por report_status.
+    """
+    key = report_content_hash(kind, payload)
+    store = get_report_store()
+    with store["lock"]:
+        if key in store["done"] or key in store["jobs"]:
+            return key
+        store["errors"].pop(key, None)
+        store["jobs"][key] = get_report_executor().submit(_render_report_job, store, key, kind, payload)
+    return key
+
+def report_status(key):
+    """("pronto", bytes), ("processando", None), ("erro", mensagem) ou (None, None) se nunca foi pedido."""
+    store = get_report_store()
+    with store["lock"]:
+        if key in store["done"]:
+            # Reposiciona como usado mais recentemente (o descarte remove o mais antigo)
+            store["done"][key] = store["done"].pop(key)
+            return "pronto", store["done"][key]
+        if key in store["jobs"]:
+            return "processando", None
+        if key in store["errors"]:
+            return "erro", store["errors"][key]
+    return None, None
+
+def export_reports_zip(documents, kind="laudo", on_progress=None):
+    """
+    Gera vários PDFs do mesmo tipo e os grava, à medida que ficam prontos, num único ZIP.
+    documents: lista de (nome do arquivo, payload). Documentos cujo hash já está no cache
+    entram direto no ZIP; os demais são renderizados em paralelo no pool de processos e
+    guardados no cache, então uma nova exportação só refaz as empresas que mudaram.
+    on_progress(feitos, total, nome) é chamado a cada documento concluído.
+    Devolve (bytes do ZIP, reaproveitados do cache, [(nome, erro)]).
+    """
+    store = get_report_store()
+    total, feitos, reaproveitados, falhas = len(documents), 0, 0, []
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        pendentes = {}
+        for file_name, payload in documents:
+            key = report_content_hash(kind, payload)
+            status, pdf = report_status(key)
+            if status == "pronto":
+                zf.writestr(file_name, pdf)
+                feitos += 1
+                reaproveitados += 1
+                if on_progress:
+                    on_progress(feitos, total, file_name)
+            else:
+                pendentes[get_report_process_pool().submit(render_report_pdf, kind, payload)] = (file_name, key)
+        for future in as_completed(pendentes):
+            file_name, key = pendentes[future]
+            try:
+                pdf = future.result()
+            except Exception as e:
+                falhas.append((file_name, str(e)))
+            else:
+                _store_report(store, key, pdf)
+                zf.writestr(file_name, pdf)
+            feitos += 1
+            if on_progress:
+                on_progress(feitos, total, file_name)
+    return buffer.getvalue(), reaproveitados, falhas
+
+def _report_panel_body(key, file_name, label, polling=False):
+    status, data = report_status(key)
+    if polling and status != "processando":
+        # O run_every foi fixado na execução completa: reconstrói o painel sem ele
+        st.rerun()
+    if status == "pronto":
+        st.download_button(label, data=data, file_name=file_name, mime="application/pdf", type="primary", use_container_width=True, on_click="ignore")
+    elif status == "processando":
+        st.info("⏳ Gerando o PDF oficial em segundo plano. O botão de download aparece aqui assim que ficar pronto.")
+    elif status == "erro":
+        st.error(f"Falha ao gerar o PDF: {data}")
+
+def report_download_panel(key, file_name, label):
+    """
+    Botão de download do PDF. Enquanto a geração roda, o trecho vira um fragmento com
+    run_every: só ele é reexecutado a cada REPORT_POLL_SECONDS, sem recalcular a página.
+    Quando o job termina, o fragmento dispara uma nova execução completa, que remonta o
+    painel sem run_every (senão ele seguiria reenviando o botão de download a cada ciclo).
+    """
+    status, _ = report_status(key)
+    polling = status == "processando"
+    st.fragment(_report_panel_body, run_every=REPORT_POLL_SECONDS if polling else None)(key, file_name, label, polling)
+
+def html_report_panel(html, file_name, label, preview_key):
+    """
+    Entrega do HTML como bytes pelo endpoint de mídia do Streamlit (uma única vez, sem data URI
+    em base64 dentro da mensagem do websocket). A prévia é opcional e paginada por seção.
+    """
+    st.download_button(label, data=html.encode('utf-8'), file_name=file_name, mime="text/html", use_container_width=True, on_click="ignore")
+    if st.toggle("👁️ Pré-visualizar o documento (por seção)", key=f"{preview_key}_preview"):
+        paginas = report_html_pages(html)
+        pagina = st.selectbox("Seção exibida", range(len(paginas)), format_func=lambda i: paginas[i][0], key=f"{preview_key}_page")
+        st.components.v1.html(paginas[pagina][1], height=600, scrolling=True)
+
+# ==============================================================================
+# 4.12 REPOSITÓRIO DE ATIVOS (LOGOS) ENDEREÇADO POR CONTEÚDO
+# ==============================================================================
+# O logo enviado é reduzido e recomprimido no upload e gravado uma única vez na tabela `assets`,
+# com o sha256 dos bytes finais como chave. Empresas e configuração da plataforma guardam só essa
+# referência (logo_ref), então a listagem de empresas não cresce com o tamanho das imagens.
+# Estrutura em supabase/migrations/20261018130000_assets.sql.
+LOGO_MAX_PX = 512
+LOGO_JPEG_QUALITY = 85
+ASSET_CACHE_MAX_ENTRIES = 256
+LOGO_MIGRATION_BATCH = 50
+
+def normalize_logo(raw):
+    """
+    Reduz a imagem para caber em LOGO_MAX_PX x LOGO_MAX_PX (mantendo a proporção) e recomprime:
+    PNG otimizado quando há transparência, JPEG nos demais casos. Devolve (bytes, mime, largura, altura).
+    """
+    img = Image.open(io.BytesIO(raw))
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail((LOGO_MAX_PX, LOGO_MAX_PX), Image.LANCZOS)
+    out = io.BytesIO()
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img = img.convert("RGBA")
+        img.save(out, "PNG", optimize=True)
+        mime = "image/png"
+    else:
+        img = img.convert("RGB")
+        img.save(out, "JPEG", quality=LOGO_JPEG_QUALITY, optimize=True, progressive=True)
+        mime = "image/jpeg"
+    return out.getvalue(), mime, img.width, img.height
+
+def make_asset(raw):
+    """Linha da tabela assets para a imagem já normalizada; a chave é o sha256 dos bytes finais."""
+    data, mime, width, height = normalize_logo(raw)
+    return {"hash": hashlib.sha256(data).hexdigest(), "mime": mime, "width": width, "height": height, "data": base64.b64encode(data).decode()}
+
+def put_asset(raw):
+    """
+    Normaliza e grava o ativo (idempotente: o mesmo conteúdo gera a mesma chave). Devolve a referência.
+    Com o banco conectado a falha é propagada: a referência vai para registros compartilhados
+    (companies / platform_settings) e um ativo gravado só no SQLite deste servidor não seria
+    encontrado pelas demais instâncias.
+    """
+    asset = make_asset(raw)
+    if DB_CONNECTED:
+        supabase.table('assets').upsert(asset).execute()
+    else:
+        get_local_storage().put_asset(asset)
+    return asset['hash']
+
+def store_logo(file):
+    """Upload de logo (empresa ou plataforma) para o repositório; None sem arquivo ou se a gravação falhar (com aviso na tela)."""
+    if not file:
+        return None
+    try:
+        return put_asset(file.getvalue())
+    except Exception as e:
+        st.error(f"Não foi possível gravar o logo enviado: {e}")
+        return None
+
+@st.cache_data(max_entries=ASSET_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_asset(ref):
+    """
+    (mime, base64) do ativo. O conteúdo de uma referência nunca muda, então o cache não expira;
+    um ativo ausente levanta KeyError (exceções não entram no cache_data).
+    """
+    if DB_CONNECTED:
+        res = supabase.table('assets').select(ASSET_COLUMNS).eq('hash', ref).limit(1).execute()
+        asset = res.data[0] if res.data else None
+    else:
+        asset = get_local_storage().get_asset(ref)
+    if asset is None:
+        raise KeyError(ref)
+    return asset['mime'], asset['data']
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, max_entries=ASSET_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_legacy_logo(comp_id):
+    """
+    logo_b64 inline de uma empresa ainda não migrada. As listagens de empresas não trazem mais essa
+    coluna, então ela é lida à parte, só para empresas sem logo_ref. None se não houver logo; uma falha
+    de leitura do banco é propagada (e não entra no cache).
+    """
+    if DB_CONNECTED:
+        res = supabase.table('companies').select("logo_b64").eq('id', comp_id).limit(1).execute()
+        return res.data[0].get('logo_b64') if res.data else None
+    comp = get_local_storage().get_company(comp_id)
+    return comp.get('logo_b64') if comp else None
+
+def logo_source(owner):
+    """
+    (mime, base64) do logo de uma empresa ou da configuração da plataforma: pela referência ou, em
+    registros ainda não migrados, pelo base64 inline legado (lido à parte quando a empresa veio de
+    uma listagem sem essa coluna). (None, None) sem logo.
+    """
+    if owner.get('logo_ref'):
+        try:
+            return load_asset(owner['logo_ref'])
+        except Exception:
+            return None, None
+    logo_b64 = owner.get('logo_b64')
+    if 'logo_b64' not in owner and owner.get('id'):
+        try:
+            logo_b64 = load_legacy_logo(owner['id'])
+        except Exception:
+            return None, None
+    if logo_b64:
+        return "image/png", logo_b64
+    return None, None
+
+def logo_data_uri(owner):
+    mime, b64 = logo_source(owner)
+    return f"data:{mime};base64,{b64}" if b64 else None
+
+def migrate_inline_logos():
+    """
+    Move para o repositório os logos ainda gravados em base64 (companies.logo_b64 e o logo_b64 da
+    configuração da plataforma), já reduzidos, e troca cada um pela referência. Retorna quantos migrou.
+    """
+    migrated = 0
+    if DB_CONNECTED:
+        # put_asset propaga a falha do banco: o base64 só é apagado depois que o ativo foi gravado
+        legados = [c for page in iter_table_pages('companies', "id, logo_b64", ('id',), page_size=LOGO_MIGRATION_BATCH) for c in page if c.get('logo_b64')]
+        for c in legados:
+            supabase.table('companies').update({"logo_ref": put_asset(base64.b64decode(c['logo_b64'])), "logo_b64": None}).eq('id', c['id']).execute()
+            migrated += 1
+        res = supabase.table('platform_settings').select("*").execute()
+        if res.data and (res.data[0].get('config_json') or {}).get('logo_b64'):
+            conf = dict(res.data[0]['config_json'])
+            conf['logo_ref'] = put_asset(base64.b64decode(conf.pop('logo_b64')))
+            supabase.table('platform_settings').update({"config_json": conf}).eq("id", res.data[0]['id']).execute()
+            fetch_platform_settings.clear()
+            st.session_state.platform_config = {**st.session_state.platform_config, "logo_ref": conf['logo_ref'], "logo_b64": None}
+            migrated += 1
+        invalidate_data_cache()
+    else:
+        local_store = get_local_storage()
+        for c in local_store.list_inline_logos():
+            local_store.replace_inline_logo(c['id'], put_asset(base64.b64decode(c['logo_b64'])))
+            migrated += 1
+    load_legacy_logo.clear()
+    return migrated
+
+# ==============================================================================
+# 4.13 QR CODES E CONVITES DOS LINKS DE AVALIAÇÃO (GERAÇÃO LOCAL)
+# ==============================================================================
+# O QR code é gerado no próprio servidor (segno), sem serviço externo: funciona offline e o link da
+# pesquisa não é enviado a terceiros. PNG e SVG ficam em cache por empresa e base_url.
+QR_CACHE_MAX_ENTRIES = 512
+QR_PNG_SCALE = 10
+QR_BORDER = 2
+
+def survey_link(base_url, comp_id):
+    return f"{base_url.rstrip('/')}/?cod={comp_id}"
+
+@st.cache_data(max_entries=QR_CACHE_MAX_ENTRIES, show_spinner=False)
+def survey_qr(comp_id, base_url):
+    """(png, svg) do QR code do link de avaliação da empresa."""
+    qr = segno.make(survey_link(base_url, comp_id), error='m')
+    png, svg = io.BytesIO(), io.BytesIO()
+    qr.save(png, kind='png', scale=QR_PNG_SCALE, border=QR_BORDER)
+    qr.save(svg, kind='svg', scale=QR_PNG_SCALE, border=QR_BORDER, xmldecl=False)
+    return png.getvalue(), svg.getvalue()
+
+def invite_text(razao, link_final):
+    """Texto modelo de convite (WhatsApp / endomarketing / e-mail) para a pesquisa da empresa."""
+    return f"""Olá, equipe da {razao}! 👋\n\nCuidar da nossa operação e dos nossos resultados estratégicos é fundamental, mas absolutamente nada disso faz sentido se não cuidarmos, em primeiro lugar, de quem faz toda a mágica acontecer: vocês.\n\nEstamos dando início oficial à nossa Avaliação de Riscos Psicossociais e queremos te fazer um convite para um bate-papo estruturado e extremamente sincero. Mas, afinal, por que isso é tão importante na nossa rotina?\n\n🧠 **Por que a sua participação é tão valiosa?**\nEm diversos momentos, a intensidade do estresse corporativo, a elevada carga de trabalho ou a própria dinâmica intensa do dia a dia podem gerar impactos profundos no nosso bem-estar coletivo de formas quase invisíveis.\nResponder a esta avaliação rápida não é apenas o preenchimento protocolar de um formulário; é fornecer para nós, na gestão, o raio-x e as métricas precisas necessárias para:\n\n* Identificar e mitigar rapidamente os pontos críticos e de fricção no nosso ambiente de trabalho diário.\n* Desenhar e aprovar orçamentos para ações práticas focadas em promover mais equilíbrio e blindagem à nossa saúde mental.\n* Construir dia a dia uma cultura organizacional horizontal onde todos se sintam ativamente ouvidos e plenamente respeitados na sua individualidade.\n\n🔒 **A sua segurança psicológica é a nossa premissa inegociável**\nTemos total consciência de que abrir o jogo sobre sentimentos, processos falhos e percepções exige um elo forte de confiança. Por essa razão, queremos assinar simbolicamente com você dois acordos inquebráveis:\n\n* **Blindagem de Anonimato:** O nosso novo sistema em nuvem foi programado com restrições rígidas para garantir que nenhuma resposta preenchida seja cruzada ou vinculada ao seu nome, cargo ou e-mail pessoal. Seu CPF é hash-criptografado e irreversível.\n* **Análise Sigilosa:** Todos os dados exportados e analisados são extraídos de forma coletiva, macro e estatística (formando médias do seu setor ou da empresa geral). Absolutamente nenhum líder ou diretor terá permissão técnica de acesso para visualizar o detalhamento das suas respostas individuais.\n\nO seu "sincerômetro" apontado pro máximo é exatamente a bússola que precisamos para poder evoluir de verdade. Tenha a tranquilidade de saber que aqui não há respostas tecnicamente certas ou erradas; buscamos apenas a sua genuína percepção e o seu sentimento sobre a realidade crua do nosso cotidiano ao seu lado.\n\n🚀 **Acessando a plataforma**\nBasta clicar ou tocar no link automatizado logo abaixo. Garantimos que o preenchimento não vai consumir mais do que 7 minutinhos da sua atenção, e as telas são facílimas de usar até mesmo no celular.\n\n🔗 {link_final}\n\nNós contamos, de verdade, com a força e a veracidade da sua voz para erguermos, de braços dados, um ecossistema muito mais agradável e acolhedor para investirmos os nossos dias.\n\nUm abraço respeitoso,\nLiderança Estratégica e Time de Gestão de Pessoas (RH)"""
+
+def export_links_zip(companies, base_url):
+    """
+    Um ZIP com, para cada empresa, o QR code (PNG e SVG) e o texto de convite numa pasta própria,
+    mais um links.csv com o link de cada empresa.
+    """
+    buffer = io.BytesIO()
+    index = io.StringIO()
+    writer = csv.writer(index, delimiter=';')
+    writer.writerow(["empresa", "id", "link"])
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        for comp in companies:
+            link = survey_link(base_url, comp['id'])
+            png, svg = survey_qr(comp['id'], base_url)
+            zf.writestr(f"{comp['id']}/QRCode_{comp['id']}.png", png)
+            zf.writestr(f"{comp['id']}/QRCode_{comp['id']}.svg", svg)
+            zf.writestr(f"{comp['id']}/Convite_{comp['id']}.txt", invite_text(comp['razao'], link))
+            writer.writerow([comp['razao'], comp['id'], link])
+        zf.writestr("links.csv", "\ufeff" + index.getvalue())
+    return buffer.getvalue()
+
+# ==============================================================================
+# 4.14 CAMINHO RÁPIDO DO LINK PÚBLICO (DESCRITOR DA EMPRESA PARA A PESQUISA)
+# ==============================================================================
+# Numa campanha, centenas de colaboradores abrem o mesmo ?cod= em poucos minutos. A pesquisa só precisa
+# de um descritor enxuto da empresa (nome, validade, teto, setores e o logo já pronto para o HTML), então
+# ele é montado a partir de poucas colunas e compartilhado entre as sessões por um TTL curto: alterações
+# de cadastro aparecem no link em até SURVEY_COMPANY_TTL_SECONDS (edição e exclusão limpam na hora).
+# O total de respostas do descritor bloqueia a abertura do formulário com o teto atingido; no envio a
+# contagem é refeita, então o teto vale mesmo dentro da janela do TTL.
+SURVEY_COMPANY_COLUMNS = "id, razao, valid_until, limit_evals, logo_ref, org_structure"
+SURVEY_COMPANY_TTL_SECONDS = 60
+SURVEY_COMPANY_MAX_ENTRIES = 1024
+
+def count_company_responses(comp_id):
+    """
+    Respostas já coletadas da empresa (contagem HEAD no banco, sem trafegar linhas). Se a contagem
+    falhar, devolve 0: o envio segue e a própria gravação reporta o erro de conexão.
+    """
+    if DB_CONNECTED:
+        try:
+            return supabase.table('responses').select('id', count='exact', head=True).eq('company_id', comp_id).execute().count or 0
+        except Exception:
+            return 0
+    return get_local_storage().count_responses(comp_id)
+
+def _survey_company_descriptor(row, legacy_logo=None):
+    org = row.get('org_structure')
+    return {
+        "id": row['id'],
+        "razao": row['razao'],
+        "valid_until": row.get('valid_until'),
+        "limit_evals": row['limit_evals'] if row.get('limit_evals') is not None else 999999,
+        "respondidas": count_company_responses(row['id']),
+        "setores": list(org.keys()) if isinstance(org, dict) and org else ["Geral"],
+        "logo_uri": logo_data_uri({"logo_ref": row.get('logo_ref'), "logo_b64": legacy_logo or row.get('logo_b64')}),
+    }
+
+@st.cache_resource(ttl=SURVEY_COMPANY_TTL_SECONDS, max_entries=SURVEY_COMPANY_MAX_ENTRIES, show_spinner=False)
+def fetch_survey_company(cod):
+    """
+    Descritor da empresa do link (somente leitura, compartilhado entre sessões), do banco ou, no modo
+    local, do armazenamento embutido. Código desconhecido (ou banco inacessível) levanta KeyError,
+    que não entra no cache.
+    """
+    if DB_CONNECTED:
+        try:
+            res = supabase.table('companies').select(SURVEY_COMPANY_COLUMNS).eq('id', cod).limit(1).execute()
+            if res.data:
+                row = res.data[0]
+                legacy_logo = None
+                if not row.get('logo_ref'):
+                    # Logo ainda não migrado para o repositório de ativos (4.12)
+                    try:
+                        legado = supabase.table('companies').select("logo_b64").eq('id', cod).limit(1).execute()
+                        legacy_logo = legado.data[0].get('logo_b64') if legado.data else None
+                    except Exception:
+                        pass
+                return _survey_company_descriptor(row, legacy_logo)
+        except Exception:
+            pass
+        raise KeyError(cod)
+    row = get_local_storage().get_company(cod) if cod else None
+    if row is None:
+        raise KeyError(cod)
+    return _survey_company_descriptor(row)
+
+def survey_company(cod):
+    try:
+        return fetch_survey_company(cod)
+    except KeyError:
+        return None
+
 # ==============================================================================
 # 5. TELAS DO SISTEMA - FRONTEND E ADMINISTRAÇÃO
 # ==============================================================================
@@ -1081,9 +3916,13 @@ def login_screen():
                             linked_comp = user_data.get('linked_company_id')
                     except: pass
                 
-                if not login_ok and user in st.session_state.users_db and st.session_state.users_db[user].get('password') == pwd:
+                # Acessos locais só valem no modo offline: com o banco conectado, apenas admin_users autentica
+                local_user = None
+                if not DB_CONNECTED:
+                    local_user = get_local_storage().get_user(user) or st.session_state.users_db.get(user)
+                if local_user and local_user.get('password') == pwd:
                     login_ok = True
-                    user_data = st.session_state.users_db[user]
+                    user_data = local_user
                     user_role_type = user_data.get('role', 'Analista')
                     user_credits = user_data.get('credits', 0)
                     linked_comp = user_data.get('linked_company_id')
@@ -1113,8 +3952,11 @@ def login_screen():
 
 def admin_dashboard():
     """Painel de Controle Central para Gestores e Masters"""
-    companies_data, responses_data = load_data_from_db()
+    companies_data, responses_data = load_data_from_db(get_user_scope())
     perm = st.session_state.admin_permission
+    
+    if st.session_state.get('data_stale'):
+        st.warning("⚠️ O banco de dados está instável no momento. Exibindo os últimos dados carregados com sucesso; alterações feitas agora podem não ser gravadas.")
     curr_user = st.session_state.user_username
     
     if perm == "Gestor":
@@ -1223,13 +4065,17 @@ def admin_dashboard():
             st.markdown("<div class='chart-container'>", unsafe_allow_html=True)
             st.markdown("##### Resultados Analíticos por Setor (Score Verdadeiro)")
             if responses_filtered:
-                df_resp = pd.DataFrame(responses_filtered)
-                if 'setor' in df_resp.columns and 'score_calculado' in df_resp.columns:
-                    df_setor = df_resp.groupby('setor')['score_calculado'].mean().reset_index()
+                cube = get_analytics_cube(responses_data, st.session_state.hse_questions)
+                setores_cubo = cube.slice(company=[c['id'] for c in companies_filtered]).rollup(('setor',), include_suppressed=True)
+                setores_visiveis = [s for s in setores_cubo if not s['suprimido']]
+                if setores_visiveis:
+                    df_setor = pd.DataFrame([{'setor': s['setor'], 'score_calculado': s['score_medio']} for s in setores_visiveis])
                     fig_bar = px.bar(df_setor, x='setor', y='score_calculado', title="Score Médio Real por Área", color='score_calculado', color_continuous_scale='RdYlGn', range_y=[0, 5])
                     st.plotly_chart(fig_bar, use_container_width=True)
                 else: 
                     st.info("Sem dados setoriais estruturados.")
+                if len(setores_cubo) > len(setores_visiveis):
+                    st.caption(f"🔒 {len(setores_cubo) - len(setores_visiveis)} setor(es) ocultado(s) por possuírem menos de {MIN_RESPONDENTES_CELULA} respondentes (proteção de anonimato).")
             else: 
                 st.info("Aguardando respostas para compilar o gráfico de barras.")
             st.markdown("</div>", unsafe_allow_html=True)
@@ -1312,6 +4158,10 @@ def admin_dashboard():
                                 supabase.table('companies').update(update_dict).eq('id', target_id).execute()
                             except Exception as e: 
                                 st.warning(f"Erro DB Update: {e}")
+                            invalidate_data_cache()
+                        else:
+                            get_local_storage().update_company(target_id, update_dict)
+                        fetch_survey_company.clear()
                         
                         emp_edit.update(update_dict)
                         st.session_state.edit_mode = False
@@ -1396,7 +4246,7 @@ def admin_dashboard():
                             else:
                                 # GERA ID UUID SEGURO AUTOMATICAMENTE
                                 cod = str(uuid.uuid4())[:8].upper()
-                                logo_str = image_to_base64(logo_cliente)
+                                logo_ref = store_logo(logo_cliente)
                                 
                                 new_c = {
                                     "id": cod, 
@@ -1413,7 +4263,7 @@ def admin_dashboard():
                                     "telefone": tel, 
                                     "endereco": end, 
                                     "valid_until": valid_date.isoformat(), 
-                                    "logo_b64": logo_str, 
+                                    "logo_ref": logo_ref, 
                                     "score": 0, 
                                     "respondidas": 0, 
                                     "owner": curr_user, 
@@ -1437,11 +4287,13 @@ def admin_dashboard():
                                             }).execute()
                                     except Exception as e: 
                                         error_msg = str(e)
+                                    invalidate_data_cache()
                                 
-                                st.session_state.companies_db.append(new_c)
+                                else:
+                                    get_local_storage().insert_company(new_c)
                                 
                                 if error_msg: 
-                                    st.warning(f"⚠️ Aviso do Banco de Dados: Processo salvo localmente. Encontramos um gargalo de rede ({error_msg})")
+                                    st.error(f"⚠️ Aviso do Banco de Dados: a organização não foi gravada. Encontramos um gargalo de rede ({error_msg})")
                                 else: 
                                     st.success(f"🎉 Organização cadastrada perfeitamente! O ID gerado para envio do link é: {cod}")
                                 
@@ -1473,6 +4325,9 @@ def admin_dashboard():
                             try: 
                                 supabase.table('companies').update({"org_structure": empresa['org_structure']}).eq('id', empresa['id']).execute()
                             except: pass
+                            invalidate_data_cache()
+                        else:
+                            get_local_storage().update_company(empresa['id'], {"org_structure": empresa['org_structure']})
                         st.success(f"Departamento '{new_setor}' foi catalogado com sucesso!")
                         time.sleep(1); st.rerun()
                 
@@ -1485,6 +4340,9 @@ def admin_dashboard():
                          try: 
                              supabase.table('companies').update({"org_structure": empresa['org_structure']}).eq('id', empresa['id']).execute()
                          except: pass
+                         invalidate_data_cache()
+                    else:
+                         get_local_storage().update_company(empresa['id'], {"org_structure": empresa['org_structure']})
                     st.success("Setor e seus cargos dependentes foram removidos.")
                     time.sleep(1); st.rerun()
                 st.markdown("</div>", unsafe_allow_html=True)
@@ -1503,6 +4361,9 @@ def admin_dashboard():
                              try: 
                                  supabase.table('companies').update({"org_structure": empresa['org_structure']}).eq('id', empresa['id']).execute()
                              except: pass
+                             invalidate_data_cache()
+                        else:
+                             get_local_storage().update_company(empresa['id'], {"org_structure": empresa['org_structure']})
                         st.success("A matriz de cargos para este setor foi sincronizada.")
                 st.markdown("</div>", unsafe_allow_html=True)
 
@@ -1518,7 +4379,7 @@ def admin_dashboard():
             
             # GERAÇÃO SEGURA BASEADA NO UUID DA EMPRESA
             base_url = st.session_state.platform_config.get('base_url', 'https://elonr01-cris.streamlit.app').rstrip('/')
-            link_final = f"{base_url}/?cod={empresa['id']}"
+            link_final = survey_link(base_url, empresa['id'])
             
             c1, c2 = st.columns([2, 1])
             with c1:
@@ -1540,17 +4401,34 @@ def admin_dashboard():
                     st.rerun()
             with c2:
                 st.markdown("##### Imagem QR Code Rápido")
-                qr_api_url = f"https://api.qrserver.com/v1/create-qr-code/?size=300x300&data={urllib.parse.quote(link_final)}"
-                st.image(qr_api_url, width=150)
-                st.markdown(f"[📥 Baixar Vetor do QR Code]({qr_api_url})")
+                qr_png, qr_svg = survey_qr(empresa['id'], base_url)
+                st.image(qr_png, width=150)
+                q1, q2 = st.columns(2)
+                q1.download_button("📥 PNG", data=qr_png, file_name=f"QRCode_{empresa['id']}.png", mime="image/png", use_container_width=True, on_click="ignore")
+                q2.download_button("📥 SVG", data=qr_svg, file_name=f"QRCode_{empresa['id']}.svg", mime="image/svg+xml", use_container_width=True, on_click="ignore")
             st.markdown("</div>", unsafe_allow_html=True)
             
             st.markdown("<div class='chart-container'>", unsafe_allow_html=True)
             st.markdown("##### 💬 Estrutura Modelo de Comunicação Corporativa (WhatsApp / Endomarketing / E-mail)")
-            texto_convite = f"""Olá, equipe da {empresa['razao']}! 👋\n\nCuidar da nossa operação e dos nossos resultados estratégicos é fundamental, mas absolutamente nada disso faz sentido se não cuidarmos, em primeiro lugar, de quem faz toda a mágica acontecer: vocês.\n\nEstamos dando início oficial à nossa Avaliação de Riscos Psicossociais e queremos te fazer um convite para um bate-papo estruturado e extremamente sincero. Mas, afinal, por que isso é tão importante na nossa rotina?\n\n🧠 **Por que a sua participação é tão valiosa?**\nEm diversos momentos, a intensidade do estresse corporativo, a elevada carga de trabalho ou a própria dinâmica intensa do dia a dia podem gerar impactos profundos no nosso bem-estar coletivo de formas quase invisíveis.\nResponder a esta avaliação rápida não é apenas o preenchimento protocolar de um formulário; é fornecer para nós, na gestão, o raio-x e as métricas precisas necessárias para:\n\n* Identificar e mitigar rapidamente os pontos críticos e de fricção no nosso ambiente de trabalho diário.\n* Desenhar e aprovar orçamentos para ações práticas focadas em promover mais equilíbrio e blindagem à nossa saúde mental.\n* Construir dia a dia uma cultura organizacional horizontal onde todos se sintam ativamente ouvidos e plenamente respeitados na sua individualidade.\n\n🔒 **A sua segurança psicológica é a nossa premissa inegociável**\nTemos total consciência de que abrir o jogo sobre sentimentos, processos falhos e percepções exige um elo forte de confiança. Por essa razão, queremos assinar simbolicamente com você dois acordos inquebráveis:\n\n* **Blindagem de Anonimato:** O nosso novo sistema em nuvem foi programado com restrições rígidas para garantir que nenhuma resposta preenchida seja cruzada ou vinculada ao seu nome, cargo ou e-mail pessoal. Seu CPF é hash-criptografado e irreversível.\n* **Análise Sigilosa:** Todos os dados exportados e analisados são extraídos de forma coletiva, macro e estatística (formando médias do seu setor ou da empresa geral). Absolutamente nenhum líder ou diretor terá permissão técnica de acesso para visualizar o detalhamento das suas respostas individuais.\n\nO seu "sincerômetro" apontado pro máximo é exatamente a bússola que precisamos para poder evoluir de verdade. Tenha a tranquilidade de saber que aqui não há respostas tecnicamente certas ou erradas; buscamos apenas a sua genuína percepção e o seu sentimento sobre a realidade crua do nosso cotidiano ao seu lado.\n\n🚀 **Acessando a plataforma**\nBasta clicar ou tocar no link automatizado logo abaixo. Garantimos que o preenchimento não vai consumir mais do que 7 minutinhos da sua atenção, e as telas são facílimas de usar até mesmo no celular.\n\n🔗 {link_final}\n\nNós contamos, de verdade, com a força e a veracidade da sua voz para erguermos, de braços dados, um ecossistema muito mais agradável e acolhedor para investirmos os nossos dias.\n\nUm abraço respeitoso,\nLiderança Estratégica e Time de Gestão de Pessoas (RH)"""
+            texto_convite = invite_text(empresa['razao'], link_final)
             st.text_area("Copie o material formatado abaixo para disparo:", value=texto_convite, height=350)
             st.markdown("</div>", unsafe_allow_html=True)
 
+        # --- EXPORTAÇÃO EM LOTE (QR CODES E CONVITES DE TODAS AS EMPRESAS) ---
+        st.markdown("---")
+        with st.expander("🗂️ Exportação em Lote: QR Codes e Convites de Todas as Empresas (ZIP)"):
+            st.caption("Para cada empresa: QR code em PNG e SVG e o texto de convite com o link, numa pasta própria, além de um links.csv com o índice dos links.")
+            # Seleção por id: razões sociais podem se repetir, e o código no rótulo mantém as opções distintas
+            nomes_lote = {c['id']: f"{c['razao']} ({c['id']})" for c in visible_companies}
+            lote_sel = st.multiselect("Empresas incluídas no lote", list(nomes_lote), default=list(nomes_lote), format_func=nomes_lote.get, key="lote_links_sel")
+            if st.button("📦 Gerar ZIP com QR Codes e Convites", disabled=not lote_sel):
+                st.session_state.lote_links = export_links_zip([c for c in visible_companies if c['id'] in lote_sel], base_url)
+            if st.session_state.get('lote_links'):
+                st.download_button(
+                    "⬇️ BAIXAR ZIP DOS QR CODES E CONVITES", data=st.session_state.lote_links, file_name=f"Links_Avaliacao_{datetime.date.today().strftime('%Y%m%d')}.zip",
+                    mime="application/zip", type="primary", use_container_width=True, on_click="ignore"
+                )
+
     elif selected == "Relatórios":
         st.title("Módulo de Geração de Relatórios e Laudos")
         if not visible_companies: 
@@ -1580,14 +4458,7 @@ def admin_dashboard():
             
         if not st.session_state.acoes_list and sugestoes_auto:
             # Integração total e automática: injeta todas as predições do banco de inteligência
-            for s in sugestoes_auto: 
-                st.session_state.acoes_list.append({
-                    "acao": s['acao'], 
-                    "estrat": s['estrat'], 
-                    "area": s['area'], 
-                    "resp": "A Definir na Reunião de Acompanhamento", 
-                    "prazo": "SLA Estipulado em 30 a 60 dias"
-                })
+            st.session_state.acoes_list.extend(default_action_plan(sugestoes_auto))
         
         html_act = ""
         if st.session_state.acoes_list:
@@ -1638,359 +4509,101 @@ def admin_dashboard():
             if not edited_df.empty: 
                 st.session_state.acoes_list = edited_df.to_dict('records')
 
-        # --- GERAÇÃO EXPANDIDA, DOCUMENTADA E TOTALMENTE DESMINIFICADA DO CÓDIGO HTML (V100.0+) ---
-        if st.button("📥 Sintetizar Arquivo do Laudo Analítico (Motor HTML > PDF)", type="primary"):
-            st.markdown("---")
-            logo_html = get_logo_html(150)
-            logo_cliente_html = ""
-            if empresa.get('logo_b64'):
-                logo_cliente_html = f"<img src='data:image/png;base64,{empresa.get('logo_b64')}' width='110' style='float:right; margin-left: 15px; border-radius:4px; box-shadow: 0px 2px 4px rgba(0,0,0,0.1);'>"
-            
-            # --- CONSTRUÇÃO CUIDADOSA DOS CARDS DIMENSIONAIS PARA O DOM DO HTML ---
-            html_dimensoes = ""
-            if empresa.get('dimensoes'):
-                for dim, nota in empresa.get('dimensoes', {}).items():
-                    cor_card = COR_RISCO_ALTO if nota < 3 else (COR_RISCO_MEDIO if nota < 4 else COR_RISCO_BAIXO)
-                    label_card = "CENÁRIO CRÍTICO" if nota < 3 else ("MOMENTO DE ATENÇÃO" if nota < 4 else "AMBIENTE SEGURO")
-                    html_dimensoes += f"""
-                    <div style="flex: 1; min-width: 85px; background-color: #fcfcfc; border: 1px solid #e0e0e0; padding: 8px; border-radius: 6px; margin: 4px; text-align: center; font-family: 'Helvetica Neue', Helvetica, sans-serif; box-shadow: inset 0 -2px 0 {cor_card};">
-                        <div style="font-size: 8px; color: #555; text-transform: uppercase; letter-spacing: 0.5px; font-weight: bold;">{dim}</div>
-                        <div style="font-size: 16px; font-weight: 800; color: {cor_card}; margin: 4px 0;">{nota:.1f}</div>
-                        <div style="font-size: 7px; color: #777; background: #eee; padding: 2px; border-radius: 2px;">{label_card}</div>
-                    </div>
-                    """
-
-            # --- CONSTRUÇÃO DO MAPA DE CALOR (RAIO-X DAS 35 PERGUNTAS DE FORMA EXPANDIDA E REALISTA) ---
-            html_x = ""
-            detalhes_heatmap = empresa.get('detalhe_perguntas', {})
-            
-            for cat, pergs in st.session_state.hse_questions.items():
-                 html_x += f"""
-                 <div style="font-weight: bold; color: {COR_PRIMARIA}; font-size: 11px; margin-top: 14px; margin-bottom: 6px; border-bottom: 2px solid #eaeaea; font-family: 'Helvetica Neue', Helvetica, sans-serif; padding-bottom: 2px;">
-                    {cat.upper()}
-                 </div>
-                 """
-                 
-                 for q in pergs:
-                     # Resgata a pocentagem pre-calculada pelo motor Python real. Agora convertida pela fórmula de 0 a 100% exata
-                     val = detalhes_heatmap.get(q['q']) 
-                     
-                     if val is None:
-                         # Se ninguem respondeu ainda
-                         c_bar = "#cccccc" 
-                         txt_exposicao = "Sem Respostas"
-                         val_width = 0
-                     else:
-                         # Classificacao da barra CSS
-                         c_bar = COR_RISCO_ALTO if val >= 50 else (COR_RISCO_MEDIO if val >= 25 else COR_RISCO_BAIXO)
-                         txt_exposicao = f"{val}% Exposição"
-                         val_width = val
-                         
-                     html_x += f"""
-                     <div style="margin-bottom: 6px; font-family: 'Helvetica Neue', Helvetica, sans-serif;">
-                        <div style="display: flex; justify-content: space-between; align-items: flex-end; font-size: 9px; margin-bottom: 2px;">
-                            <span style="color: #444; width: 85%; white-space: nowrap; overflow: hidden; text-overflow: ellipsis;" title="{q['q']}">{q['q']}</span>
-                            <span style="color: {c_bar}; font-weight: bold; font-size: 8px;">{txt_exposicao}</span>
-                        </div>
-                        <div style="width: 100%; background-color: #f0f0f0; height: 6px; border-radius: 3px; overflow: hidden; box-shadow: inset 0 1px 2px rgba(0,0,0,0.05);">
-                            <div style="width: {val_width}%; background-color: {c_bar}; height: 100%; border-radius: 3px; transition: width 0.5s ease-in-out;"></div>
-                        </div>
-                     </div>
-                     """
-
-            # --- SÍNTESE DA MATRIZ DO PLANO DE AÇÃO ---
-            html_act_final = "".join([f"""
-                <tr>
-                    <td style="padding: 10px; border-bottom: 1px solid #eef0f2; font-weight: bold; color: #2c3e50;">{i.get('acao','')}</td>
-                    <td style="padding: 10px; border-bottom: 1px solid #eef0f2; color: #555;">{i.get('estrat','')}</td>
-                    <td style="padding: 10px; border-bottom: 1px solid #eef0f2; text-align: center;"><span style="background: #eef2f5; padding: 3px 6px; border-radius: 4px; font-size: 8px; color: #34495e;">{i.get('area','')}</span></td>
-                    <td style="padding: 10px; border-bottom: 1px solid #eef0f2; font-style: italic; color: #7f8c8d;">{i.get('resp','')}</td>
-                    <td style="padding: 10px; border-bottom: 1px solid #eef0f2; font-weight: bold; color: {COR_PRIMARIA};">{i.get('prazo','')}</td>
-                </tr>
-            """ for i in st.session_state.acoes_list])
-            
-            if not st.session_state.acoes_list: 
-                html_act_final = "<tr><td colspan='5' style='text-align: center; padding: 20px; color: #999;'>Matriz de ações não preenchida pelo corpo técnico.</td></tr>"
-
-            # --- RENDERIZAÇÃO DO MEDIDOR GERAL DE PRESSÃO (GAUGE) EM CSS PURO ---
-            score_final_empresa = empresa.get('score', 0)
-            score_width_css = (score_final_empresa / 5.0) * 100
-            
-            html_gauge_css = f"""
-            <div style="text-align: center; padding: 15px; font-family: 'Helvetica Neue', Helvetica, sans-serif;">
-                <div style="font-size: 32px; font-weight: 900; color: {COR_PRIMARIA}; text-shadow: 1px 1px 0px rgba(0,0,0,0.05);">
-                    {score_final_empresa:.2f} <span style="font-size: 14px; font-weight: normal; color: #a0a0a0;">/ 5.00 Máx</span>
-                </div>
-                <div style="width: 100%; background: #e0e0e0; height: 16px; border-radius: 8px; margin-top: 10px; position: relative; overflow: hidden; box-shadow: inset 0 2px 4px rgba(0,0,0,0.1);">
-                    <div style="position: absolute; left: 0; top: 0; width: {score_width_css}%; background: linear-gradient(90deg, {COR_PRIMARIA} 0%, {COR_SECUNDARIA} 100%); height: 16px; border-radius: 8px;"></div>
-                </div>
-                <div style="font-size: 10px; color: #7f8c8d; margin-top: 8px; letter-spacing: 1px; text-transform: uppercase;">
-                    Coeficiente Geral do Ecossistema
-                </div>
-            </div>
-            """
-            
-            # --- TABELA DE RADAR SINTÉTICO (PARA COMPLEMENTAR O GRÁFICO VISUAL) ---
-            html_radar_rows = ""
-            for k, v in empresa.get('dimensoes', {}).items():
-                html_radar_rows += f"""
-                <tr>
-                    <td style='padding: 6px 10px; border-bottom: 1px solid #f0f0f0; color: #444; font-weight: 500;'>{k}</td>
-                    <td style='padding: 6px 10px; text-align: right; border-bottom: 1px solid #f0f0f0; font-weight: bold; color: {COR_PRIMARIA};'>{v:.1f}</td>
-                </tr>
-                """
-            
-            html_radar_table = f"""
-            <table style="width: 100%; font-size: 10px; font-family: 'Helvetica Neue', Helvetica, sans-serif; border-collapse: collapse; margin-top: 5px;">
-                <thead>
-                    <tr style="background-color: #f8f9fa;">
-                        <th style="text-align: left; padding: 8px 10px; border-bottom: 2px solid #ddd; color: #555;">Dimensão Investigada</th>
-                        <th style="text-align: right; padding: 8px 10px; border-bottom: 2px solid #ddd; color: #555;">Nota Obtida</th>
-                    </tr>
-                </thead>
-                <tbody>
-                    {html_radar_rows}
-                </tbody>
-            </table>
-            """
-
-            lgpd_note = f"""
-            <div style="margin-top: 40px; border-top: 1px solid #ccc; padding-top: 15px; font-size: 8px; color: #888; text-align: justify; font-family: 'Helvetica Neue', Helvetica, sans-serif; line-height: 1.4;">
-                <strong>TERMO DE CONFIDENCIALIDADE E PROTEÇÃO ESTRITA DE DADOS (LGPD):</strong> Este instrumento avaliativo de saúde ocupacional corporativa foi confeccionado utilizando complexos métodos de criptografia de banco de dados e obfuscação de entidades. Os resultados e matrizes de calor apresentados neste dossiê carregam a premissa irrevogável do anonimato. Nenhum número, gráfico, tabela ou insight aqui delineado é capaz de identificar participantes do corpo colaborativo individualmente ou quebrar a barreira do sigilo profissional garantido pela Lei Geral de Proteção de Dados Pessoais (Lei nº 13.709/2018).
-            </div>
-            """
-
-            # --- SUPER CONTEÚDO BRUTO DO ARQUIVO COMPLETO HTML FORMATADO PARA IMPRESSÃO PERFEITA ---
-            raw_html = f"""
-            <!DOCTYPE html>
-            <html lang="pt-BR">
-            <head>
-                <meta charset="utf-8">
-                <title>Dossiê Técnico Institucional - {empresa['razao']}</title>
-                <style>
-                    body {{
-                        font-family: 'Segoe UI', 'Helvetica Neue', Helvetica, Arial, sans-serif;
-                        padding: 30mm 20mm;
-                        color: #2c3e50;
-                        background-color: #ffffff;
-                        line-height: 1.6;
-                        max-width: 210mm;
-                        margin: 0 auto;
-                    }}
-                    h4 {{
-                        color: {COR_PRIMARIA}; 
-                        border-left: 5px solid {COR_SECUNDARIA}; 
-                        padding-left: 12px; 
-                        margin-top: 40px;
-                        margin-bottom: 15px;
-                        font-size: 13px;
-                        letter-spacing: 0.5px;
-                    }}
-                    .caixa-destaque {{
-                        background: linear-gradient(135deg, #f8f9fa 0%, #ffffff 100%);
-                        padding: 20px; 
-                        border-radius: 8px; 
-                        margin-bottom: 25px; 
-                        border-left: 6px solid {COR_SECUNDARIA};
-                        box-shadow: 0 4px 6px rgba(0,0,0,0.02);
-                    }}
-                    .colunas-flex {{
-                        display: flex; 
-                        gap: 30px; 
-                        margin-top: 25px; 
-                        margin-bottom: 25px;
-                    }}
-                    .coluna-dado {{
-                        flex: 1; 
-                        border: 1px solid #eef2f5; 
-                        border-radius: 10px; 
-                        padding: 15px;
-                        background-color: #fafbfc;
-                    }}
-                    .titulo-coluna {{
-                        font-weight: 800; 
-                        font-size: 11px; 
-                        color: {COR_PRIMARIA}; 
-                        margin-bottom: 12px;
-                        text-align: center;
-                        text-transform: uppercase;
-                        letter-spacing: 1px;
-                        border-bottom: 1px solid #eef2f5;
-                        padding-bottom: 8px;
-                    }}
-                    .grid-raiox {{
-                        background: #ffffff; 
-                        border: 1px solid #eef2f5; 
-                        padding: 20px; 
-                        border-radius: 10px; 
-                        margin-bottom: 25px; 
-                        column-count: 2; 
-                        column-gap: 50px;
-                        box-shadow: 0 2px 4px rgba(0,0,0,0.01);
-                    }}
-                    @media print {{
-                        body {{
-                            padding: 0;
-                            margin: 0;
-                            -webkit-print-color-adjust: exact !important;
-                            print-color-adjust: exact !important;
-                        }}
-                        .grid-raiox {{
-                            page-break-inside: avoid;
-                        }}
-                        table {{
-                            page-break-inside: auto;
-                        }}
-                        tr {{
-                            page-break-inside: avoid;
-                            page-break-after: auto;
-                        }}
-                        h4 {{
-                            page-break-after: avoid;
-                        }}
-                    }}
-                </style>
-            </head>
-            <body>
-                <header style="display: flex; justify-content: space-between; align-items: center; border-bottom: 3px solid {COR_PRIMARIA}; padding-bottom: 20px; margin-bottom: 30px;">
-                    <div style="flex: 0 0 auto;">{logo_html}</div>
-                    <div style="text-align: right; flex: 1;">
-                        <div style="font-size: 22px; font-weight: 900; color: {COR_PRIMARIA}; letter-spacing: -0.5px;">LAUDO TÉCNICO HSE-IT</div>
-                        <div style="font-size: 12px; color: #7f8c8d; font-weight: 500; text-transform: uppercase; letter-spacing: 1px; margin-top: 4px;">Mapeamento de Riscos Psicossociais (NR-01)</div>
-                    </div>
-                </header>
-
-                <div class="caixa-destaque">
-                    {logo_cliente_html}
-                    <div style="font-size: 10px; color: #95a5a6; margin-bottom: 6px; text-transform: uppercase; font-weight: bold; letter-spacing: 1px;">Entidade Auditada</div>
-                    <div style="font-weight: 900; font-size: 18px; margin-bottom: 8px; color: #2c3e50;">{empresa.get('razao', 'Razão Social Não Informada')}</div>
-                    
-                    <div style="display: flex; gap: 40px; margin-top: 15px;">
-                        <div>
-                            <div style="font-size: 9px; color: #7f8c8d; text-transform: uppercase;">Registro CNPJ</div>
-                            <div style="font-size: 11px; font-weight: 600; color: #34495e;">{empresa.get('cnpj','Não Especificado')}</div>
-                        </div>
-                        <div>
-                            <div style="font-size: 9px; color: #7f8c8d; text-transform: uppercase;">Adesão Total da Cota</div>
-                            <div style="font-size: 11px; font-weight: 600; color: #34495e;">{empresa.get('respondidas',0)} Vidas Mapeadas</div>
-                        </div>
-                        <div>
-                            <div style="font-size: 9px; color: #7f8c8d; text-transform: uppercase;">Data de Fechamento (Emissão)</div>
-                            <div style="font-size: 11px; font-weight: 600; color: #34495e;">{datetime.datetime.now().strftime('%d de %B de %Y')}</div>
-                        </div>
-                    </div>
-                    <div style="margin-top: 15px; border-top: 1px dashed #ddd; padding-top: 10px;">
-                        <div style="font-size: 9px; color: #7f8c8d; text-transform: uppercase;">Endereço de Faturamento e Auditoria</div>
-                        <div style="font-size: 11px; color: #34495e;">{empresa.get('endereco','Sem endereço de auditoria configurado no sistema.')}</div>
-                    </div>
-                </div>
-
-                <h4>1. TESE, OBJETIVO E RIGOR METODOLÓGICO</h4>
-                <p style="text-align: justify; font-size: 11px; color: #555;">
-                    O presente relatório executivo embasa-se na literatura técnica científica e carrega como objetivo macro identificar, catalogar e mensurar através de score a existência de potencias fatores nocivos de risco psicossocial permeando as malhas do ambiente de trabalho desta Organização Cliente. 
-                    <br><br>
-                    Para garantir lisura ao processo, a plataforma tecnológica encarregou-se de transcrever e calcular os algoritmos validados mundialmente pelo <strong>HSE Management Standards Indicator Tool</strong> (Reino Unido), convergindo suas normativas para atender diretamente às exigências modernas estipuladas pelo GRO/PGR no escopo da Norma Regulamentadora Brasileira nº 01 (NR-01). 
-                    <br><br>
-                    A engenharia da metodologia escaneia com rigor absoluto 7 (sete) dimensões indissociáveis da saúde mental laborativa: Compressão de Nível de Demandas, Soberania e Autonomia (Controle Organizacional), Suporte Estrutural Liderança (Gestor), Solidariedade Setorial (Pares), Textura e Qualidade dos Relacionamentos Interpessoais, Clareza de Papel Individual, e fluidez da Gestão na Curva de Mudança Institucional.
-                </p>
-
-                <div class="colunas-flex">
-                    <div class="coluna-dado">
-                        <div class="titulo-coluna">2. SCORE MASTER DA ORGANIZAÇÃO</div>
-                        {html_gauge_css}
-                    </div>
-                    <div class="coluna-dado">
-                        <div class="titulo-coluna">3. RAIZ E MATRIZ PONTUAL DAS DIMENSÕES</div>
-                        {html_radar_table}
-                    </div>
-                </div>
-
-                <h4>4. MAPA DE DIAGNÓSTICO DETALHADO POR DIMENSÃO DE SAÚDE</h4>
-                <div style="display: flex; flex-wrap: wrap; margin-bottom: 30px; gap: 8px;">
-                    {html_dimensoes}
-                </div>
-
-                <h4>5. VARREDURA RAIO-X DOS 35 FATORES DE RISCO INTERNOS AVALIADOS</h4>
-                <p style="font-size: 10px; color: #777; margin-bottom: 15px; margin-top: -10px; font-style: italic;">
-                    Nota técnica de interpretação de leitura: As barras gráficas ilustradas abaixo representam o grau de fragilidade (ou exposição perigosa) do grupo avaliado em relação a cada afirmação da pesquisa. Porcentagens acentuadamente altas, sinalizadas na paleta de cores quentes, requerem atenção mandatória nos planos de remediação.
-                </p>
-                <div class="grid-raiox">
-                    {html_x}
-                </div>
-
-                <div style="page-break-before: always;"></div>
-
-                <h4>6. ARQUITETURA DO PLANO DE AÇÃO ESTRATÉGICO SUGERIDO PELA IA (GRO)</h4>
-                <p style="font-size: 10px; color: #777; margin-bottom: 15px; margin-top: -10px; font-style: italic;">
-                    A tabela subsequente foi refinada pelo algoritmo consultivo para combater diretamente e com máxima eficiência as maiores ameaças listadas nas piores pontuações encontradas no radar de escaneamento interno.
-                </p>
-                <table style="width: 100%; border-collapse: collapse; font-size: 10px; font-family: 'Helvetica Neue', Helvetica, Arial, sans-serif; box-shadow: 0 0 0 1px #eef2f5; border-radius: 8px; overflow: hidden;">
-                    <thead>
-                        <tr style="background-color: {COR_PRIMARIA}; color: #ffffff;">
-                            <th style="padding: 12px 10px; text-align: left; font-weight: 600; letter-spacing: 0.5px;">AÇÃO MACRO / TÍTULO</th>
-                            <th style="padding: 12px 10px; text-align: left; font-weight: 600; letter-spacing: 0.5px;">DESDOBRAMENTO E ESTRATÉGIA PRÁTICA DETALHADA</th>
-                            <th style="padding: 12px 10px; text-align: center; font-weight: 600; letter-spacing: 0.5px;">ÁREA FOCO</th>
-                            <th style="padding: 12px 10px; text-align: left; font-weight: 600; letter-spacing: 0.5px;">ATOR RESPONSÁVEL</th>
-                            <th style="padding: 12px 10px; text-align: left; font-weight: 600; letter-spacing: 0.5px;">TIMELINE/PRAZO</th>
-                        </tr>
-                    </thead>
-                    <tbody>
-                        {html_act_final}
-                    </tbody>
-                </table>
+        with st.expander("🔎 Drill-down Analítico por Setor (Cubo de Dados)"):
+            cube = get_analytics_cube(responses_data, st.session_state.hse_questions)
+            setores_cubo = cube.drilldown('setor', company=[empresa['id']])
+            if setores_cubo:
+                st.dataframe(pd.DataFrame([
+                    {"Setor": s['setor'], "Respondentes": s['respondentes'], "Score Geral": s['score'], **s['dimensoes']}
+                    for s in setores_cubo
+                ]), use_container_width=True)
+                setor_drill = st.selectbox("Detalhar a exposição por pergunta do setor:", [s['setor'] for s in setores_cubo])
+                detalhe_setor = next(s for s in setores_cubo if s['setor'] == setor_drill)['detalhe_perguntas']
+                st.dataframe(pd.DataFrame(
+                    [{"Pergunta": q, "Exposição (%)": v} for q, v in detalhe_setor.items()]
+                ).sort_values("Exposição (%)", ascending=False), use_container_width=True)
+            else:
+                st.info(f"Nenhum setor desta empresa atingiu o mínimo de {MIN_RESPONDENTES_CELULA} respondentes para exibição segura.")
 
-                <h4>7. DESPACHO E CONCLUSÃO TÉCNICA EMANADA DO LAUDO AUDITADO</h4>
-                <div style="text-align: justify; font-size: 11px; line-height: 1.8; background-color: #f8fbfc; padding: 25px; border-radius: 8px; border: 1px solid #eef2f5; color: #444; white-space: pre-wrap;">
-                    {analise_texto}
-                </div>
+        with st.expander("📊 Benchmark Setorial (Divisão CNAE x Grau de Risco)"):
+            indice_bench = get_benchmark_index(st.session_state.hse_questions)
+            benchmark = indice_bench.percentiles(empresa) if indice_bench else None
+            if indice_bench is None:
+                st.warning("Benchmark indisponível no momento: os agregados setoriais da base não puderam ser lidos.")
+            elif benchmark:
+                st.caption(f"Grupo de referência: {benchmark['grupo']} · {benchmark['empresas']} empresas")
+                st.dataframe(pd.DataFrame([
+                    {"Indicador": u['unidade'], "Nota da Empresa": u['valor'], "Percentil": u['percentil'], "P25": u['p25'], "Mediana": u['mediana'], "P75": u['p75']}
+                    for u in benchmark['unidades'] if u['tipo'] != 'pergunta'
+                ]), use_container_width=True, hide_index=True)
+                st.dataframe(pd.DataFrame([
+                    {"Pergunta": u['unidade'], "Exposição (%)": u['valor'], "Percentil de Exposição": u['percentil'], "Mediana do Setor (%)": u['mediana']}
+                    for u in benchmark['unidades'] if u['tipo'] == 'pergunta'
+                ]).sort_values("Percentil de Exposição", ascending=False), use_container_width=True, hide_index=True)
+            else:
+                st.info(f"Sem grupo de referência publicável: é preciso CNAE informado e ao menos {BENCHMARK_MIN_EMPRESAS} empresas avaliadas na mesma divisão CNAE.")
 
-                <div style="margin-top: 80px; display: flex; justify-content: space-around; gap: 60px;">
-                    <div style="flex: 1; text-align: center; border-top: 1px solid #2c3e50; padding-top: 12px;">
-                        <div style="font-weight: 800; font-size: 12px; color: #2c3e50; text-transform: uppercase;">{sig_empresa_nome}</div>
-                        <div style="color: #7f8c8d; font-size: 10px; margin-top: 4px;">{sig_empresa_cargo}</div>
-                        <div style="color: #95a5a6; font-size: 9px; margin-top: 2px;">Assinatura por delegação da Contratante</div>
-                    </div>
-                    <div style="flex: 1; text-align: center; border-top: 1px solid #2c3e50; padding-top: 12px;">
-                        <div style="font-weight: 800; font-size: 12px; color: #2c3e50; text-transform: uppercase;">{sig_tecnico_nome}</div>
-                        <div style="color: #7f8c8d; font-size: 10px; margin-top: 4px;">{sig_tecnico_cargo}</div>
-                        <div style="color: #95a5a6; font-size: 9px; margin-top: 2px;">Chancela Técnica Eletrônica da Especialista</div>
-                    </div>
-                </div>
-                
-                {lgpd_note}
-            </body>
-            </html>
-            """
-            
-            # Formatação segura para download do string gigantesco (sem quebra de bytes)
-            b64_pdf = base64.b64encode(raw_html.encode('utf-8')).decode('utf-8')
-            
-            st.markdown(f"""
-            <a href="data:text/html;base64,{b64_pdf}" download="Laudo_Oficial_NR01_{empresa["id"]}.html" style="
-                text-decoration: none; 
-                background-color: {COR_PRIMARIA}; 
-                color: #ffffff; 
-                padding: 15px 30px; 
-                border-radius: 8px; 
-                font-weight: 800; 
-                display: inline-block;
-                box-shadow: 0 4px 6px rgba(0,0,0,0.2);
-                transition: transform 0.2s;
-                text-transform: uppercase;
-                letter-spacing: 1px;
-                width: 100%;
-                text-align: center;
-                margin-bottom: 20px;
-            ">
-                ⬇️ BAIXAR LAUDO TÉCNICO CORPORATIVO COMPLETO (ARQUIVO SEGURO HTML)
-            </a>
-            """, unsafe_allow_html=True)
-            
+        # --- PDF OFICIAL EM SEGUNDO PLANO (CACHE PELO HASH DO CONTEÚDO) ---
+        laudo_payload = laudo_pdf_payload(
+            empresa, st.session_state.hse_questions, st.session_state.acoes_list, analise_texto,
+            {"empresa_nome": sig_empresa_nome, "empresa_cargo": sig_empresa_cargo, "tecnico_nome": sig_tecnico_nome, "tecnico_cargo": sig_tecnico_cargo},
+            benchmark
+        )
+        laudo_key = report_content_hash("laudo", laudo_payload)
+        if st.button("📥 Sintetizar Arquivo do Laudo Analítico (PDF Oficial + HTML)", type="primary"):
+            submit_report("laudo", laudo_payload)
+            st.session_state.html_laudo_key = laudo_key
+        report_download_panel(laudo_key, f"Laudo_Oficial_NR01_{empresa['id']}.pdf", "⬇️ BAIXAR LAUDO TÉCNICO CORPORATIVO (PDF)")
+        
+        # --- VERSÃO HTML DO LAUDO (BYTES PELO ENDPOINT DE DOWNLOAD + PRÉVIA OPCIONAL) ---
+        # Fica disponível enquanto o conteúdo for o mesmo que foi sintetizado (editar o laudo pede nova síntese)
+        if st.session_state.get('html_laudo_key') == laudo_key:
+            st.markdown("---")
+            raw_html = build_laudo_html(
+                empresa, st.session_state.hse_questions, st.session_state.acoes_list, analise_texto,
+                sig_empresa_nome, sig_empresa_cargo, sig_tecnico_nome, sig_tecnico_cargo, benchmark
+            )
+            html_report_panel(raw_html, f"Laudo_Oficial_NR01_{empresa['id']}.html", "⬇️ BAIXAR LAUDO TÉCNICO CORPORATIVO COMPLETO (ARQUIVO HTML)", "laudo")
             st.info("💡 **Dica de Tecnologia (Acelerador RH):** Após o arquivo baixar para o seu computador, abra ele dando dois cliques. No seu navegador, pressione as teclas `Ctrl + P` (no Windows) ou `Cmd + P` (no Mac). Escolha a opção **'Salvar como PDF'**, desmarque os cabeçalhos/rodapés nas configurações e marque a opção **'Gráficos de Plano de Fundo'** para extrair o design impecável e com as cores originais da identidade da sua plataforma.")
-            
-            st.markdown("<hr>", unsafe_allow_html=True)
-            st.subheader("Modo Exibição (Canvas Viewer - Preview do Documento Final):")
-            st.components.v1.html(raw_html, height=1000, scrolling=True)
+
+        # --- EXPORTAÇÃO EM LOTE (UM ZIP COM OS LAUDOS DE VÁRIAS EMPRESAS) ---
+        st.markdown("---")
+        with st.expander("🗂️ Exportação em Lote: Laudos de Todas as Empresas (ZIP)"):
+            avaliadas = [e for e in visible_companies if e.get('respondidas', 0) > 0]
+            if not avaliadas:
+                st.info("Nenhuma empresa visível possui respostas coletadas para compor um laudo.")
+            else:
+                st.caption("Cada laudo usa o parecer e o plano de ação automáticos da empresa, com o selo técnico da barra lateral. Empresas sem alteração desde a última exportação são reaproveitadas do cache.")
+                # Seleção por id, como no lote de links (Gerar Link)
+                nomes_lote = {e['id']: f"{e['razao']} ({e['id']})" for e in avaliadas}
+                lote_sel = st.multiselect("Empresas incluídas no lote", list(nomes_lote), default=list(nomes_lote), format_func=nomes_lote.get, key="lote_laudos_sel")
+                if st.button("📦 Gerar ZIP com os Laudos Selecionados", disabled=not lote_sel):
+                    indice_bench = get_benchmark_index(st.session_state.hse_questions)
+                    documentos = []
+                    for e in avaliadas:
+                        if e['id'] not in lote_sel:
+                            continue
+                        dims = e.get('dimensoes', {})
+                        documentos.append((f"Laudo_Oficial_NR01_{e['id']}.pdf", laudo_pdf_payload(
+                            e, st.session_state.hse_questions, default_action_plan(gerar_banco_sugestoes(dims)), gerar_analise_robusta(dims),
+                            {"empresa_nome": e.get('resp', ''), "empresa_cargo": sig_empresa_cargo, "tecnico_nome": sig_tecnico_nome, "tecnico_cargo": sig_tecnico_cargo},
+                            indice_bench.percentiles(e) if indice_bench else None
+                        )))
+                    barra = st.progress(0.0, text=f"Preparando {len(documentos)} laudos...")
+                    zip_bytes, reaproveitados, falhas = export_reports_zip(
+                        documentos, "laudo",
+                        on_progress=lambda feitos, total, nome: barra.progress(feitos / total, text=f"{feitos}/{total} laudos prontos · {nome}")
+                    )
+                    st.session_state.lote_laudos = {"zip": zip_bytes, "total": len(documentos) - len(falhas), "reaproveitados": reaproveitados, "falhas": falhas}
+                lote = st.session_state.get('lote_laudos')
+                if lote:
+                    st.success(f"{lote['total']} laudos no arquivo ({lote['reaproveitados']} reaproveitados do cache).")
+                    for nome, erro in lote['falhas']:
+                        st.warning(f"Falha ao gerar {nome}: {erro}")
+                    st.download_button(
+                        "⬇️ BAIXAR ZIP DOS LAUDOS (PDF)", data=lote['zip'], file_name=f"Laudos_NR01_{datetime.date.today().strftime('%Y%m%d')}.zip",
+                        mime="application/zip", type="primary", use_container_width=True, on_click="ignore"
+                    )
 
     elif selected == "Histórico & Comparativo":
         st.title("Hub Histórico Evolutivo (Inteligência Temporal de Saúde Mental)")
@@ -2001,13 +4614,24 @@ def admin_dashboard():
         empresa = next((c for c in visible_companies if c['razao'] == empresa_nome), None)
         
         if empresa:
-            # GERA HISTÓRICO REAL COM BASE NO BANCO DE DADOS (AGRUPAMENTO POR TIMESTAMP MÊS/ANO VERÍDICO)
-            history_data = generate_real_history(empresa['id'], responses_data, st.session_state.hse_questions, empresa.get('func', 1))
+            # Granularidade do histórico: mês, trimestre ou janelas de datas definidas pelo usuário
+            g1, g2, g3 = st.columns([1, 2, 1])
+            granularidade = HISTORY_GRANULARITIES[g1.radio("Granularidade da Linha do Tempo", list(HISTORY_GRANULARITIES.keys()), horizontal=True)]
+            if granularidade == "custom":
+                hoje = datetime.date.today()
+                faixa = g2.date_input("Intervalo Analisado", (hoje - datetime.timedelta(days=364), hoje), format="DD/MM/YYYY")
+                janela = g3.number_input("Janela (dias)", min_value=7, max_value=366, value=90, step=1)
+                if not isinstance(faixa, (tuple, list)) or len(faixa) != 2:
+                    st.info("Selecione a data inicial e a data final do intervalo."); return
+                granularidade = build_custom_history_ranges(faixa[0], faixa[1], int(janela))
+            
+            # GERA HISTÓRICO REAL COM BASE NO BANCO DE DADOS (AGRUPAMENTO VETORIZADO POR PERÍODO)
+            history_data = get_company_history(empresa['id'], responses_data, st.session_state.hse_questions, empresa.get('func', 1), empresa.get('respondidas', 0), granularity=granularidade)
             
             if not history_data:
                 st.info("ℹ️ Ops! A inteligência de dados informa que não há respostas válidas e decodificadas registradas para esta empresa no banco de dados ainda. As predições e o histórico evolutivo se formarão retroativamente conforme a coleta fluir ativamente nos próximos ciclos de pesquisa com a equipe.")
             else:
-                tab_evo, tab_comp = st.tabs(["📈 Mapa Gráfico Contínuo (Curva de Evolução)", "⚖️ Balança Analítica Direta (Raio-X: Período A vs Período B)"])
+                tab_evo, tab_setor, tab_comp = st.tabs(["📈 Mapa Gráfico Contínuo (Curva de Evolução)", "🏢 Evolução por Setor", "⚖️ Balança Analítica Direta (Raio-X: Período A vs Período B)"])
                 
                 with tab_evo:
                     st.markdown("<div class='chart-container'>", unsafe_allow_html=True)
@@ -2033,8 +4657,57 @@ def admin_dashboard():
                     st.plotly_chart(fig_line, use_container_width=True)
                     st.markdown("</div>", unsafe_allow_html=True)
 
+                with tab_setor:
+                    st.markdown("<div class='chart-container'>", unsafe_allow_html=True)
+                    cube = get_analytics_cube(responses_data, st.session_state.hse_questions)
+                    serie_setores = sorted(
+                        [s for s in cube.slice(company=[empresa['id']]).rollup(('month', 'setor')) if s['month'] not in ("sem-data", "geral")],
+                        key=lambda s: s['month']
+                    )
+                    if serie_setores:
+                        df_setores = pd.DataFrame([{"periodo": period_label(s['month']), "setor": s['setor'], "score": s['score']} for s in serie_setores])
+                        fig_setores = px.line(df_setores, x='periodo', y='score', color='setor', markers=True, title="Score Geral por Setor ao longo do Tempo")
+                        fig_setores.update_layout(yaxis_range=[1, 5], plot_bgcolor='#fafbfc', xaxis_title="Janela de Monitoramento", yaxis_title="Score HSE (1 a 5)")
+                        st.plotly_chart(fig_setores, use_container_width=True)
+                    else:
+                        st.info(f"Nenhum recorte setor x mês atingiu o mínimo de {MIN_RESPONDENTES_CELULA} respondentes para exibição segura.")
+                    st.markdown("</div>", unsafe_allow_html=True)
+                    
+                    # Teste de significância entre dois setores (todas as respostas de cada um)
+                    comp_rows = [r for r in responses_data if str(r.get('company_id')) == str(empresa['id'])]
+                    setores_resp = sorted({r.get('setor') or "Geral" for r in comp_rows})
+                    if len(setores_resp) >= 2:
+                        st.markdown("##### 🧪 Diferença Real entre Setores? (IC 95%)")
+                        s1, s2 = st.columns(2)
+                        setor_a = s1.selectbox("Setor A", setores_resp, index=0)
+                        setor_b = s2.selectbox("Setor B", setores_resp, index=1)
+                        if setor_a != setor_b:
+                            resultado_setores = compare_setores(comp_rows, setor_a, setor_b, st.session_state.hse_questions)
+                            tabela_setores = pd.DataFrame(significance_rows(resultado_setores, st.session_state.hse_questions))
+                            st.dataframe(tabela_setores.rename(columns={"Período A": f"Setor A ({setor_a})", "Período B": f"Setor B ({setor_b})"}), use_container_width=True, hide_index=True)
+
                 with tab_comp:
-                    if len(history_data) < 2:
+                    modo_comp = st.radio("Base da Comparação", ["Períodos da Linha do Tempo", "Intervalos de Datas Livres"], horizontal=True)
+                    dados_a = dados_b = None
+                    if modo_comp == "Intervalos de Datas Livres":
+                        # Intervalos arbitrários (ex: trimestres, antes/depois de uma intervenção) via somas de prefixo por dia
+                        prefix = get_company_prefix_sums(empresa['id'], responses_data, st.session_state.hse_questions)
+                        if prefix.first_day is None:
+                            st.warning("⚠️ Nenhuma resposta datada desta empresa para montar intervalos de comparação.")
+                        else:
+                            primeiro, ultimo = prefix.first_day, prefix.last_day
+                            meio = primeiro + (ultimo - primeiro) // 2
+                            c1, c2 = st.columns(2)
+                            faixa_a = c1.date_input("Período A - Referência Base (Início e Fim)", (primeiro, meio), min_value=primeiro, max_value=ultimo, format="DD/MM/YYYY")
+                            faixa_b = c2.date_input("Período B - Efeito/Resultado (Início e Fim)", (min(meio + datetime.timedelta(days=1), ultimo), ultimo), min_value=primeiro, max_value=ultimo, format="DD/MM/YYYY")
+                            if len(faixa_a) == 2 and len(faixa_b) == 2:
+                                dados_a = prefix.range_summary(faixa_a[0], faixa_a[1], empresa.get('func', 1))
+                                dados_b = prefix.range_summary(faixa_b[0], faixa_b[1], empresa.get('func', 1))
+                                periodo_a, periodo_b = dados_a['periodo'], dados_b['periodo']
+                                if dados_a['respondidas'] == 0 or dados_b['respondidas'] == 0:
+                                    st.warning("⚠️ Um dos intervalos selecionados não possui respostas registradas. Ajuste as datas para comparar.")
+                                    dados_a = dados_b = None
+                    elif len(history_data) < 2:
                         st.warning("⚠️ Dados limiares e insuficientes para ancorar um comparativo sólido de ciclos com integridade matemática. Para a geração de evidências concretas no relatório evolutivo (A vs B), exige-se, logicamente, que o organismo alvo tenha submetido avaliações na base de dados em, pelo menos, 2 (dois) recortes de tempo distintos (Exemplo: Meses diferentes em nossa timeline).")
                     else:
                         st.write("Determine as balizas temporais que alimentarão as matrizes matemáticas.")
@@ -2044,168 +4717,63 @@ def admin_dashboard():
                         
                         dados_a = next((h for h in history_data if h['periodo'] == periodo_a), None)
                         dados_b = next((h for h in history_data if h['periodo'] == periodo_b), None)
+                    
+                    if dados_a and dados_b:
+                        st.markdown("<div class='chart-container'>", unsafe_allow_html=True)
+                        categories = list(dados_a['dimensoes'].keys())
+                        fig_comp = go.Figure()
                         
-                        if dados_a and dados_b:
-                            st.markdown("<div class='chart-container'>", unsafe_allow_html=True)
-                            categories = list(dados_a['dimensoes'].keys())
-                            fig_comp = go.Figure()
-                            
-                            # Radar A - Formatação translúcida para melhor visualização comparativa
-                            fig_comp.add_trace(go.Scatterpolar(
-                                r=list(dados_a['dimensoes'].values()), 
-                                theta=categories, 
-                                fill='toself', 
-                                name=f'Análise Censitária: {periodo_a}', 
-                                line_color=COR_COMP_A, 
-                                opacity=0.4
-                            ))
-                            
-                            # Radar B - Formatação sobreposta e focada no destaque da evolução
-                            fig_comp.add_trace(go.Scatterpolar(
-                                r=list(dados_b['dimensoes'].values()), 
-                                theta=categories, 
-                                fill='toself', 
-                                name=f'Análise Censitária: {periodo_b}', 
-                                line_color=COR_COMP_B, 
-                                opacity=0.8
-                            ))
-                            
-                            fig_comp.update_layout(
-                                polar=dict(radialaxis=dict(visible=True, range=[0, 5])),
-                                title="Sobreposição Geométrica Direta das Malhas Organizacionais (Radar A x B)"
-                            )
-                            st.plotly_chart(fig_comp, use_container_width=True)
-                            st.markdown("</div>", unsafe_allow_html=True)
-                            
-                            # --- ROTINA PESADA DE ENGENHARIA DE DOCUMENTO EVOLUTIVO EM HTML (CÓDIGO ABERTO/EXPANDIDO) ---
-                            if st.button("📥 Sintetizar e Baixar Documento Comparativo Oficial (Motor HTML > PDF)", type="primary"):
-                                 logo_html = get_logo_html(150)
-                                 
-                                 # Lógica pura e simples de saldo/evolução de KPIs da empresa
-                                 diff_score = dados_b['score'] - dados_a['score']
-                                 txt_evolucao = "uma melhoria palpável e generalizada" if diff_score > 0 else "um platô de estabilidade que exige vigília contínua, ou, de modo agravante, uma sinalização técnica de queda que denota forte ponto de atenção crítico imediato"
-                                 
-                                 # Injeção de Barras Visuais Inteligentes com CSS Inline Robusto para impressão offline perfeita
-                                 chart_css_viz = f"""
-                                 <div style="padding: 25px; border: 1px solid #e0e6ed; border-radius: 12px; font-family: 'Helvetica Neue', Helvetica, Arial, sans-serif; background: #ffffff; box-shadow: 0 4px 15px rgba(0,0,0,0.03);">
-                                     <div style="margin-bottom: 25px;">
-                                         <div style="display: flex; justify-content: space-between; align-items: baseline; margin-bottom: 8px;">
-                                             <strong style="color: #34495e; font-size: 12px; text-transform: uppercase; letter-spacing: 0.5px;">Volume e Score da Análise Período [{periodo_a}]:</strong> 
-                                             <span style="font-size: 24px; font-weight: 900; color: {COR_COMP_A}">{dados_a['score']} <span style="font-size: 12px; color: #aab7b8;">/ 5.0</span></span>
-                                         </div>
-                                         <div style="width: 100%; background: #ecf0f1; height: 18px; border-radius: 9px; overflow: hidden; box-shadow: inset 0 2px 4px rgba(0,0,0,0.06);">
-                                            <div style="width: {(dados_a['score']/5)*100}%; background: {COR_COMP_A}; height: 18px; border-radius: 9px;"></div>
-                                         </div>
-                                     </div>
-                                     <div>
-                                         <div style="display: flex; justify-content: space-between; align-items: baseline; margin-bottom: 8px;">
-                                             <strong style="color: #34495e; font-size: 12px; text-transform: uppercase; letter-spacing: 0.5px;">Volume e Score da Análise Período [{periodo_b}]:</strong> 
-                                             <span style="font-size: 24px; font-weight: 900; color: {COR_COMP_B}">{dados_b['score']} <span style="font-size: 12px; color: #aab7b8;">/ 5.0</span></span>
-                                         </div>
-                                         <div style="width: 100%; background: #ecf0f1; height: 18px; border-radius: 9px; overflow: hidden; box-shadow: inset 0 2px 4px rgba(0,0,0,0.06);">
-                                            <div style="width: {(dados_b['score']/5)*100}%; background: {COR_COMP_B}; height: 18px; border-radius: 9px;"></div>
-                                         </div>
-                                     </div>
-                                 </div>
-                                 """
-
-                                 # Estruturação HTML Completa do Dossiê Evolutivo (Expandida para evitar quebra/minificação)
-                                 html_comp = f"""
-                                 <!DOCTYPE html>
-                                 <html lang="pt-BR">
-                                 <head>
-                                     <meta charset="utf-8">
-                                     <title>Relatório Evolutivo HSE</title>
-                                     <style>
-                                         body {{
-                                             font-family: 'Segoe UI', 'Helvetica Neue', Helvetica, Arial, sans-serif;
-                                             padding: 40px 30px;
-                                             color: #2c3e50;
-                                             background: white;
-                                             line-height: 1.6;
-                                         }}
-                                         .linha-divisor {{ border-bottom: 2px solid {COR_PRIMARIA}; padding-bottom: 15px; margin-bottom: 25px; display: flex; justify-content: space-between; align-items: center; }}
-                                         .box-infos {{ background: #f8fbfc; padding: 20px; border-radius: 8px; margin-bottom: 25px; border-left: 5px solid {COR_SECUNDARIA}; }}
-                                         h4 {{ color: {COR_PRIMARIA}; border-left: 4px solid {COR_SECUNDARIA}; padding-left: 12px; margin-top: 35px; font-size: 14px; text-transform: uppercase; }}
-                                         .tabela-kpi {{ width: 100%; border-collapse: collapse; font-size: 12px; margin-bottom: 30px; box-shadow: 0 0 0 1px #eef2f5; border-radius: 6px; overflow: hidden; }}
-                                         .tabela-kpi th {{ background-color: {COR_PRIMARIA}; color: white; padding: 12px; text-align: center; font-weight: 600; letter-spacing: 0.5px; }}
-                                         .tabela-kpi td {{ padding: 12px; border-bottom: 1px solid #eef2f5; text-align: center; color: #34495e; }}
-                                         .tabela-kpi td:first-child {{ text-align: left; font-weight: 600; }}
-                                         .rodape {{ margin-top: 60px; font-size: 9px; color: #95a5a6; text-align: center; border-top: 1px dashed #e0e6ed; padding-top: 15px; letter-spacing: 0.5px; text-transform: uppercase; }}
-                                     </style>
-                                 </head>
-                                 <body>
-                                     <div class="linha-divisor">
-                                         <div>{logo_html}</div>
-                                         <div style="text-align:right;">
-                                             <div style="font-size:20px; font-weight:900; color:{COR_PRIMARIA}; letter-spacing: -0.5px;">DOSSIÊ TÉCNICO EVOLUTIVO</div>
-                                             <div style="font-size:11px; color:#7f8c8d; font-weight:600; letter-spacing: 1px;">Análise Comparativa Temporal de Saúde Ocupacional Corporativa</div>
-                                         </div>
-                                     </div>
-                                     
-                                     <div class="box-infos">
-                                         <div style="font-size:10px; color:#95a5a6; margin-bottom:6px; font-weight: 800; letter-spacing: 1px;">DADOS CADASTRAIS DA ORGANIZAÇÃO AUDITADA</div>
-                                         <div style="font-weight:900; font-size:16px; margin-bottom:8px; color:#2c3e50;">{empresa['razao']}</div>
-                                         <div style="display: flex; gap: 20px; margin-top: 10px;">
-                                             <div style="font-size:11px;"><strong>CNPJ Atrelado:</strong> <span style="color:#7f8c8d;">{empresa.get('cnpj','Não Especificado no Sistema')}</span></div>
-                                             <div style="font-size:11px;"><strong>Janelas Temporais Sob Análise Crítica Restrita:</strong> <span style="color:{COR_PRIMARIA}; font-weight: bold; background: #eef2f5; padding: 2px 6px; border-radius: 4px;">{periodo_a}</span> VERSUS <span style="color:{COR_PRIMARIA}; font-weight: bold; background: #eef2f5; padding: 2px 6px; border-radius: 4px;">{periodo_b}</span></div>
-                                         </div>
-                                     </div>
-                                     
-                                     <h4>1. PAINEL DE RESUMO DA MATRIZ DE INDICADORES CHAVE (OVERALL KPIs)</h4>
-                                     <table class="tabela-kpi">
-                                         <tr>
-                                             <th>SINTOMA / INDICADOR ANALISADO</th>
-                                             <th>MARCO REFERÊNCIA [{periodo_a}]</th>
-                                             <th>MARCO CONSTATADO [{periodo_b}]</th>
-                                             <th>VARIAÇÃO LÍQUIDA (DELTA)</th>
-                                         </tr>
-                                         <tr>
-                                             <td>Score Geral da Organização (Cálculo Composto)</td>
-                                             <td>{dados_a['score']}</td>
-                                             <td>{dados_b['score']}</td>
-                                             <td style="font-weight:900; color:{'#27ae60' if diff_score > 0 else '#c0392b'};">{diff_score:+.2f} pts</td>
-                                         </tr>
-                                         <tr>
-                                             <td>Taxa Bruta de Adesão e Participação Censitária (%)</td>
-                                             <td>{dados_a['adesao']}%</td>
-                                             <td>{dados_b['adesao']}%</td>
-                                             <td style="font-weight:bold; color:#7f8c8d;">{(dados_b['adesao'] - dados_a['adesao']):+.1f}% de tração</td>
-                                         </tr>
-                                     </table>
-                                     
-                                     <h4>2. REPRESENTAÇÃO VISUAL DA TENSÃO E EQUILÍBRIO GRÁFICO</h4>
-                                     {chart_css_viz}
-                                     
-                                     <h4>3. EXPOSIÇÃO E ANÁLISE TÉCNICA PRELIMINAR DOS RESULTADOS</h4>
-                                     <p style="text-align:justify; font-size:12px; line-height:1.7; background:#fbfcfd; padding:20px; border-radius:8px; border: 1px solid #eef2f5; color: #444;">A análise metodológica e estruturada, fruto do levantamento de dados contínuos comparando os dois recortes delimitados, demonstra estatisticamente <strong>{txt_evolucao}</strong> nos índices gerais balizadores do vasto ecossistema de saúde mental e gestão de pressões internas nesta frente corporativa.<br><br>Recomenda-se terminantemente aos diretores, RH e SESMT responsáveis não só garantir a manutenção contínua e incansável dos protocolos protetivos de acompanhamento já vigentes, mas seguir com firmeza incontestável a execução e o compliance da Matriz do Plano de Ação Estratégico. Atenção irredutível e foco de reestruturação prioritário devem incidir sem delongas sobre os times ou dimensões mapeadas que, inegavelmente, não foram hábeis o suficiente para demonstrar oscilação benéfica de variação estatística positiva nesse último ciclo.</p>
-                                     
-                                     <div class="rodape">
-                                         Plataforma Elo NR-01 Enterprise Core | Inteligência em Dados e Saúde Mental no Trabalho<br>Documento Oficial Sigiloso e Criptografado de Caráter Único e Exclusivamente Analítico
-                                     </div>
-                                 </body>
-                                 </html>
-                                 """
-                                 
-                                 # Empacotamento para download da arquitetura string HTML completa (Fim do processo evolutivo)
-                                 b64_comp = base64.b64encode(html_comp.encode('utf-8')).decode('utf-8')
-                                 
-                                 st.markdown(f"""
-                                 <a href="data:text/html;base64,{b64_comp}" download="Dossie_Evolutivo_Oficial_{empresa["id"]}.html" style="
-                                     text-decoration: none; 
-                                     background-color: {COR_PRIMARIA}; 
-                                     color: white; 
-                                     padding: 12px 25px; 
-                                     border-radius: 6px; 
-                                     font-weight: 700; 
-                                     display: inline-block;
-                                     text-transform: uppercase;
-                                     box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-                                 ">
-                                     📥 INICIAR DOWNLOAD DO DOSSIÊ TÉCNICO DE HISTÓRICO (ARQUIVO HTML)
-                                 </a>
-                                 """, unsafe_allow_html=True)
-                                 st.caption("Ao fazer o download e abrir o arquivo no seu navegador (ex: Chrome/Edge), pressione as teclas `Ctrl+P` para formatar a página, marcar as imagens de fundo nas configurações e gerar a exportação fiel do PDF.")
+                        # Radar A - Formatação translúcida para melhor visualização comparativa
+                        fig_comp.add_trace(go.Scatterpolar(
+                            r=list(dados_a['dimensoes'].values()), 
+                            theta=categories, 
+                            fill='toself', 
+                            name=f'Análise Censitária: {periodo_a}', 
+                            line_color=COR_COMP_A, 
+                            opacity=0.4
+                        ))
+                        
+                        # Radar B - Formatação sobreposta e focada no destaque da evolução
+                        fig_comp.add_trace(go.Scatterpolar(
+                            r=list(dados_b['dimensoes'].values()), 
+                            theta=categories, 
+                            fill='toself', 
+                            name=f'Análise Censitária: {periodo_b}', 
+                            line_color=COR_COMP_B, 
+                            opacity=0.8
+                        ))
+                        
+                        fig_comp.update_layout(
+                            polar=dict(radialaxis=dict(visible=True, range=[0, 5])),
+                            title="Sobreposição Geométrica Direta das Malhas Organizacionais (Radar A x B)"
+                        )
+                        st.plotly_chart(fig_comp, use_container_width=True)
+                        st.markdown("</div>", unsafe_allow_html=True)
+                        
+                        # Significância das variações: ICs e teste A x B por dimensão e por pergunta (somas de prefixo)
+                        significancia = None
+                        if dados_a.get('inicio') and dados_b.get('inicio'):
+                            prefix = get_company_prefix_sums(empresa['id'], responses_data, st.session_state.hse_questions)
+                            resultado_sig = prefix.compare_ranges((dados_a['inicio'], dados_a['fim']), (dados_b['inicio'], dados_b['fim']))
+                            significancia = significance_rows(resultado_sig, st.session_state.hse_questions)
+                            st.markdown("##### 🧪 Significância Estatística das Variações (IC 95%)")
+                            st.dataframe(pd.DataFrame(significancia), use_container_width=True, hide_index=True)
+                            with st.expander("Detalhamento por Pergunta"):
+                                st.dataframe(pd.DataFrame(significance_rows(resultado_sig, st.session_state.hse_questions, kinds=("pergunta",))), use_container_width=True, hide_index=True)
+                        else:
+                            st.caption("Períodos sem data registrada não permitem o teste de significância.")
+                        
+                        # --- ROTINA PESADA DE ENGENHARIA DE DOCUMENTO EVOLUTIVO EM HTML (CÓDIGO ABERTO/EXPANDIDO) ---
+                        dossie_payload = dossie_pdf_payload(empresa, periodo_a, periodo_b, dados_a, dados_b, significancia)
+                        dossie_key = report_content_hash("dossie", dossie_payload)
+                        if st.button("📥 Sintetizar e Baixar Documento Comparativo Oficial (PDF Oficial + HTML)", type="primary"):
+                            submit_report("dossie", dossie_payload)
+                            st.session_state.html_dossie_key = dossie_key
+                        report_download_panel(dossie_key, f"Dossie_Evolutivo_Oficial_{empresa['id']}.pdf", "⬇️ BAIXAR DOSSIÊ TÉCNICO EVOLUTIVO (PDF)")
+                        if st.session_state.get('html_dossie_key') == dossie_key:
+                            html_comp = build_dossie_html(empresa, periodo_a, periodo_b, dados_a, dados_b, significancia)
+                            html_report_panel(html_comp, f"Dossie_Evolutivo_Oficial_{empresa['id']}.html", "📥 BAIXAR DOSSIÊ TÉCNICO DE HISTÓRICO (ARQUIVO HTML)", "dossie")
+                            st.caption("Ao fazer o download e abrir o arquivo no seu navegador (ex: Chrome/Edge), pressione as teclas `Ctrl+P` para formatar a página, marcar as imagens de fundo nas configurações e gerar a exportação fiel do PDF.")
 
     elif selected == "Configurações":
         if perm == "Master":
@@ -2220,7 +4788,7 @@ def admin_dashboard():
                 if DB_CONNECTED:
                     usrs_raw = supabase.table('admin_users').select("username, role, credits, linked_company_id").execute().data
                 else:
-                    usrs_raw = [{"username": k, "role": v['role'], "credits": v.get('credits',0)} for k,v in st.session_state.users_db.items()]
+                    usrs_raw = [{"username": u['username'], "role": u['role'], "credits": u.get('credits', 0), "linked_company_id": u.get('linked_company_id')} for u in get_local_storage().list_users()]
                 
                 if usrs_raw: 
                     st.dataframe(pd.DataFrame(usrs_raw), use_container_width=True)
@@ -2240,14 +4808,15 @@ def admin_dashboard():
                         if DB_CONNECTED:
                             try:
                                 supabase.table('admin_users').insert({"username": new_u, "password": new_p, "role": new_r, "credits": 999999 if new_r=="Master" else 500}).execute()
+                                invalidate_data_cache()
                                 st.success(f"✅ Execução perfeita! O usuário [{new_u}] foi consolidado como ativo na Tabela Principal!")
                                 time.sleep(1.5)
                                 st.rerun()
                             except Exception as e: 
                                 st.error(f"Engasgo no roteamento do Supabase DB: Verifique logs ou chaves ativas. {e}")
                         else:
-                            st.session_state.users_db[new_u] = {"password": new_p, "role": new_r, "credits": 999999}
-                            st.success(f"✅ Usuário [{new_u}] instanciado apenas localmente via Session_State!")
+                            get_local_storage().insert_user({"username": new_u, "password": new_p, "role": new_r, "credits": 999999})
+                            st.success(f"✅ Usuário [{new_u}] instanciado apenas no armazenamento local!")
                             time.sleep(1)
                             st.rerun()
                 
@@ -2274,8 +4843,10 @@ def admin_dashboard():
                     new_conf = st.session_state.platform_config.copy()
                     new_conf['name'] = nn
                     new_conf['consultancy'] = nc
-                    if nl: 
-                        new_conf['logo_b64'] = image_to_base64(nl)
+                    logo_ref = store_logo(nl)
+                    if logo_ref: 
+                        new_conf['logo_ref'] = logo_ref
+                        new_conf.pop('logo_b64', None)
                     
                     if DB_CONNECTED:
                         try:
@@ -2284,6 +4855,7 @@ def admin_dashboard():
                                 supabase.table('platform_settings').update({"config_json": new_conf}).eq("id", res.data[0]['id']).execute()
                             else: 
                                 supabase.table('platform_settings').insert({"config_json": new_conf}).execute()
+                            fetch_platform_settings.clear()
                         except: 
                             pass
                             
@@ -2310,6 +4882,7 @@ def admin_dashboard():
                                 supabase.table('platform_settings').update({"config_json": new_conf}).eq("id", res.data[0]['id']).execute()
                             else: 
                                 supabase.table('platform_settings').insert({"config_json": new_conf}).execute()
+                            fetch_platform_settings.clear()
                         except: pass
                         
                     st.session_state.platform_config = new_conf
@@ -2317,12 +4890,64 @@ def admin_dashboard():
                     time.sleep(1.5)
                     st.rerun()
                     
+                st.markdown("---")
+                st.write("### Agregados Analíticos Pré-Calculados (Empresa x Setor x Mês)")
+                st.caption("Recalcula a tabela response_aggregates a partir de todas as respostas gravadas. Utilize após aplicar a migração no banco ou para corrigir divergências. Evite executar durante campanhas de coleta ativas.")
+                if st.button("🧮 Reconstruir Agregados a partir das Respostas (Backfill)"):
+                    if DB_CONNECTED:
+                        try:
+                            total_linhas = rebuild_response_aggregates(st.session_state.hse_questions)
+                            st.success(f"✅ Backfill concluído: {total_linhas} linhas agregadas gravadas.")
+                        except Exception as e:
+                            st.error(f"Falha ao reconstruir os agregados: {e}")
+                    else:
+                        st.warning("Disponível apenas com o banco de dados conectado.")
+                    
+                st.markdown("---")
+                st.write("### Formato Compacto das Respostas")
+                st.caption("Converte as respostas antigas (gravadas com o texto integral das perguntas) para o formato compacto por id de pergunta, reduzindo o tamanho trafegado em cada carga do painel. Os scores não são alterados.")
+                if st.button("🗜️ Migrar Respostas Legadas para o Formato Compacto"):
+                    try:
+                        if DB_CONNECTED:
+                            total_migradas = migrate_answers_to_compact(st.session_state.hse_questions)
+                        else:
+                            total_migradas = migrate_local_answers_to_compact(st.session_state.hse_questions)
+                        st.success(f"✅ Migração concluída: {total_migradas} respostas convertidas.")
+                    except Exception as e:
+                        st.error(f"Falha na migração das respostas: {e}")
+                    
+                st.markdown("---")
+                st.write("### Repositório de Logos")
+                st.caption("Move os logos ainda gravados em base64 dentro das empresas e da configuração da plataforma para o repositório de ativos (reduzidos para no máximo 512 px), deixando nos cadastros apenas a referência. A listagem de empresas deixa de trafegar as imagens.")
+                if st.button("🖼️ Migrar Logos para o Repositório de Ativos"):
+                    try:
+                        total_logos = migrate_inline_logos()
+                        st.success(f"✅ Migração concluída: {total_logos} logos movidos para o repositório.")
+                    except Exception as e:
+                        st.error(f"Falha na migração dos logos: {e}")
+                    
                 st.markdown("---")
                 st.write("### Hub de Informação e Diagnóstico Técnico de Infraestrutura API")
-                if DB_CONNECTED: 
+                if DB_CONNECTED and supabase.is_open():
+                    st.error(f"🔴 Disjuntor do banco ABERTO: as consultas estão suspensas por até {CIRCUIT_RESET_SECONDS}s após {supabase.consecutive_failures} falhas seguidas. O painel está servindo o último retrato válido dos dados.")
+                elif DB_CONNECTED: 
                     st.info("🟢 Telemetria Informa: O Hub Central de Relacionamento (Supabase PostgreSQL Engine) encontra-se estritamente Online e totalmente sincronizado. Funcionalidade integral, salvamento cruzado e processos de permanência real da base de dados foram todos habilitados e rodando em plano de fundo sem anomalias.")
                 else: 
                     st.error("🔴 Anomalia Fetal Informada: A conexão via API REST com o provedor em nuvem do Supabase Engine encontra-se Offline, obstruída ou instável por falha nos tokens Secretos inseridos. O aplicativo de software precisou retroceder para ambiente seguro local, alocando-se puramente em um modelo frágil e transitório de cache. Atualizar esta página, limpar os cookies ou reiniciar o host culminarão na eliminação indesejada de quaisquer atualizações produzidas. Verifique de imediato seu console de desenvolvedor.")
+                    if DB_CONNECT_ERROR:
+                        st.caption(f"Falha ao iniciar a conexão: {DB_CONNECT_ERROR}")
+                
+                if DB_CONNECTED:
+                    st.write("#### Métricas de Acesso ao Banco (desde o início do processo)")
+                    c_m1, c_m2, c_m3 = st.columns(3)
+                    c_m1.metric("Falhas Seguidas", supabase.consecutive_failures)
+                    c_m2.metric("Aberturas do Disjuntor", supabase.circuit_opens)
+                    c_m3.metric("Estado do Disjuntor", "Aberto" if supabase.is_open() else "Fechado")
+                    metricas_db = supabase.metrics_rows()
+                    if metricas_db:
+                        st.dataframe(pd.DataFrame(metricas_db), use_container_width=True, hide_index=True)
+                    if supabase.last_error:
+                        st.caption(f"Último erro registrado: {supabase.last_error}")
                 st.markdown("</div>", unsafe_allow_html=True)
         else:
             st.error("🚫 Bloqueio de Proteção: Este módulo analítico possui um alto grau de intervenção estrutural e tem acesso severamente negado e bloqueado a usuários fora do grupo de permissão 'Master'.")
@@ -2334,16 +4959,8 @@ def survey_screen():
     """Esta é a tela blindada onde apenas a pessoa base acessa através do celular ou pc para dar suas repostas."""
     cod = st.query_params.get("cod")
     
-    # 1. Busca a empresa de forma blindada com dupla checagem (DB prioritário vs Local backup)
-    comp = None
-    if DB_CONNECTED:
-        try:
-            res = supabase.table('companies').select("*").eq('id', cod).execute()
-            if res.data: comp = res.data[0]
-        except: pass
-        
-    if not comp: 
-        comp = next((c for c in st.session_state.companies_db if c['id'] == cod), None)
+    # 1. Busca a empresa de forma blindada com dupla checagem (DB prioritário vs Local backup), pelo descritor em cache
+    comp = survey_company(cod)
     
     # 2. Pareamento com Firewall contra invasores (Bloqueio duro por URL não reconhecida)
     if not comp: 
@@ -2359,16 +4976,14 @@ def survey_screen():
                 return
         except: pass
         
-    limit_evals = comp.get('limit_evals', 999999)
-    resp_count = comp.get('respondidas', 0) if comp.get('respondidas') is not None else 0
-    if resp_count >= limit_evals:
+    if comp['respondidas'] >= comp['limit_evals']:
         st.error("⚠️ Um barramento compulsório ativou este aviso: O limite de vidas populacionais alocadas neste contrato específico na nuvem chegou em seu teto global e bloqueou a transição de mais nenhuma nova requisição e adição.")
         st.caption("Para voltar a ter o link normalizado pela segurança da rede, basta solicitar a expansão global para nossa central, que assim faremos de imediato no portal base.")
         return
     
     # 4. Renderizacao Dinâmica do Hub Físico que será impresso para o operador ver
     logo = get_logo_html(150)
-    if comp.get('logo_b64'): logo = f"<img src='data:image/png;base64,{comp.get('logo_b64')}' width='180'>"
+    if comp['logo_uri']: logo = f"<img src='{comp['logo_uri']}' width='180'>"
     
     st.markdown(f"<div style='text-align:center; margin-bottom: 20px;'>{logo}</div>", unsafe_allow_html=True)
     st.markdown(f"<h3 style='text-align:center; color: {COR_PRIMARIA}; font-weight:800; font-family:sans-serif; text-transform:uppercase;'>Levantamento Metodológico de Risco Psicossocial e Ambientação - Projeto Integrado {comp['razao']}</h3>", unsafe_allow_html=True)
@@ -2390,11 +5005,8 @@ def survey_screen():
         cpf_raw = c1.text_input("Seu CPF de forma limpa (Inserir apenas os números. Evitar por traços ou pontos nos vãos do input)")
         
         # Estrutura Inteligente que processa e mapeia os setores originados no Master para alimentar os funcionários
-        s_keys = ["Geral"] # Fallback de proteção para empresas sem árvore ou seletos apagados na pressa
-        if 'org_structure' in comp and isinstance(comp['org_structure'], dict) and comp['org_structure']:
-            s_keys = list(comp['org_structure'].keys())
-             
-        setor_colab = c2.selectbox("Selecione qual o seu Setor atual de Atuação majoritária no ecossistema da corporação", s_keys)
+        # (o descritor já traz ["Geral"] como fallback para empresas sem árvore ou seletos apagados na pressa)
+        setor_colab = c2.selectbox("Selecione qual o seu Setor atual de Atuação majoritária no ecossistema da corporação", comp['setores'])
         
         st.markdown("---")
         st.write("#### Bloco 2 Avançado. Questionário Metodológico Analítico sobre o Fato Real de Percepção (HSE-Tool)")
@@ -2461,35 +5073,38 @@ def survey_screen():
                             cpf_already_exists = True
                     except: pass
                 else:
-                    for r in st.session_state.local_responses_db:
-                        if r['company_id'] == comp['id'] and r['cpf_hash'] == hashed_cpf:
-                            cpf_already_exists = True
-                            break
+                    cpf_already_exists = get_local_storage().has_response(comp['id'], hashed_cpf)
 
                 if cpf_already_exists:
                     st.error("🚫 O protocolo de trava antifraude acabou de interceptar este seu botão. Foi visualmente verificado pelo cruzamento mecânico e rastreio inabalável que o seu dado criptografado de hash advindo do CPF se encontra preenchido no nosso acervo base para esta empresa que se faz o link atual. Entenda que, para a garantia vitalícia da solidez sem vícios nos cálculos que compõem estatística corporativa que é repassada para seu líder, somente permite o banco central a inclusão massificada por via restrita do servidor uma única base de respostas originadas a cada vez e em cada avaliação singular para cada funcionário com voz. Não são passíveis submissões adicionais feitas à posteriori que comprometam métricas e gerem anomalias na conta do RH ou da empresa.")
+                elif count_company_responses(comp['id']) >= comp['limit_evals']:
+                    # Contagem atualizada no envio: o descritor em cache pode ter até SURVEY_COMPANY_TTL_SECONDS
+                    st.error("⚠️ Um barramento compulsório ativou este aviso: O limite de vidas populacionais alocadas neste contrato específico na nuvem chegou em seu teto global e bloqueou a transição de mais nenhuma nova requisição e adição.")
                 else:
                     # REGISTRO HISTÓRICO TIMEZONADO PARA EVOLUÇÃO (ESSENCIAL AO GRÁFICO HISTÓRICO E COMPARAÇÃO TEMPORAL MENSAL QUE MOSTRA A A X B DO RELATÓRIO DO ADM)
                     now_str = datetime.datetime.now(datetime.timezone.utc).isoformat()
+                    answers_compact = compact_answers(answers_dict, st.session_state.hse_questions)
                     
                     if DB_CONNECTED:
                         try:
                             # CRIA E IMPÕE ROTINA INSERINDO DIRETO NA ESTRUTURA MAIS PURA A TABELA 'RESPONSES' DA BASE DE DADOS DO SUPER APP SUPABASE. A RESPOSTA ENTRA CEGA (CPF INVERTE E FICA HASH).
-                            supabase.table('responses').insert({
+                            # O AGREGADO (EMPRESA x SETOR x MÊS) É INCREMENTADO NA MESMA TRANSAÇÃO.
+                            submit_survey_response({
                                 "company_id": comp['id'], 
                                 "cpf_hash": hashed_cpf,
                                 "setor": setor_colab, 
-                                "answers": answers_dict, 
+                                "answers": answers_compact, 
                                 "created_at": now_str
-                            }).execute()
+                            }, st.session_state.hse_questions)
                         except Exception as e: 
                             st.error(f"Erro e barramento falho indesejado na conexão exata ou no banco do servidor raiz onde a informação entra no backend em nuvem online processual: {e}")
+                        invalidate_data_cache()
                     else:
-                        st.session_state.local_responses_db.append({
+                        get_local_storage().insert_response({
                             "company_id": comp['id'], 
                             "cpf_hash": hashed_cpf,
                             "setor": setor_colab, 
-                            "answers": answers_dict, 
+                            "answers": answers_compact, 
                             "created_at": now_str
                         })
 
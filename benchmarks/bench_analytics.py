@@ -0,0 +1,182 @@
+"""
+Benchmark do caminho analítico do Elo NR-01.
+
+Mede cada etapa sobre o conjunto sintético determinístico (synthetic_data.py), em tamanhos
+crescentes, e reporta tempo, vazão e pico de memória (tracemalloc) por etapa:
+
+    python benchmarks/bench_analytics.py                      # 1k, 100k e 1M respostas
+    python benchmarks/bench_analytics.py --sizes 1000 20000   # tamanhos customizados
+    python benchmarks/bench_analytics.py --no-memory --json resultado.json
+
+O tempo vem de uma execução sem tracemalloc (que deixa o Python bem mais lento); o pico de
+memória vem de uma segunda execução instrumentada. Use --no-memory para pular a segunda.
+"""
+import argparse
+import datetime
+import gc
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# O app roda em "bare mode" (sem servidor Streamlit): silencia os avisos de contexto
+logging.disable(logging.WARNING)
+import app  # noqa: E402
+from synthetic_data import SyntheticDataset  # noqa: E402
+
+DEFAULT_SIZES = [1_000, 100_000, 1_000_000]
+DOC_REPEAT = 20
+
+
+def stage_ingest(ctx):
+    """Leitura em streaming: páginas no formato do banco -> slim_scored_rows (uma página por vez)."""
+    total = 0
+    for page in ctx["dataset"].pages("compact", app.RESPONSE_PAGE_SIZE):
+        total += len(app.slim_scored_rows(page, ctx["hse"]))
+    return total
+
+
+def stage_scores(ctx):
+    app.calculate_actual_scores(ctx["rows"], ctx["hse"])
+    return len(ctx["rows"])
+
+
+def stage_all_companies(ctx):
+    app.process_all_companies_analytics([dict(c) for c in ctx["dataset"].companies], ctx["rows"], ctx["hse"])
+    return len(ctx["rows"])
+
+
+def stage_company(ctx):
+    ctx["empresa"] = app.process_company_analytics(dict(ctx["largest"]), ctx["largest_rows"], ctx["hse"])
+    return len(ctx["largest_rows"])
+
+
+def stage_history(ctx):
+    app.get_closed_period_cache()["periods"].clear()
+    ctx["history"] = app.generate_real_history(ctx["largest"]["id"], ctx["largest_rows"], ctx["hse"], ctx["largest"]["func"], today=ctx["today"])
+    return len(ctx["largest_rows"])
+
+
+def stage_history_cached(ctx):
+    """Recomputação com os períodos encerrados já em cache (só o mês corrente é somado)."""
+    app.generate_real_history(ctx["largest"]["id"], ctx["largest_rows"], ctx["hse"], ctx["largest"]["func"], today=ctx["today"])
+    return len(ctx["largest_rows"])
+
+
+def stage_aggregates(ctx):
+    app.compute_aggregate_rows(ctx["rows"], ctx["hse"])
+    return len(ctx["rows"])
+
+
+def stage_cube(ctx):
+    cube = app.AnalyticsCube.from_responses(ctx["rows"], ctx["hse"])
+    cube.rollup(("company", "setor"))
+    return len(ctx["rows"])
+
+
+def stage_laudo(ctx):
+    for _ in range(DOC_REPEAT):
+        app.build_laudo_html(ctx["empresa"], ctx["hse"], ctx["acoes"], "Parecer sintético.", "Resp.", "Diretoria", "Avaliador", "RH")
+    return DOC_REPEAT
+
+
+def stage_dossie(ctx):
+    hist = ctx["history"]
+    a, b = (hist[1], hist[0]) if len(hist) > 1 else (hist[0], hist[0])
+    for _ in range(DOC_REPEAT):
+        app.build_dossie_html(ctx["largest"], a["periodo"], b["periodo"], a, b)
+    return DOC_REPEAT
+
+
+# (nome, função, unidade da vazão)
+STAGES = [
+    ("ingest_stream_pages", stage_ingest, "respostas"),
+    ("calculate_actual_scores", stage_scores, "respostas"),
+    ("process_all_companies_analytics", stage_all_companies, "respostas"),
+    ("process_company_analytics", stage_company, "respostas"),
+    ("generate_real_history", stage_history, "respostas"),
+    ("generate_real_history_cached", stage_history_cached, "respostas"),
+    ("compute_aggregate_rows", stage_aggregates, "respostas"),
+    ("analytics_cube_rollup", stage_cube, "respostas"),
+    ("build_laudo_html", stage_laudo, "documentos"),
+    ("build_dossie_html", stage_dossie, "documentos"),
+]
+
+
+def build_context(n_responses, n_companies):
+    hse = app.st.session_state.hse_questions
+    dataset = SyntheticDataset(hse, n_responses, n_companies=n_companies)
+    rows = dataset.rows("slim")
+    app.calculate_actual_scores(rows, hse)
+    largest, _ = dataset.largest_company()
+    largest_rows = [r for r in rows if r["company_id"] == largest["id"]]
+    return {
+        "hse": hse,
+        "dataset": dataset,
+        "rows": rows,
+        "largest": largest,
+        "largest_rows": largest_rows,
+        # Último mês do conjunto sintético ainda "aberto", como em produção
+        "today": datetime.date(2026, 9, 15),
+        "acoes": [{"acao": s["acao"], "estrat": s["estrat"], "area": s["area"], "resp": "RH", "prazo": "30 dias"} for s in app.gerar_banco_sugestoes({})],
+    }
+
+
+def run_stage(fn, ctx, measure_memory):
+    gc.collect()
+    if measure_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    units = fn(ctx)
+    elapsed = time.perf_counter() - started
+    peak = None
+    if measure_memory:
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return units, elapsed, peak
+
+
+def run(sizes, n_companies, measure_memory, only=None):
+    results = []
+    for n in sizes:
+        t0 = time.perf_counter()
+        ctx = build_context(n, n_companies)
+        print(f"\n== {n:,} respostas | {n_companies} empresas | maior empresa: {len(ctx['largest_rows']):,} respostas (dados gerados em {time.perf_counter() - t0:.1f}s)")
+        print(f"{'etapa':34} {'tempo (s)':>10} {'vazão':>22} {'pico (MB)':>10}")
+        for name, fn, unit in STAGES:
+            if only and name not in only:
+                continue
+            units, elapsed, _ = run_stage(fn, ctx, False)
+            peak = run_stage(fn, ctx, True)[2] if measure_memory else None
+            rate = units / elapsed if elapsed else float("inf")
+            results.append({"respostas": n, "etapa": name, "segundos": elapsed, "unidades": units, "unidade": unit, "vazao_por_s": rate, "pico_mb": peak})
+            peak_txt = f"{peak:10.1f}" if peak is not None else f"{'-':>10}"
+            print(f"{name:34} {elapsed:10.3f} {rate:14,.0f} {unit[:4]}/s {peak_txt}")
+        del ctx
+        gc.collect()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do caminho analítico (scores, analítico, histórico, cubo e documentos).")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="quantidades de respostas (padrão: 1k 100k 1M)")
+    parser.add_argument("--companies", type=int, default=200, help="número de empresas sintéticas")
+    parser.add_argument("--stages", nargs="+", help="roda apenas as etapas informadas")
+    parser.add_argument("--no-memory", action="store_true", help="não mede o pico de memória (execução mais rápida)")
+    parser.add_argument("--json", help="grava os resultados neste arquivo JSON")
+    args = parser.parse_args()
+    
+    results = run(args.sizes, args.companies, not args.no_memory, args.stages)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Gerador determinístico de dados sintéticos para benchmarks e testes de carga.
+
+Mesma semente => mesmas empresas e mesmas respostas, em qualquer máquina.
+As respostas seguem distribuições Likert realistas para as 35 perguntas HSE:
+cada pergunta tem uma média própria, cada empresa e cada setor deslocam essa média
+(clima organizacional) e uma pequena fração das perguntas fica sem resposta.
+"""
+import numpy as np
+
+BENCH_SEED = 20261018
+SETORES_PADRAO = ["Administrativo", "Operações", "Comercial", "RH", "TI", "Logística", "Financeiro", "Produção"]
+CNAES_PADRAO = ["86.10-1", "47.11-3", "62.01-5", "49.30-2", "10.91-1", "85.13-9", "64.22-1", "41.20-4"]
+TAXA_SEM_RESPOSTA = 0.01
+
+
+def month_keys(n_months, last_month="2026-09"):
+    """Lista de períodos 'YYYY-MM' terminando em last_month (mais antigo primeiro)."""
+    year, month = (int(p) for p in last_month.split("-"))
+    keys = []
+    for _ in range(n_months):
+        keys.append(f"{year:04d}-{month:02d}")
+        month -= 1
+        if month == 0:
+            year, month = year - 1, 12
+    return keys[::-1]
+
+
+def generate_companies(n_companies, setores=SETORES_PADRAO, seed=BENCH_SEED, owner="admin"):
+    """Empresas com o mesmo formato da tabela companies (org_structure com os setores informados)."""
+    rng = np.random.default_rng(seed)
+    companies = []
+    for i in range(n_companies):
+        n_setores = int(rng.integers(1, len(setores) + 1))
+        setores_empresa = [str(s) for s in rng.choice(setores, size=n_setores, replace=False)]
+        companies.append({
+            "id": f"BENCH{i:05d}",
+            "razao": f"Empresa Sintética {i:05d} Ltda",
+            "cnpj": f"{i:08d}/0001-{i % 100:02d}",
+            "cnae": str(rng.choice(CNAES_PADRAO)),
+            "risco": int(rng.integers(1, 5)),
+            "func": int(rng.integers(20, 2000)),
+            "limit_evals": 999999,
+            "segmentacao": "setor",
+            "resp": "Responsável Sintético",
+            "valid_until": "2030-12-31",
+            "logo_ref": None,
+            "owner": owner,
+            "org_structure": {s: ["Geral"] for s in setores_empresa},
+        })
+    return companies
+
+
+def generate_codes(n_responses, n_questions, setores_por_empresa, n_months, seed=BENCH_SEED):
+    """
+    Núcleo vetorizado do gerador. Devolve:
+      codes   (n x perguntas, uint8): posição Likert 1..5, 0 = sem resposta
+      company (n,): índice da empresa, com tamanhos desiguais (poucas empresas grandes)
+      month   (n,): índice do mês
+      setor   (n,): índice do setor dentro da org_structure da empresa
+      day     (n,): dia do mês (1..28)
+    """
+    rng = np.random.default_rng(seed + 1)
+    n_companies = len(setores_por_empresa)
+    setores_por_empresa = np.asarray(setores_por_empresa)
+    peso_empresa = rng.pareto(1.5, size=n_companies) + 1
+    company = rng.choice(n_companies, size=n_responses, p=peso_empresa / peso_empresa.sum())
+    month = rng.integers(0, n_months, size=n_responses)
+    setor = (rng.random(n_responses) * setores_por_empresa[company]).astype(np.int64)
+    day = rng.integers(1, 29, size=n_responses)
+    
+    media_pergunta = rng.uniform(2.3, 3.9, size=n_questions)
+    clima_empresa = rng.normal(0.0, 0.45, size=n_companies)
+    clima_setor = rng.normal(0.0, 0.25, size=(n_companies, int(setores_por_empresa.max())))
+    deslocamento = clima_empresa[company] + clima_setor[company, setor]
+    
+    latente = media_pergunta[None, :] + deslocamento[:, None] + rng.normal(0.0, 0.95, size=(n_responses, n_questions))
+    codes = np.clip(np.rint(latente), 1, 5).astype(np.uint8)
+    codes[rng.random((n_responses, n_questions)) < TAXA_SEM_RESPOSTA] = 0
+    return codes, company, month, setor, day
+
+
+class SyntheticDataset:
+    """
+    Conjunto sintético completo: empresas + respostas.
+    As linhas podem ser materializadas em três formatos, os mesmos que o app encontra:
+      - "slim": já pontuáveis, com _codes (formato mantido em memória após a sincronização)
+      - "compact": answers {"v": 2, "a": {id: 1..5}} (formato gravado no banco)
+      - "legacy": answers {texto da pergunta: rótulo} (linhas antigas)
+    """
+    def __init__(self, hse_questions, n_responses, n_companies=50, setores=SETORES_PADRAO, n_months=12, seed=BENCH_SEED):
+        self.hse_questions = hse_questions
+        self.questions = [q for qs in hse_questions.values() for q in qs]
+        self.n_responses = n_responses
+        self.companies = generate_companies(n_companies, setores, seed)
+        self.months = month_keys(n_months)
+        self.setores_empresa = [list(c["org_structure"].keys()) for c in self.companies]
+        self.codes, self.company_idx, self.month_idx, self.setor_idx, self.day = generate_codes(
+            n_responses, len(self.questions), [len(s) for s in self.setores_empresa], n_months, seed
+        )
+    
+    def _meta(self, i):
+        ci = int(self.company_idx[i])
+        return {
+            "id": i + 1,
+            "company_id": self.companies[ci]["id"],
+            "cpf_hash": f"bench{i:09d}",
+            "setor": self.setores_empresa[ci][int(self.setor_idx[i])],
+            "created_at": f"{self.months[int(self.month_idx[i])]}-{int(self.day[i]):02d}T12:00:00+00:00",
+        }
+    
+    def _answers(self, i, fmt):
+        row_codes = self.codes[i]
+        if fmt == "compact":
+            return {"v": 2, "a": {str(q["id"]): int(c) for q, c in zip(self.questions, row_codes) if c}}
+        labels = [None, "Nunca", "Raramente", "Às vezes", "Frequentemente", "Sempre"]
+        return {q["q"]: labels[c] for q, c in zip(self.questions, row_codes) if c}
+    
+    def rows(self, fmt="slim", start=0, stop=None):
+        stop = self.n_responses if stop is None else min(stop, self.n_responses)
+        out = []
+        for i in range(start, stop):
+            row = self._meta(i)
+            if fmt == "slim":
+                row["_codes"] = self.codes[i].tobytes()
+            else:
+                row["answers"] = self._answers(i, fmt)
+            out.append(row)
+        return out
+    
+    def pages(self, fmt="compact", page_size=1000):
+        """Páginas no formato do banco, como as devolvidas pelo leitor em streaming (uma por vez)."""
+        for start in range(0, self.n_responses, page_size):
+            yield self.rows(fmt, start, start + page_size)
+    
+    def largest_company(self):
+        counts = np.bincount(self.company_idx, minlength=len(self.companies))
+        return self.companies[int(counts.argmax())], int(counts.max())
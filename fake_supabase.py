@@ -0,0 +1,325 @@
+"""
+Backend Supabase falso, em processo, para benchmarks e testes de carga sem rede.
+
+Implementa a mesma cadeia usada pelo app.py
+(table().select().eq().in_().gte().order().limit().insert().update().upsert().delete().execute()
+e rpc().execute()) sobre tabelas SQLite, em memória (":memory:") ou em arquivo.
+Cada linha é guardada como um documento JSON; os filtros são traduzidos para json_extract,
+com índices de expressão nas colunas mais consultadas.
+
+Cada execute() conta como uma ida ao banco (round trip) e pode receber uma latência
+artificial (latency_ms + jitter_ms aleatório), simulando a rede até o Supabase.
+"""
+import json
+import random
+import sqlite3
+import threading
+import time
+
+# Chave primária de cada tabela (mesmo desenho das tabelas do Supabase)
+TABLE_KEYS = {
+    "companies": ("id",),
+    "responses": ("id",),
+    "admin_users": ("username",),
+    "platform_settings": ("id",),
+    "response_aggregates": ("company_id", "setor", "periodo"),
+    "assets": ("hash",),
+}
+# Tabelas com id numérico gerado pelo banco (identity)
+AUTO_ID_TABLES = {"responses", "platform_settings"}
+# Colunas com índice (as mesmas consultadas pelo app)
+INDEXED_COLUMNS = {
+    "companies": ["owner"],
+    "responses": ["company_id", "created_at", "cpf_hash"],
+    "admin_users": ["linked_company_id"],
+    "response_aggregates": ["company_id"],
+}
+
+
+class FakeAPIError(Exception):
+    """Espelha o postgrest.APIError: o app decide o que fazer pelo atributo `code`."""
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class FakeResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+def column_expr(column):
+    """Traduz a coluna do PostgREST (inclusive caminhos JSON como answers->>v) para json_extract."""
+    path = column.replace("->>", ".").replace("->", ".")
+    return f"json_extract(data, '$.{path}')"
+
+
+class FakeQuery:
+    """Um builder por chamada, acumulando filtros até o execute()."""
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.op = "select"
+        self.columns = "*"
+        self.count = None
+        self.head = False
+        self.payload = None
+        self.on_conflict = None
+        self.filters = []
+        self.params = []
+        self.orders = []
+        self.limit_rows = None
+        self.offset_rows = 0
+
+    # ---- Operações ----
+    def select(self, columns="*", count=None, head=False):
+        self.columns, self.count, self.head = columns, count, head
+        return self
+
+    def insert(self, rows):
+        self.op, self.payload = "insert", rows
+        return self
+
+    def upsert(self, rows, on_conflict=None):
+        self.op, self.payload, self.on_conflict = "upsert", rows, on_conflict
+        return self
+
+    def update(self, values):
+        self.op, self.payload = "update", values
+        return self
+
+    def delete(self):
+        self.op = "delete"
+        return self
+
+    # ---- Filtros ----
+    def _filter(self, column, sql_op, value):
+        self.filters.append(f"{column_expr(column)} {sql_op} ?")
+        self.params.append(value)
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, "=", value)
+
+    def neq(self, column, value):
+        return self._filter(column, "!=", value)
+
+    def gt(self, column, value):
+        return self._filter(column, ">", value)
+
+    def gte(self, column, value):
+        return self._filter(column, ">=", value)
+
+    def lt(self, column, value):
+        return self._filter(column, "<", value)
+
+    def lte(self, column, value):
+        return self._filter(column, "<=", value)
+
+    def in_(self, column, values):
+        values = list(values)
+        if not values:
+            self.filters.append("0")
+            return self
+        self.filters.append(f"{column_expr(column)} IN ({', '.join('?' for _ in values)})")
+        self.params.extend(values)
+        return self
+
+    def is_(self, column, value):
+        literal = {"null": "NULL", None: "NULL", "true": "1", True: "1", "false": "0", False: "0"}[value]
+        self.filters.append(f"{column_expr(column)} IS {literal}")
+        return self
+
+    def order(self, column, desc=False):
+        self.orders.append(f"{column_expr(column)} {'DESC' if desc else 'ASC'}")
+        return self
+
+    def limit(self, n):
+        self.limit_rows = n
+        return self
+
+    def range(self, start, end):
+        self.offset_rows, self.limit_rows = start, end - start + 1
+        return self
+
+    def execute(self):
+        return self.client._execute(self)
+
+
+class FakeRpc:
+    def __init__(self, client, fn, params):
+        self.client = client
+        self.fn = fn
+        self.params = params or {}
+
+    def execute(self):
+        return self.client._execute_rpc(self)
+
+
+class FakeSupabaseClient:
+    """
+    Substituto do cliente supabase-py para rodar o app, benchmarks e testes de carga sem rede.
+    `round_trips` conta os execute() por (tabela, operação); reset_stats() zera a contagem.
+    Funções RPC podem ser registradas com register_rpc(nome, fn(client, params)).
+    """
+    def __init__(self, path=":memory:", latency_ms=0, jitter_ms=0):
+        self.path = path
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.next_ids = {}
+        self.round_trips = {}
+        self.rpcs = {"submit_survey_response": rpc_submit_survey_response}
+        with self.lock, self.conn:
+            for table in TABLE_KEYS:
+                self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (pk TEXT PRIMARY KEY, data TEXT NOT NULL)")
+            for table, cols in INDEXED_COLUMNS.items():
+                for col in cols:
+                    self.conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_{col} ON {table} ({column_expr(col)})")
+            for table in AUTO_ID_TABLES:
+                last = self.conn.execute(f"SELECT MAX({column_expr('id')}) FROM {table}").fetchone()[0]
+                self.next_ids[table] = (last or 0) + 1
+
+    # ---- Interface do supabase-py ----
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def rpc(self, fn, params=None, **kwargs):
+        return FakeRpc(self, fn, params)
+
+    def register_rpc(self, name, fn):
+        self.rpcs[name] = fn
+
+    def reset_stats(self):
+        with self.lock:
+            self.round_trips = {}
+
+    def total_round_trips(self):
+        return sum(self.round_trips.values())
+
+    # ---- Execução ----
+    def _round_trip(self, label):
+        with self.lock:
+            self.round_trips[label] = self.round_trips.get(label, 0) + 1
+        delay = self.latency_ms + (random.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if delay:
+            time.sleep(delay / 1000)
+
+    def _key(self, table, row):
+        return json.dumps([row.get(k) for k in TABLE_KEYS[table]])
+
+    def _where(self, query):
+        return (" WHERE " + " AND ".join(query.filters)) if query.filters else ""
+
+    def _project(self, row, columns):
+        if columns.strip() == "*":
+            return row
+        return {c.strip(): row.get(c.strip()) for c in columns.split(",")}
+
+    def _execute(self, query):
+        if query.table not in TABLE_KEYS:
+            raise FakeAPIError("PGRST205", f"Could not find the table 'public.{query.table}' in the schema cache")
+        self._round_trip(f"{query.table}.{query.op}")
+        with self.lock, self.conn:
+            return getattr(self, f"_op_{query.op}")(query)
+
+    def _op_select(self, query):
+        where = self._where(query)
+        count = None
+        if query.count:
+            count = self.conn.execute(f"SELECT COUNT(*) FROM {query.table}{where}", query.params).fetchone()[0]
+        if query.head:
+            return FakeResponse([], count)
+        sql = f"SELECT data FROM {query.table}{where}"
+        if query.orders:
+            sql += " ORDER BY " + ", ".join(query.orders)
+        if query.limit_rows is not None:
+            sql += f" LIMIT {int(query.limit_rows)} OFFSET {int(query.offset_rows)}"
+        rows = [self._project(json.loads(d), query.columns) for (d,) in self.conn.execute(sql, query.params)]
+        return FakeResponse(rows, count)
+
+    def _new_row(self, table, row):
+        row = dict(row)
+        if table in AUTO_ID_TABLES and row.get("id") is None:
+            row["id"] = self.next_ids[table]
+            self.next_ids[table] += 1
+        return row
+
+    def _op_insert(self, query):
+        rows = query.payload if isinstance(query.payload, list) else [query.payload]
+        inserted = []
+        for row in rows:
+            row = self._new_row(query.table, row)
+            try:
+                self.conn.execute(f"INSERT INTO {query.table} (pk, data) VALUES (?, ?)", (self._key(query.table, row), json.dumps(row)))
+            except sqlite3.IntegrityError:
+                raise FakeAPIError("23505", f"duplicate key value violates unique constraint \"{query.table}_pkey\"")
+            inserted.append(row)
+        return FakeResponse(inserted)
+
+    def _op_upsert(self, query):
+        """Upsert com merge-duplicates: as colunas enviadas sobrescrevem as da linha existente."""
+        rows = query.payload if isinstance(query.payload, list) else [query.payload]
+        written = []
+        for row in rows:
+            row = self._new_row(query.table, row)
+            key = self._key(query.table, row)
+            current = self.conn.execute(f"SELECT data FROM {query.table} WHERE pk = ?", (key,)).fetchone()
+            merged = {**json.loads(current[0]), **row} if current else row
+            self.conn.execute(f"INSERT OR REPLACE INTO {query.table} (pk, data) VALUES (?, ?)", (key, json.dumps(merged)))
+            written.append(merged)
+        return FakeResponse(written)
+
+    def _op_update(self, query):
+        updated = []
+        for pk, data in self.conn.execute(f"SELECT pk, data FROM {query.table}{self._where(query)}", query.params).fetchall():
+            row = {**json.loads(data), **query.payload}
+            self.conn.execute(f"UPDATE {query.table} SET data = ? WHERE pk = ?", (json.dumps(row), pk))
+            updated.append(row)
+        return FakeResponse(updated)
+
+    def _op_delete(self, query):
+        where = self._where(query)
+        deleted = [json.loads(d) for (d,) in self.conn.execute(f"SELECT data FROM {query.table}{where}", query.params)]
+        self.conn.execute(f"DELETE FROM {query.table}{where}", query.params)
+        return FakeResponse(deleted)
+
+    def _execute_rpc(self, rpc):
+        if rpc.fn not in self.rpcs:
+            raise FakeAPIError("PGRST202", f"Could not find the function public.{rpc.fn} in the schema cache")
+        self._round_trip(f"rpc:{rpc.fn}.call")
+        with self.lock, self.conn:
+            return FakeResponse(self.rpcs[rpc.fn](self, rpc.params))
+
+    # ---- Carga de dados ----
+    def seed(self, table, rows):
+        """Carga direta (sem latência nem contagem de round trips), para montar cenários de teste."""
+        with self.lock, self.conn:
+            for row in rows:
+                row = self._new_row(table, row)
+                self.conn.execute(f"INSERT OR REPLACE INTO {table} (pk, data) VALUES (?, ?)", (self._key(table, row), json.dumps(row)))
+
+
+def rpc_submit_survey_response(client, params):
+    """Mesma semântica da função SQL submit_survey_response: resposta + incremento do agregado."""
+    client._op_insert(FakeQuery(client, "responses").insert({
+        "company_id": params["p_company_id"],
+        "cpf_hash": params["p_cpf_hash"],
+        "setor": params["p_setor"],
+        "answers": params["p_answers"],
+        "created_at": params["p_created_at"],
+    }))
+    agg = {"company_id": params["p_company_id"], "setor": params["p_setor"], "periodo": params["p_periodo"]}
+    key = client._key("response_aggregates", agg)
+    current = client.conn.execute("SELECT data FROM response_aggregates WHERE pk = ?", (key,)).fetchone()
+    row = json.loads(current[0]) if current else {**agg, "respondentes": 0, "soma_scores": 0, "somas": {}, "contagens": {}}
+    row["respondentes"] += 1
+    row["soma_scores"] += params["p_score"]
+    for field, delta in (("somas", params["p_somas"]), ("contagens", params["p_contagens"])):
+        for k, v in delta.items():
+            row[field][k] = row[field].get(k, 0) + v
+    client.conn.execute("INSERT OR REPLACE INTO response_aggregates (pk, data) VALUES (?, ?)", (key, json.dumps(row)))
+    return None
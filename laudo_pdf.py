@@ -0,0 +1,369 @@
+"""
+Geração dos documentos oficiais em PDF (Laudo Técnico HSE-IT e Dossiê Técnico Evolutivo).
+
+Funções puras, sem Streamlit: recebem um payload (dict) já montado pelo app.py e devolvem os
+bytes do PDF, então podem rodar numa thread/processo auxiliar. Os gráficos estáticos usam o
+kaleido (plotly -> PNG); se o kaleido não estiver disponível (ex: sem Chrome no servidor), as
+barras são desenhadas diretamente no PDF, sem perder informação.
+"""
+import base64
+import io
+import threading
+
+from fpdf import FPDF, FontFace
+from fpdf.enums import XPos, YPos
+
+# Fontes nativas do PDF (Helvetica) só cobrem latin-1: troca da pontuação tipográfica mais comum
+LATIN1_REPLACEMENTS = {
+    "–": "-", "—": "-", "‘": "'", "’": "'", "“": '"', "”": '"',
+    "…": "...", "•": "-", "·": "-", "≤": "<=", "≥": ">=", "Δ": "Delta",
+}
+CHART_SCALE = 2
+KALEIDO_STATE = {"ok": None, "lock": threading.Lock()}
+
+
+def latin1(text):
+    """Texto seguro para as fontes nativas: pontuação tipográfica trocada e emojis removidos."""
+    text = str(text if text is not None else "")
+    for src, dst in LATIN1_REPLACEMENTS.items():
+        text = text.replace(src, dst)
+    return text.encode("latin-1", "ignore").decode("latin-1")
+
+
+def hex_to_rgb(color):
+    color = color.lstrip("#")
+    return tuple(int(color[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def risk_color(payload, nota):
+    """Mesma régua de cores dos cards do laudo em HTML (nota < 3 crítico, < 4 atenção)."""
+    cores = payload["cores"]
+    return cores["risco_alto"] if nota < 3 else (cores["risco_medio"] if nota < 4 else cores["risco_baixo"])
+
+
+def exposure_color(payload, val):
+    cores = payload["cores"]
+    return cores["risco_alto"] if val >= 50 else (cores["risco_medio"] if val >= 25 else cores["risco_baixo"])
+
+
+def chart_png(fig, width=700, height=420):
+    """
+    Renderiza a figura plotly em PNG com o kaleido. A primeira falha (kaleido ou Chrome ausentes)
+    fica registrada e as chamadas seguintes já devolvem None, sem novas tentativas lentas.
+    """
+    if KALEIDO_STATE["ok"] is False:
+        return None
+    try:
+        png = fig.to_image(format="png", width=width, height=height, scale=CHART_SCALE)
+        KALEIDO_STATE["ok"] = True
+        return png
+    except Exception:
+        with KALEIDO_STATE["lock"]:
+            KALEIDO_STATE["ok"] = False
+        return None
+
+
+def radar_png(series, cores):
+    """Radar das dimensões (uma ou mais séries: [(nome, {dimensão: nota}, cor)])."""
+    import plotly.graph_objects as go
+    fig = go.Figure()
+    for nome, dimensoes, cor in series:
+        fig.add_trace(go.Scatterpolar(r=list(dimensoes.values()), theta=list(dimensoes.keys()), fill="toself", name=nome, line_color=cor, opacity=0.6))
+    fig.update_layout(polar=dict(radialaxis=dict(visible=True, range=[0, 5])), margin=dict(l=60, r=60, t=30, b=30), showlegend=len(series) > 1, paper_bgcolor="white")
+    return chart_png(fig)
+
+
+class ReportPDF(FPDF):
+    """A4 com cabeçalho de marca e rodapé de confidencialidade em todas as páginas."""
+    def __init__(self, payload, titulo):
+        super().__init__(orientation="P", unit="mm", format="A4")
+        self.payload = payload
+        self.titulo = titulo
+        self.set_auto_page_break(auto=True, margin=18)
+        self.set_margins(15, 15, 15)
+
+    def header(self):
+        marca = self.payload["marca"]
+        primaria = hex_to_rgb(self.payload["cores"]["primaria"])
+        logo = decode_logo(marca.get("logo_b64"))
+        if logo:
+            try:
+                self.image(io.BytesIO(logo), x=15, y=10, h=12)
+            except Exception:
+                logo = None
+        self.set_xy(15 if not logo else 50, 10)
+        self.set_font("helvetica", "B", 13)
+        self.set_text_color(*primaria)
+        self.cell(0, 6, latin1(marca.get("nome", "")), align="L" if not logo else "R", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        self.set_font("helvetica", "", 8)
+        self.set_text_color(127, 140, 141)
+        self.cell(0, 5, latin1(self.titulo), align="L" if not logo else "R", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        self.set_draw_color(*primaria)
+        self.set_line_width(0.6)
+        self.line(15, 25, 195, 25)
+        self.set_y(30)
+
+    def footer(self):
+        self.set_y(-13)
+        self.set_font("helvetica", "", 7)
+        self.set_text_color(149, 165, 166)
+        marca = self.payload["marca"]
+        self.cell(0, 4, latin1(f"{marca.get('nome', '')} | {marca.get('consultoria', '')} | Documento confidencial (LGPD - Lei nº 13.709/2018)"), align="L")
+        self.cell(0, 4, f"{self.page_no()}/{{nb}}", align="R")
+
+    # ---- Blocos reutilizáveis ----
+    def section(self, text):
+        if self.get_y() > 260:
+            self.add_page()
+        self.ln(4)
+        primaria = hex_to_rgb(self.payload["cores"]["primaria"])
+        self.set_fill_color(*hex_to_rgb(self.payload["cores"]["secundaria"]))
+        self.rect(15, self.get_y(), 1.5, 6, style="F")
+        self.set_x(19)
+        self.set_font("helvetica", "B", 10)
+        self.set_text_color(*primaria)
+        self.cell(0, 6, latin1(text.upper()), new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        self.ln(2)
+        self.set_text_color(44, 62, 80)
+
+    def paragraph(self, text, size=9, style=""):
+        self.set_font("helvetica", style, size)
+        self.set_text_color(68, 68, 68)
+        self.multi_cell(0, 4.6, latin1(text), new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        self.ln(1)
+
+    def info_box(self, pares):
+        """Caixa com pares (rótulo, valor) em duas colunas."""
+        self.set_fill_color(248, 251, 252)
+        y0 = self.get_y()
+        linhas = (len(pares) + 1) // 2
+        self.rect(15, y0, 180, linhas * 6 + 4, style="F")
+        self.set_fill_color(*hex_to_rgb(self.payload["cores"]["secundaria"]))
+        self.rect(15, y0, 1.2, linhas * 6 + 4, style="F")
+        for i, (rotulo, valor) in enumerate(pares):
+            self.set_xy(19 + (i % 2) * 90, y0 + 2 + (i // 2) * 6)
+            self.set_font("helvetica", "B", 8)
+            self.set_text_color(52, 73, 94)
+            self.cell(32, 6, latin1(rotulo))
+            self.set_font("helvetica", "", 8)
+            self.set_text_color(127, 140, 141)
+            self.cell(54, 6, latin1(valor)[:48])
+        self.set_xy(15, y0 + linhas * 6 + 6)
+
+    def bar(self, label, value, max_value, color, text, label_w=95, bar_w=60):
+        """Linha com rótulo, barra proporcional e valor, desenhada com primitivas do PDF."""
+        if self.get_y() > 270:
+            self.add_page()
+        y = self.get_y()
+        self.set_font("helvetica", "", 7.5)
+        self.set_text_color(68, 68, 68)
+        rotulo = latin1(label)
+        while self.get_string_width(rotulo) > label_w - 2 and len(rotulo) > 4:
+            rotulo = rotulo[:-4] + "..."
+        self.cell(label_w, 5, rotulo)
+        self.set_fill_color(240, 240, 240)
+        self.rect(15 + label_w, y + 1.5, bar_w, 2.4, style="F")
+        if max_value and value:
+            self.set_fill_color(*hex_to_rgb(color))
+            self.rect(15 + label_w, y + 1.5, bar_w * min(value, max_value) / max_value, 2.4, style="F")
+        self.set_x(15 + label_w + bar_w + 3)
+        self.set_font("helvetica", "B", 7.5)
+        self.set_text_color(*hex_to_rgb(color))
+        self.cell(0, 5, latin1(text), new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+
+    def data_table(self, headings, rows, col_widths, first_col_left=True):
+        primaria = hex_to_rgb(self.payload["cores"]["primaria"])
+        self.set_font("helvetica", "", 7.5)
+        self.set_text_color(52, 73, 94)
+        with self.table(
+            col_widths=col_widths, text_align=["LEFT" if first_col_left else "CENTER"] + ["CENTER"] * (len(headings) - 1),
+            headings_style=FontFace(emphasis="BOLD", color=(255, 255, 255), fill_color=primaria),
+            line_height=4.6, borders_layout="HORIZONTAL_LINES", cell_fill_color=(250, 251, 252), cell_fill_mode="ROWS",
+        ) as table:
+            head = table.row()
+            for h in headings:
+                head.cell(latin1(h))
+            for r in rows:
+                row = table.row()
+                for value in r:
+                    row.cell(latin1(value))
+        self.ln(2)
+
+    def image_png(self, png, w=120):
+        if self.get_y() > 190:
+            self.add_page()
+        self.image(io.BytesIO(png), x=(210 - w) / 2, w=w)
+        self.ln(2)
+
+
+def decode_logo(logo_b64):
+    """Logo da marca (base64 de PNG/JPG) em bytes; None se ausente ou inválida."""
+    if not logo_b64:
+        return None
+    try:
+        return base64.b64decode(logo_b64)
+    except Exception:
+        return None
+
+
+def build_laudo_pdf(payload):
+    """
+    Laudo Técnico HSE-IT em PDF. Chaves do payload: empresa (dados cadastrais e analíticos),
+    perguntas ({dimensão: [textos]}), acoes, analise, assinaturas, benchmark, marca e cores.
+    """
+    emp = payload["empresa"]
+    cores = payload["cores"]
+    pdf = ReportPDF(payload, "Laudo Técnico de Avaliação de Riscos Psicossociais (NR-01 / HSE-IT)")
+    pdf.alias_nb_pages()
+    pdf.add_page()
+
+    pdf.set_font("helvetica", "B", 15)
+    pdf.set_text_color(*hex_to_rgb(cores["primaria"]))
+    pdf.cell(0, 8, latin1(emp.get("razao", "")), new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.ln(1)
+    adesao = int((emp.get("respondidas", 0) / emp["func"]) * 100) if emp.get("func") else 0
+    pdf.info_box([
+        ("CNPJ", emp.get("cnpj") or "-"), ("CNAE", emp.get("cnae") or "-"),
+        ("Grau de Risco", str(emp.get("risco") or "-")), ("Vidas", str(emp.get("func") or "-")),
+        ("Respondentes", str(emp.get("respondidas", 0))), ("Adesão", f"{adesao}%"),
+        ("Emissão", payload.get("data_emissao", "")), ("Consultoria", payload["marca"].get("consultoria", "")),
+    ])
+
+    pdf.section("1. Objetivo e metodologia")
+    pdf.paragraph("Este laudo apresenta a avaliação dos fatores de riscos psicossociais relacionados ao trabalho, conforme o Gerenciamento de Riscos Ocupacionais (GRO) da NR-01, com base no instrumento HSE Management Standards Indicator Tool (HSE-IT). As notas vão de 1 (cenário crítico) a 5 (ambiente seguro); as perguntas negativas têm a escala invertida.")
+
+    pdf.section("2. Score geral e dimensões avaliadas")
+    score = float(emp.get("score") or 0)
+    pdf.bar("Score Geral da Organização", score, 5, cores["primaria"], f"{score:.2f} / 5.00", label_w=60, bar_w=95)
+    pdf.ln(2)
+    dimensoes = emp.get("dimensoes") or {}
+    png = radar_png([(emp.get("razao", ""), dimensoes, cores["primaria"])], cores) if dimensoes else None
+    if png:
+        pdf.image_png(png, w=110)
+    for dim, nota in dimensoes.items():
+        status = "CENÁRIO CRÍTICO" if nota < 3 else ("MOMENTO DE ATENÇÃO" if nota < 4 else "AMBIENTE SEGURO")
+        pdf.bar(dim, nota, 5, risk_color(payload, nota), f"{nota:.1f}  {status}", label_w=60, bar_w=80)
+
+    benchmark = payload.get("benchmark")
+    if benchmark:
+        pdf.section(f"2.1 Posicionamento frente ao setor ({benchmark['grupo']})")
+        pdf.paragraph(f"Comparação anônima com {benchmark['empresas']} organizações do mesmo grupo de referência. O percentil indica a parcela de empresas do grupo com nota igual ou inferior (quanto maior, melhor).", size=8, style="I")
+        pdf.data_table(
+            ["Indicador", "Nota da Empresa", "Mediana do Setor", "Percentil"],
+            [[u["unidade"], f"{u['valor']:.1f}", f"{u['mediana']:.1f}", f"{u['percentil']}º"] for u in benchmark["unidades"] if u["tipo"] != "pergunta"],
+            (70, 36, 36, 38),
+        )
+
+    pdf.section("3. Raio-X dos fatores de risco avaliados")
+    pdf.paragraph("As barras representam o grau de exposição do grupo avaliado em cada afirmação (0% = nenhuma exposição, 100% = exposição máxima).", size=8, style="I")
+    detalhe = emp.get("detalhe_perguntas") or {}
+    for cat, perguntas in payload["perguntas"].items():
+        if pdf.get_y() > 262:
+            pdf.add_page()
+        pdf.set_font("helvetica", "B", 8.5)
+        pdf.set_text_color(*hex_to_rgb(cores["primaria"]))
+        pdf.cell(0, 6, latin1(cat.upper()), new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        for q in perguntas:
+            val = detalhe.get(q)
+            if val is None:
+                pdf.bar(q, 0, 100, "#cccccc", "Sem respostas")
+            else:
+                pdf.bar(q, val, 100, exposure_color(payload, val), f"{val}% exposição")
+
+    pdf.section("4. Parecer técnico conclusivo")
+    pdf.paragraph(payload.get("analise", ""))
+
+    pdf.section("5. Plano de ação estratégico (GRO)")
+    acoes = payload.get("acoes") or []
+    if acoes:
+        pdf.data_table(
+            ["Ação", "Estratégia", "Área", "Responsável", "Prazo"],
+            [[a.get("acao", ""), a.get("estrat", ""), a.get("area", ""), a.get("resp", ""), a.get("prazo", "")] for a in acoes],
+            (35, 70, 22, 28, 25),
+        )
+    else:
+        pdf.paragraph("Matriz de ações não preenchida pelo corpo técnico.", size=8, style="I")
+
+    assinaturas = payload.get("assinaturas") or {}
+    if pdf.get_y() > 240:
+        pdf.add_page()
+    pdf.ln(16)
+    y = pdf.get_y()
+    pdf.set_draw_color(120, 120, 120)
+    pdf.set_line_width(0.2)
+    for i, (nome, cargo) in enumerate([(assinaturas.get("empresa_nome", ""), assinaturas.get("empresa_cargo", "")), (assinaturas.get("tecnico_nome", ""), assinaturas.get("tecnico_cargo", ""))]):
+        x = 20 + i * 95
+        pdf.line(x, y, x + 75, y)
+        pdf.set_xy(x, y + 1)
+        pdf.set_font("helvetica", "B", 8)
+        pdf.set_text_color(44, 62, 80)
+        pdf.cell(75, 4.5, latin1(nome), align="C", new_x=XPos.LEFT, new_y=YPos.NEXT)
+        pdf.set_font("helvetica", "", 7.5)
+        pdf.set_text_color(127, 140, 141)
+        pdf.cell(75, 4.5, latin1(cargo), align="C")
+    return bytes(pdf.output())
+
+
+def build_dossie_pdf(payload):
+    """
+    Dossiê Técnico Evolutivo em PDF (Período A x Período B). Chaves do payload: empresa,
+    periodo_a, periodo_b, dados_a, dados_b, texto_evolucao, significancia, marca e cores.
+    """
+    emp = payload["empresa"]
+    cores = payload["cores"]
+    a, b = payload["dados_a"], payload["dados_b"]
+    periodo_a, periodo_b = payload["periodo_a"], payload["periodo_b"]
+    pdf = ReportPDF(payload, "Dossiê Técnico Evolutivo - Análise Comparativa Temporal")
+    pdf.alias_nb_pages()
+    pdf.add_page()
+
+    pdf.set_font("helvetica", "B", 15)
+    pdf.set_text_color(*hex_to_rgb(cores["primaria"]))
+    pdf.cell(0, 8, latin1(emp.get("razao", "")), new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.ln(1)
+    pdf.info_box([("CNPJ", emp.get("cnpj") or "-"), ("Emissão", payload.get("data_emissao", "")), ("Período A", periodo_a), ("Período B", periodo_b)])
+
+    pdf.section("1. Indicadores-chave")
+    diff_score = b["score"] - a["score"]
+    pdf.data_table(
+        ["Indicador", f"Período A [{periodo_a}]", f"Período B [{periodo_b}]", "Variação"],
+        [
+            ["Score Geral da Organização", f"{a['score']}", f"{b['score']}", f"{diff_score:+.2f} pts"],
+            ["Taxa de Adesão (%)", f"{a['adesao']}%", f"{b['adesao']}%", f"{(b['adesao'] - a['adesao']):+.1f}%"],
+        ],
+        (64, 40, 40, 36),
+    )
+    pdf.bar(f"Score [{periodo_a}]", a["score"], 5, cores["comp_a"], f"{a['score']} / 5.0", label_w=60, bar_w=95)
+    pdf.bar(f"Score [{periodo_b}]", b["score"], 5, cores["comp_b"], f"{b['score']} / 5.0", label_w=60, bar_w=95)
+
+    pdf.section("2. Dimensões: Período A x Período B")
+    png = radar_png([(periodo_a, a.get("dimensoes") or {}, cores["comp_a"]), (periodo_b, b.get("dimensoes") or {}, cores["comp_b"])], cores)
+    if png:
+        pdf.image_png(png, w=110)
+    pdf.data_table(
+        ["Dimensão", f"[{periodo_a}]", f"[{periodo_b}]", "Variação"],
+        [[dim, f"{nota:.1f}", f"{(b.get('dimensoes') or {}).get(dim, 0):.1f}", f"{(b.get('dimensoes') or {}).get(dim, 0) - nota:+.1f}"] for dim, nota in (a.get("dimensoes") or {}).items()],
+        (64, 40, 40, 36),
+    )
+
+    significancia = payload.get("significancia")
+    if significancia:
+        pdf.section("3. Significância estatística das variações (IC 95%)")
+        pdf.data_table(
+            ["Indicador", "A [IC 95%]", "B [IC 95%]", "Variação [IC 95%]", "p-valor", "Conclusão"],
+            [[r["Indicador"], r["Período A"], r["Período B"], r["Variação (B - A)"], r["p-valor"], r["Conclusão"]] for r in significancia],
+            (30, 30, 30, 34, 16, 40),
+        )
+        pdf.paragraph(payload.get("nota_significancia", ""), size=7.5, style="I")
+
+    pdf.section("4. Análise técnica dos resultados")
+    pdf.paragraph(f"A comparação entre os dois recortes delimitados demonstra {payload.get('texto_evolucao', '')} nos índices gerais de saúde mental e gestão de pressões internas da organização. Recomenda-se manter os protocolos protetivos vigentes e seguir a execução do Plano de Ação Estratégico, com foco prioritário nas dimensões que não apresentaram evolução positiva no último ciclo.")
+    return bytes(pdf.output())
+
+
+# Geradores disponíveis por tipo de documento
+PDF_BUILDERS = {"laudo": build_laudo_pdf, "dossie": build_dossie_pdf}
+
+
+def render_report_pdf(kind, payload):
+    return PDF_BUILDERS[kind](payload)
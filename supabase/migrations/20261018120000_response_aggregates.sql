@@ -0,0 +1,81 @@
+-- ==============================================================================
+-- AGREGADOS PRÉ-CALCULADOS DAS RESPOSTAS (EMPRESA x SETOR x MÊS)
+-- ==============================================================================
+-- Uma linha por (empresa, setor, período 'YYYY-MM'). As chaves de `somas` e
+-- `contagens` são os ids das perguntas HSE; os valores já chegam com a inversão
+-- das perguntas negativas (rev) aplicada pelo app, na escala 1..5.
+-- `soma_scores` acumula o score individual de cada respondente (score_calculado).
+
+create table if not exists public.response_aggregates (
+    company_id   text        not null,
+    setor        text        not null,
+    periodo      text        not null,
+    respondentes integer     not null default 0,
+    soma_scores  numeric     not null default 0,
+    somas        jsonb       not null default '{}'::jsonb,
+    contagens    jsonb       not null default '{}'::jsonb,
+    updated_at   timestamptz not null default now(),
+    primary key (company_id, setor, periodo)
+);
+
+-- Soma chave a chave de dois objetos jsonb numéricos
+create or replace function public.jsonb_sum_merge(a jsonb, b jsonb)
+returns jsonb
+language sql
+immutable
+as $$
+    select coalesce(
+        jsonb_object_agg(k, coalesce((a ->> k)::numeric, 0) + coalesce((b ->> k)::numeric, 0)),
+        '{}'::jsonb
+    )
+    from jsonb_object_keys(coalesce(a, '{}'::jsonb) || coalesce(b, '{}'::jsonb)) as k
+$$;
+
+-- Incremento atômico de um respondente no agregado (upsert com trava de linha)
+create or replace function public.increment_response_aggregate(
+    p_company_id text,
+    p_setor      text,
+    p_periodo    text,
+    p_somas      jsonb,
+    p_contagens  jsonb,
+    p_score      numeric
+)
+returns void
+language plpgsql
+as $$
+begin
+    insert into public.response_aggregates as ra
+        (company_id, setor, periodo, respondentes, soma_scores, somas, contagens)
+    values
+        (p_company_id, p_setor, p_periodo, 1, p_score, p_somas, p_contagens)
+    on conflict (company_id, setor, periodo) do update set
+        respondentes = ra.respondentes + 1,
+        soma_scores  = ra.soma_scores + excluded.soma_scores,
+        somas        = public.jsonb_sum_merge(ra.somas, excluded.somas),
+        contagens    = public.jsonb_sum_merge(ra.contagens, excluded.contagens),
+        updated_at   = now();
+end
+$$;
+
+-- Gravação da resposta e do agregado na mesma transação (chamada pelo survey_screen)
+create or replace function public.submit_survey_response(
+    p_company_id text,
+    p_cpf_hash   text,
+    p_setor      text,
+    p_answers    jsonb,
+    p_created_at timestamptz,
+    p_periodo    text,
+    p_somas      jsonb,
+    p_contagens  jsonb,
+    p_score      numeric
+)
+returns void
+language plpgsql
+as $$
+begin
+    insert into public.responses (company_id, cpf_hash, setor, answers, created_at)
+    values (p_company_id, p_cpf_hash, p_setor, p_answers, p_created_at);
+
+    perform public.increment_response_aggregate(p_company_id, p_setor, p_periodo, p_somas, p_contagens, p_score);
+end
+$$;
@@ -0,0 +1,23 @@
+-- ==============================================================================
+-- REPOSITÓRIO DE ATIVOS (LOGOS) ENDEREÇADO POR CONTEÚDO
+-- ==============================================================================
+-- Uma linha por imagem, com o sha256 dos bytes (já reduzidos e recomprimidos pelo
+-- app no upload) como chave: o mesmo arquivo enviado duas vezes ocupa uma linha só.
+-- `data` guarda os bytes em base64. Empresas e a configuração da plataforma passam
+-- a guardar apenas a referência (companies.logo_ref / config_json.logo_ref).
+
+create table if not exists public.assets (
+    hash       text        primary key,
+    mime       text        not null,
+    width      integer,
+    height     integer,
+    data       text        not null,
+    created_at timestamptz not null default now()
+);
+
+alter table public.companies add column if not exists logo_ref text;
+
+-- A coluna companies.logo_b64 continua existindo para a migração dos logos já
+-- gravados (Configurações > "Migrar Logos para o Repositório de Ativos"). Depois
+-- de migrar, ela pode ser removida:
+--   alter table public.companies drop column logo_b64;